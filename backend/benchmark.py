@@ -0,0 +1,797 @@
+"""
+Benchmark and load test for the /api endpoints.
+
+Builds a synthetic database at a multiple of the row counts in
+table_meta.json, replays a mix of dashboard requests against the app, and
+reports p50/p95/p99 latency, throughput and peak RSS per endpoint. The app
+runs either in-process (requests go straight to the ASGI app, no sockets)
+or under a local uvicorn, which adds HTTP parsing and the event loop hop.
+
+    python benchmark.py build --scale 10
+    python benchmark.py run --scale 10 --mode uvicorn --concurrency 8 --save before.json
+    python benchmark.py run --scale 10 --mode uvicorn --concurrency 8 --baseline before.json
+
+The synthetic data keeps the shape of the real workbook: studies own their
+arm sizes and comparator, antibodies own their target, format and MOA
+across every table, each AE term belongs to one organ system, and value
+frequencies are Zipf-skewed so a few antibodies, studies and terms hold
+most rows. The request mix is generated from the built database with a
+fixed seed, so two runs against the same build replay the same requests;
+--workload replays a recorded JSON-lines file instead (one
+{"name", "method", "path", "body"} object per line, as --save-workload
+writes).
+"""
+import argparse
+import asyncio
+import bisect
+import http.client
+import json
+import os
+import platform
+import random
+import socket
+import sqlite3
+import subprocess
+import sys
+import threading
+import time
+import urllib.parse
+import zlib
+
+import numpy as np
+import pandas as pd
+
+from ingest import (
+    BUILD_KEY, META_PATH, SHEETS, assign_antibody_ids, build_antibody_dim, build_derived,
+    build_hash, coerce_types, insert_rows, record_state,
+)
+from schema import COLUMN_TYPES, FILTERABLE_COLUMNS, table_type
+
+BENCH_DIR = os.path.join(os.path.dirname(__file__), "bench")
+CHUNK_ROWS = 100_000
+
+# Distinct values per text column at 1x. Identifiers in GROWING scale with
+# the row count and antibodies with its square root; vocabularies (organ
+# systems, phases, formats) keep their size at every scale.
+CARDINALITY = {
+    "antibody": 400, "nct_id": 2400, "study": 650, "condition": 600, "mesh_class": 40,
+    "adverse_event_term": 3000, "event_type": 2, "phase": 7, "source": 1,
+    "target_1": 180, "target_2": 60, "target_id": 180, "target_harmonized_new": 150, "target_supercluster": 25,
+    "moa": 80, "moa_new": 40, "moa_category": 12, "general_molecular_category": 8,
+    "format_general_category": 10, "format_details": 60, "isotype_fc": 12, "light_chain_isotype": 3,
+    "record_category": 6, "comp_name": 150, "combination": 120, "arm_ab_filled": 900, "arm_comp_filled": 300,
+    "heavy_chain": 10, "gene": 20, "species": 5, "effect": 40, "imgt_nomenclature": 60,
+    "imgt_numbering": 120, "eu_numbering": 120, "reference": 150,
+}
+DEFAULT_CARDINALITY = 12
+GROWING = {"nct_id", "study", "arm_ab_filled", "arm_comp_filled", "reference"}
+ZIPF_S = 1.1
+
+ORGAN_SYSTEMS = [
+    "Blood and lymphatic system disorders", "Cardiac disorders", "Congenital, familial and genetic disorders",
+    "Ear and labyrinth disorders", "Endocrine disorders", "Eye disorders", "Gastrointestinal disorders",
+    "General disorders and administration site conditions", "Hepatobiliary disorders",
+    "Immune system disorders", "Infections and infestations", "Injury, poisoning and procedural complications",
+    "Investigations", "Metabolism and nutrition disorders", "Musculoskeletal and connective tissue disorders",
+    "Neoplasms benign, malignant and unspecified (incl cysts and polyps)", "Nervous system disorders",
+    "Pregnancy, puerperium and perinatal conditions", "Product issues", "Psychiatric disorders",
+    "Renal and urinary disorders", "Reproductive system and breast disorders",
+    "Respiratory, thoracic and mediastinal disorders", "Skin and subcutaneous tissue disorders",
+    "Social circumstances", "Surgical and medical procedures", "Vascular disorders",
+]
+VOCABULARIES = {
+    "organ_system": ORGAN_SYSTEMS,
+    "phase": ["Phase 1", "Phase 2", "Phase 3", "Phase 1/Phase 2", "Phase 2/Phase 3", "Phase 4", "Early Phase 1"],
+    "event_type": ["other", "serious"],
+    "bbw": ["No", "Yes"],
+    "wap": ["No", "Yes"],
+}
+SOURCES = {"ctgov": "CTGOV", "label": "FDA", "fc_mutations": "Fc"}
+
+# The record a row belongs to: its columns are drawn once per study or label
+UNIT_COLUMN = {"ctgov": "nct_id", "label": "study"}
+STUDY_COLUMNS = {
+    "nct_id", "study", "duration", "condition", "mesh_class", "phase", "source", "arm_ab_filled",
+    "arm_comp_filled", "has_comparator", "is_single_arm", "is_monotherapy", "combo", "combination",
+    "dose_mg", "dose_mg_kg", "dose_mg_m2", "frequency_days", "median_duration_days", "comp_name",
+}
+ROW_COLUMNS = {
+    "adverse_event_term", "organ_system", "event_type", "bbw", "wap", "heavy_chain", "id", "gene", "species",
+    "imgt_nomenclature", "imgt_numbering", "eu_numbering", "effect", "reference", "column1", *COLUMN_TYPES,
+}
+# Numeric columns outside COLUMN_TYPES (the workbook has them as numbers)
+NUMERIC_COLUMNS = {
+    "duration", "dose_mg", "dose_mg_kg", "dose_mg_m2", "frequency_days", "median_duration_days",
+    "fab_number", "ave__dar", "id",
+}
+FLAG_COLUMNS = {"has_comparator", "is_single_arm", "is_monotherapy"}
+NULL_RATE = 0.04
+
+
+def zipf_weights(n: int) -> np.ndarray:
+    w = 1.0 / np.arange(1, n + 1) ** ZIPF_S
+    return w / w.sum()
+
+
+def cardinality(col: str, scale: int) -> int:
+    n = CARDINALITY.get(col, DEFAULT_CARDINALITY)
+    if col in GROWING:
+        return n * scale
+    if col == "antibody":
+        return int(n * scale ** 0.5)
+    return n
+
+
+def antibody_name(i: int) -> str:
+    consonants, vowels = "bcdfghklmnprstvz", "aeiou"
+    syllables = []
+    i += len(consonants) * len(vowels)
+    while i:
+        i, r = divmod(i, len(consonants) * len(vowels))
+        syllables.append(consonants[r // len(vowels)] + vowels[r % len(vowels)])
+    return "".join(reversed(syllables)) + "mab"
+
+
+def text_values(col: str, n: int) -> list:
+    if col in VOCABULARIES:
+        return VOCABULARIES[col]
+    if col == "nct_id":
+        return [f"NCT{i + 1:08d}" for i in range(n)]
+    return [f"{col.replace('_', ' ').capitalize()} {i + 1}" for i in range(n)]
+
+
+def decode(values: list, codes: np.ndarray) -> np.ndarray:
+    """Values for codes, None where the code is -1"""
+    return np.array(list(values) + [None], dtype=object)[codes]
+
+
+class Vocabulary:
+    """Antibodies and their attributes, shared by every table so they agree across datasets"""
+
+    def __init__(self, scale: int, seed: int):
+        self.scale = scale
+        self.seed = seed
+        self.n_antibodies = cardinality("antibody", scale)
+        self.antibodies = [antibody_name(i) for i in range(self.n_antibodies)]
+        self.attributes = {}
+
+    def rng(self, *keys) -> np.random.Generator:
+        return np.random.default_rng([self.seed, *(zlib.crc32(k.encode()) for k in keys)])
+
+    def antibody_attribute(self, col: str) -> np.ndarray:
+        """Per-antibody values of an antibody-level column"""
+        if col not in self.attributes:
+            rng = self.rng("antibody", col)
+            n = self.n_antibodies
+            if col == "antibody_clean":
+                values = np.array([name.capitalize() for name in self.antibodies], dtype=object)
+            elif col == "fab_number":
+                values = rng.integers(1, 4, n).astype(np.float64)
+            elif col == "ave__dar":
+                values = np.where(rng.random(n) < 0.1, np.round(rng.uniform(2, 8, n), 1), np.nan)
+            else:
+                k = cardinality(col, self.scale)
+                values = decode(text_values(col, k), rng.choice(k, n, p=zipf_weights(k)))
+            if values.dtype == object:
+                values[rng.random(n) < NULL_RATE] = None
+            self.attributes[col] = values
+        return self.attributes[col]
+
+
+def study_columns(columns: list, tt: str, n_units: int, vocab: Vocabulary, rng) -> dict:
+    """Per-study arrays: arm sizes, comparator and the study-level columns"""
+    n_ab = np.floor(rng.lognormal(4.5, 1.0, n_units)) + 1
+    has_comp = rng.random(n_units) < 0.55
+    n_comp = np.where(has_comp, np.floor(rng.lognormal(4.3, 1.0, n_units)) + 1, np.nan)
+    study = {"_antibody": rng.choice(vocab.n_antibodies, n_units, p=zipf_weights(vocab.n_antibodies)),
+             "_n_ab": n_ab, "_n_comp": n_comp, "_has_comp": has_comp}
+    for col in columns:
+        base = col[:-2] if col.endswith("_1") and col[:-2] in columns else col
+        if base not in STUDY_COLUMNS:
+            continue
+        if base == UNIT_COLUMN.get(tt):
+            study[col] = np.array(text_values(base, n_units), dtype=object)
+        elif base == "source":
+            study[col] = np.full(n_units, SOURCES[tt], dtype=object)
+        elif base in FLAG_COLUMNS:
+            study[col] = {"has_comparator": has_comp, "is_single_arm": ~has_comp,
+                          "is_monotherapy": rng.random(n_units) < 0.6}[base]
+        elif base in NUMERIC_COLUMNS:
+            study[col] = np.where(rng.random(n_units) < NULL_RATE, np.nan, np.round(rng.lognormal(4, 1, n_units), 1))
+        else:
+            k = cardinality(base, vocab.scale)
+            codes = rng.choice(k, n_units, p=zipf_weights(k))
+            codes[rng.random(n_units) < NULL_RATE] = -1
+            study[col] = decode(text_values(base, k), codes)
+    return study
+
+
+def row_columns(columns: list, n: int, units: np.ndarray, study: dict, vocab: Vocabulary, rng,
+                term_organ: np.ndarray) -> dict:
+    """Per-row columns: AE term and organ system, event counts and incidence"""
+    out = {}
+    n_ab = study["_n_ab"][units]
+    n_comp = study["_n_comp"][units]
+    rate = rng.beta(0.6, 6.0, n)
+    comp_rate = np.clip(rate * rng.lognormal(-0.1, 0.4, n), 0, 1)
+    events_ab = rng.binomial(n_ab.astype(np.int64), rate).astype(np.float64)
+    events_comp = np.where(np.isnan(n_comp), np.nan,
+                           rng.binomial(np.nan_to_num(n_comp).astype(np.int64), comp_rate))
+    events_ab[rng.random(n) < 0.02] = np.nan
+    n_terms = len(term_organ)
+    terms = rng.choice(n_terms, n, p=zipf_weights(n_terms))
+
+    pct = {"": np.round(rate * 100, 1)}
+    pct["grade_3_4"] = np.round(pct[""] * rng.beta(1, 4, n), 1)
+    pct["grade_5"] = np.round(pct["grade_3_4"] * rng.beta(0.5, 10, n), 1)
+    comp_pct = {k: np.where(np.isnan(n_comp), np.nan, np.round(v * comp_rate / np.maximum(rate, 1e-9), 1))
+                for k, v in pct.items()}
+    for col in columns:
+        if col == "adverse_event_term":
+            out[col] = decode(text_values(col, n_terms), terms)
+        elif col == "organ_system":
+            out[col] = decode(ORGAN_SYSTEMS, term_organ[terms])
+        elif col == "events_ab":
+            out[col] = events_ab
+        elif col == "events_comp":
+            out[col] = events_comp
+        elif col == "n_ab":
+            out[col] = n_ab
+        elif col == "n_comp":
+            out[col] = n_comp
+        elif col == "id":
+            out[col] = np.arange(n, dtype=np.float64)
+        elif col.endswith(("%", "n")) and col in COLUMN_TYPES:
+            comp = col.startswith("comp_")
+            grade = col[len("comp_") if comp else 0:-1].removeprefix("all_grades").strip("_")
+            values = (comp_pct if comp else pct)[grade]
+            if col.endswith("n"):
+                values = np.round(values * (n_comp if comp else n_ab) / 100)
+            out[col] = values
+        elif col in ROW_COLUMNS and col not in COLUMN_TYPES:
+            k = cardinality(col, vocab.scale)
+            values = VOCABULARIES.get(col) or text_values(col, k)
+            out[col] = decode(values, rng.choice(len(values), n, p=zipf_weights(len(values))))
+    return out
+
+
+def synthetic_chunks(table: str, columns: list, rows: int, vocab: Vocabulary):
+    """DataFrames of CHUNK_ROWS rows with the table's columns, grouped by study like the workbook"""
+    tt = table_type(table)
+    rng = vocab.rng("table", table)
+    unit_col = UNIT_COLUMN.get(tt)
+    n_units = cardinality(unit_col, vocab.scale) if unit_col in columns else rows
+    # Rows per study are Zipf-skewed too; sorting keeps a study's rows together
+    units = np.sort(rng.choice(n_units, rows, p=zipf_weights(n_units))) if unit_col in columns else np.arange(rows)
+    study = study_columns(columns, tt, n_units, vocab, rng)
+    term_organ = rng.choice(len(ORGAN_SYSTEMS), cardinality("adverse_event_term", vocab.scale),
+                            p=zipf_weights(len(ORGAN_SYSTEMS)))
+    # Labels spell names capitalized, CTGOV lower case with the odd upper-case
+    # entry, so antibody_dim sees the aliases the real data has
+    names = np.array([n.capitalize() if tt == "label" else n for n in vocab.antibodies], dtype=object)
+
+    for start in range(0, rows, CHUNK_ROWS):
+        u = units[start:start + CHUNK_ROWS]
+        n = len(u)
+        ab = study["_antibody"][u]
+        data = row_columns(columns, n, u, study, vocab, rng, term_organ)
+        for col in columns:
+            if col == "antibody":
+                values = names[ab]
+                upper = rng.random(n) < 0.01
+                values[upper] = [v.upper() for v in values[upper]]
+                data[col] = values
+            elif col in study:
+                data[col] = study[col][u]
+            elif col not in data:
+                data[col] = vocab.antibody_attribute(col)[ab]
+        yield pd.DataFrame({col: data[col] for col in columns})
+
+
+def build_database(path: str, scale: int, seed: int = 0):
+    """Write a synthetic build at scale x the table_meta.json row counts to path"""
+    with open(META_PATH) as f:
+        meta = json.load(f)
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    staging = path + ".staging"
+    if os.path.exists(staging):
+        os.remove(staging)
+    conn = sqlite3.connect(staging, isolation_level=None)
+    conn.execute("PRAGMA journal_mode = MEMORY")
+    conn.execute("PRAGMA synchronous = OFF")
+
+    started = time.perf_counter()
+    vocab = Vocabulary(scale, seed)
+    antibody_ids = {}
+    conn.execute("BEGIN")
+    for table_name in SHEETS:
+        info = meta.get(table_name)
+        if info is None:
+            continue
+        rows = info["rows"] * scale
+        table_started = time.perf_counter()
+        conn.execute(f"DROP TABLE IF EXISTS {table_name}")
+        for i, df in enumerate(synthetic_chunks(table_name, info["columns"], rows, vocab)):
+            df, schema, _ = coerce_types(df, table_name)
+            df, schema = assign_antibody_ids(df, schema, antibody_ids)
+            insert_rows(conn, table_name, df, schema, create=i == 0)
+        indexes = build_derived(conn, table_name, list(df.columns))
+        print(f"  {table_name}: {rows} rows, {len(indexes)} indexes ({time.perf_counter() - table_started:.1f}s)")
+    build_antibody_dim(conn, antibody_ids)
+    record_state(conn, {**{t: f"synthetic-x{scale}-seed{seed}" for t in SHEETS}, BUILD_KEY: build_hash()})
+    conn.execute("ANALYZE")
+    conn.execute("COMMIT")
+    conn.close()
+    os.replace(staging, path)
+    print(f"Built {path} ({os.path.getsize(path) / 2 ** 20:.0f} MB) in {time.perf_counter() - started:.1f}s")
+
+
+def database_path(scale: int, seed: int = 0) -> str:
+    return os.path.join(BENCH_DIR, f"bench_x{scale}_seed{seed}.sqlite")
+
+
+# Relative frequency of each request in a dashboard session: every filter
+# change refetches the faceted options and the batch of table, AE chart and
+# distributions; the other views are opened less often.
+DASHBOARD_MIX = {
+    "filter-options": 4, "filter-options+facets": 12, "batch": 12, "query": 6, "distribution": 3,
+    "adverse-events": 4, "comparative": 4, "rr-matrix": 1, "cross-dataset": 2, "target-aggregation": 2,
+    "facet-counts": 2, "search": 5, "studies": 1, "targets": 1, "antibodies-with-comparator": 1,
+    "overlapping-antibodies": 1, "tables": 1, "stats": 0.5, "export": 0.5,
+}
+DISTRIBUTION_COLUMNS = ["record_category", "general_molecular_category", "moa_new", "target_1"]
+SORT_COLUMNS = ["antibody", "adverse_event_term", "n_ab", "all_grades%"]
+TABLE_WEIGHTS = {"ctgov_all": 6, "label_final": 2, "label_bbw": 1, "label_wap": 1}
+
+
+class MixSampler:
+    """Draws request parameters from the values present in a build"""
+
+    def __init__(self, db_path: str, seed: int):
+        self.rng = random.Random(seed)
+        conn = sqlite3.connect(f"file:{db_path}?mode=ro", uri=True)
+        try:
+            self.catalog = {}
+            for table, col, value, cnt in conn.execute(
+                    "SELECT table_name, column_name, value, cnt FROM filter_catalog ORDER BY 1, 2, 3"):
+                values = self.catalog.setdefault(table, {}).setdefault(col, ([], []))
+                values[0].append(value)
+                values[1].append(cnt)
+            self.studies = conn.execute(
+                "SELECT antibody, nct_id, COUNT(*) FROM ctgov_all WHERE n_comp > 0 "
+                "GROUP BY 1, 2 ORDER BY 3 DESC LIMIT 2000").fetchall()
+            self.columns = {t: {r[1] for r in conn.execute(f"PRAGMA table_info({t})")} for t in TABLE_WEIGHTS}
+            self.overlap = [r[0] for r in conn.execute(
+                "SELECT display FROM antibody_dim WHERE n_ctgov_all > 0 AND n_label_final > 0 "
+                "ORDER BY n_ctgov_all DESC LIMIT 500")]
+        finally:
+            conn.close()
+
+    def table(self) -> str:
+        return self.rng.choices(list(TABLE_WEIGHTS), weights=list(TABLE_WEIGHTS.values()))[0]
+
+    def value(self, table: str, col: str):
+        values, weights = self.catalog[table][col]
+        return self.rng.choices(values, weights=weights)[0]
+
+    def filters(self, table: str) -> dict:
+        cols = [c for c in FILTERABLE_COLUMNS[table_type(table)] if c in self.catalog.get(table, {})]
+        k = self.rng.choice([0, 1, 1, 1, 2, 2, 3])
+        return {col: sorted({self.value(table, col) for _ in range(self.rng.choice([1, 1, 2]))}, key=str)
+                for col in self.rng.sample(cols, min(k, len(cols)))}
+
+    def search(self, table: str):
+        if self.rng.random() < 0.85:
+            return None
+        name = self.value(table, "antibody")
+        return name[:self.rng.randint(3, 5)]
+
+    def study(self):
+        return self.studies[min(int(self.rng.paretovariate(1.2)) - 1, len(self.studies) - 1)]
+
+    def request(self, name: str) -> dict:
+        rng = self.rng
+        table = self.table()
+        get = {}
+        body = None
+        if name in ("tables", "stats", "targets", "antibodies-with-comparator", "overlapping-antibodies"):
+            path = f"/api/{name}"
+            if name in ("targets", "antibodies-with-comparator"):
+                get = {"table": table}
+        elif name.startswith("filter-options"):
+            path = "/api/filter-options"
+            get = {"table": table}
+            if name.endswith("+facets"):
+                get["filters"] = json.dumps(self.filters(table))
+                search = self.search(table)
+                if search:
+                    get["search"] = search
+        elif name == "batch":
+            path = "/api/batch"
+            body = {"table": table, "filters": self.filters(table), "search": self.search(table), "specs": [
+                {"type": "query", "page": 1, "page_size": 50,
+                 "sort_by": rng.choice([None, None, "antibody", "organ_system"]), "sort_dir": "asc",
+                 "format": "columnar"},
+                {"type": "adverse-events", "group_by": "organ_system"},
+                *({"type": "distribution", "column": c} for c in DISTRIBUTION_COLUMNS),
+            ]}
+        elif name == "query":
+            path = "/api/query"
+            body = {"table": table, "filters": self.filters(table), "search": self.search(table),
+                    "page": min(int(rng.paretovariate(1.0)), 40), "page_size": 50,
+                    "sort_by": rng.choice([None, *(c for c in SORT_COLUMNS if c in self.columns[table])]),
+                    "sort_dir": rng.choice(["asc", "desc"])}
+        elif name == "distribution":
+            path = "/api/chart/distribution"
+            get = {"table": table, "column": rng.choice(DISTRIBUTION_COLUMNS)}
+            filters = self.filters(table)
+            if filters:
+                get["filters"] = json.dumps(filters)
+        elif name == "adverse-events":
+            path = "/api/chart/adverse-events"
+            body = {"table": table, "group_by": rng.choice(["organ_system", "adverse_event_term"]),
+                    "filters": self.filters(table), "search": self.search(table), "top_n": 25}
+        elif name == "comparative":
+            path = "/api/chart/comparative"
+            antibody, nct_id, _ = self.study()
+            body = {"table": "ctgov_all", "antibody": antibody, "nct_id": nct_id if rng.random() < 0.4 else None,
+                    "group_by": rng.choice(["organ_system", "adverse_event_term"]), "top_n": 15}
+        elif name == "rr-matrix":
+            path = "/api/chart/rr-matrix"
+            body = {"table": "ctgov_all", "group_by": "organ_system", "filters": self.filters("ctgov_all")}
+        elif name == "cross-dataset":
+            path = "/api/chart/cross-dataset"
+            body = {"antibody": rng.choice(self.overlap[:100]) if self.overlap else self.study()[0],
+                    "group_by": "organ_system", "top_n": 15}
+        elif name == "target-aggregation":
+            path = "/api/chart/target-aggregation"
+            body = {"table": table, "target": self.value(table, "target_1"),
+                    "group_by": "organ_system", "top_n": 15}
+        elif name == "facet-counts":
+            path = "/api/facet-counts"
+            body = {"table": table, "filters": self.filters(table), "search": self.search(table)}
+        elif name == "search":
+            path = "/api/search"
+            term = str(self.value(table, rng.choice(["antibody", "condition", "target_1"])))
+            start = rng.randint(0, max(len(term) - 4, 0))
+            get = {"q": term[start:start + rng.randint(3, 6)], "limit": 20}
+        elif name == "studies":
+            path = "/api/studies"
+            get = {"table": "ctgov_all", "antibody": self.study()[0]}
+        elif name == "export":
+            path = "/api/export"
+            get = {"table": table, "format": "csv",
+                   "filters": json.dumps({"antibody": [self.value(table, "antibody")]})}
+        else:
+            raise ValueError(f"Unknown request type: {name}")
+        if get:
+            path += "?" + urllib.parse.urlencode(get)
+        return {"name": name, "method": "POST" if body is not None else "GET", "path": path,
+                "body": json.dumps(body) if body is not None else None}
+
+
+def dashboard_workload(db_path: str, n: int, seed: int = 0) -> list:
+    sampler = MixSampler(db_path, seed)
+    names = sampler.rng.choices(list(DASHBOARD_MIX), weights=list(DASHBOARD_MIX.values()), k=n)
+    return [sampler.request(name) for name in names]
+
+
+def read_workload(path: str) -> list:
+    with open(path) as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def write_workload(path: str, requests: list):
+    with open(path, "w") as f:
+        for r in requests:
+            f.write(json.dumps(r) + "\n")
+
+
+def rss_bytes(pid: int):
+    """Resident set size of a process, from /proc (None where there is no /proc)"""
+    try:
+        with open(f"/proc/{pid}/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError):
+        return None
+
+
+class RSSSampler(threading.Thread):
+    """Samples a process's RSS every interval seconds while a run is going"""
+
+    def __init__(self, pid: int, interval: float = 0.01):
+        super().__init__(daemon=True)
+        self.pid = pid
+        self.interval = interval
+        self.times = []
+        self.samples = []
+        self._done = threading.Event()
+
+    def run(self):
+        while not self._done.is_set():
+            rss = rss_bytes(self.pid)
+            if rss is not None:
+                self.times.append(time.perf_counter())
+                self.samples.append(rss)
+            self._done.wait(self.interval)
+
+    def stop(self):
+        self._done.set()
+        self.join()
+
+    def peak(self, start: float, end: float):
+        """Highest RSS sampled while [start, end] ran, or the sample nearest it"""
+        if not self.samples:
+            return None
+        lo = max(bisect.bisect_left(self.times, start) - 1, 0)
+        hi = bisect.bisect_right(self.times, end) + 1
+        return max(self.samples[lo:hi])
+
+
+async def asgi_call(app, method: str, path: str, body) -> tuple:
+    """One request straight into the ASGI app: (status, response bytes)"""
+    path, _, query = path.partition("?")
+    payload = body.encode() if body else b""
+    scope = {
+        "type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1", "method": method,
+        "scheme": "http", "path": urllib.parse.unquote(path), "raw_path": path.encode(),
+        "query_string": query.encode(), "root_path": "", "client": ("127.0.0.1", 0), "server": ("bench", 80),
+        "headers": [(b"host", b"bench"), (b"content-type", b"application/json"),
+                    (b"content-length", str(len(payload)).encode())],
+    }
+    done = asyncio.Event()
+    requested = False
+    response = {"status": None, "bytes": 0}
+
+    async def receive():
+        nonlocal requested
+        if not requested:
+            requested = True
+            return {"type": "http.request", "body": payload, "more_body": False}
+        await done.wait()
+        return {"type": "http.disconnect"}
+
+    async def send(message):
+        if message["type"] == "http.response.start":
+            response["status"] = message["status"]
+        elif message["type"] == "http.response.body":
+            response["bytes"] += len(message.get("body", b""))
+            if not message.get("more_body"):
+                done.set()
+
+    await app(scope, receive, send)
+    done.set()
+    return response["status"], response["bytes"]
+
+
+async def run_inprocess(requests: list, concurrency: int, warmup: int) -> tuple:
+    """Replay requests against main.app in this process; returns (results, sampler, wall seconds)"""
+    import main
+
+    results = []
+    async with main.app.router.lifespan_context(main.app):
+        for r in requests[:warmup]:
+            await asgi_call(main.app, r["method"], r["path"], r["body"])
+        queue = iter(requests[warmup:])
+
+        async def worker():
+            for r in queue:
+                started = time.perf_counter()
+                status, nbytes = await asgi_call(main.app, r["method"], r["path"], r["body"])
+                results.append((r["name"], started, time.perf_counter(), status, nbytes))
+
+        sampler = RSSSampler(os.getpid())
+        sampler.start()
+        started = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        wall = time.perf_counter() - started
+        sampler.stop()
+    return results, sampler, wall
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def http_call(conn: http.client.HTTPConnection, method: str, path: str, body) -> tuple:
+    headers = {"Content-Type": "application/json"} if body else {}
+    conn.request(method, path, body=body, headers=headers)
+    response = conn.getresponse()
+    return response.status, len(response.read())
+
+
+def run_uvicorn(requests: list, concurrency: int, warmup: int, db_path: str) -> tuple:
+    """Replay requests over HTTP against a local uvicorn serving main:app"""
+    port = free_port()
+    env = {**os.environ, "MAB_DB_PATH": os.path.abspath(db_path)}
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--host", "127.0.0.1", "--port", str(port),
+         "--log-level", "warning"],
+        cwd=os.path.dirname(os.path.abspath(__file__)), env=env,
+    )
+    try:
+        deadline = time.monotonic() + 60
+        while True:
+            try:
+                conn = http.client.HTTPConnection("127.0.0.1", port, timeout=5)
+                http_call(conn, "GET", "/api/tables", None)
+                conn.close()
+                break
+            except OSError:
+                if server.poll() is not None or time.monotonic() > deadline:
+                    raise RuntimeError("uvicorn did not start")
+                time.sleep(0.2)
+
+        conn = http.client.HTTPConnection("127.0.0.1", port, timeout=120)
+        for r in requests[:warmup]:
+            http_call(conn, r["method"], r["path"], r["body"])
+        conn.close()
+
+        results = []
+        lock = threading.Lock()
+        queue = iter(requests[warmup:])
+
+        def worker():
+            conn = http.client.HTTPConnection("127.0.0.1", port, timeout=120)
+            while True:
+                with lock:
+                    r = next(queue, None)
+                if r is None:
+                    break
+                started = time.perf_counter()
+                status, nbytes = http_call(conn, r["method"], r["path"], r["body"])
+                results.append((r["name"], started, time.perf_counter(), status, nbytes))
+            conn.close()
+
+        sampler = RSSSampler(server.pid)
+        sampler.start()
+        threads = [threading.Thread(target=worker) for _ in range(concurrency)]
+        started = time.perf_counter()
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        wall = time.perf_counter() - started
+        sampler.stop()
+        return results, sampler, wall
+    finally:
+        server.terminate()
+        server.wait(10)
+
+
+def summarize(results: list, sampler: RSSSampler, wall: float) -> dict:
+    """Latency percentiles (ms), throughput and peak RSS per endpoint and overall"""
+    def stats(rows):
+        ms = np.array([(end - start) * 1000 for _, start, end, _, _ in rows])
+        peaks = [p for p in (sampler.peak(start, end) for _, start, end, _, _ in rows) if p is not None]
+        return {
+            "requests": len(rows),
+            "errors": sum(1 for *_, status, _ in rows if status >= 400),
+            "p50_ms": round(float(np.percentile(ms, 50)), 3),
+            "p95_ms": round(float(np.percentile(ms, 95)), 3),
+            "p99_ms": round(float(np.percentile(ms, 99)), 3),
+            "mean_ms": round(float(ms.mean()), 3),
+            "throughput_rps": round(len(rows) / wall, 2),
+            "bytes_mean": int(np.mean([nbytes for *_, nbytes in rows])),
+            "peak_rss_mb": round(max(peaks) / 2 ** 20, 1) if peaks else None,
+        }
+
+    by_name = {}
+    for row in results:
+        by_name.setdefault(row[0], []).append(row)
+    return {
+        "endpoints": {name: stats(rows) for name, rows in sorted(by_name.items())},
+        "total": {**stats(results), "wall_seconds": round(wall, 3)},
+    }
+
+
+def print_report(report: dict, baseline=None):
+    cols = ["requests", "errors", "p50_ms", "p95_ms", "p99_ms", "throughput_rps", "peak_rss_mb"]
+    print(f"{'endpoint':<28}" + "".join(f"{c:>15}" for c in cols))
+    rows = [*report["endpoints"].items(), ("TOTAL", report["total"])]
+    for name, stats in rows:
+        print(f"{name:<28}" + "".join(f"{'-' if stats[c] is None else stats[c]:>15}" for c in cols))
+        if baseline is None:
+            continue
+        base = baseline["total"] if name == "TOTAL" else baseline["endpoints"].get(name)
+        if base:
+            print(f"{'  vs baseline':<28}" + "".join(f"{change(stats[c], base.get(c)):>15}" for c in cols))
+
+
+def change(value, base) -> str:
+    if value is None or not base:
+        return ""
+    return f"{(value - base) / base * 100:+.1f}%"
+
+
+def regressions(report: dict, baseline: dict, tolerance: float) -> list:
+    """(endpoint, metric, baseline, current) where latency rose or throughput fell beyond tolerance"""
+    found = []
+    for name, stats in [*report["endpoints"].items(), ("TOTAL", report["total"])]:
+        base = baseline["total"] if name == "TOTAL" else baseline["endpoints"].get(name)
+        if not base:
+            continue
+        for metric in ("p50_ms", "p95_ms", "p99_ms"):
+            if base.get(metric) and stats[metric] > base[metric] * (1 + tolerance):
+                found.append((name, metric, base[metric], stats[metric]))
+        if base.get("throughput_rps") and stats["throughput_rps"] < base["throughput_rps"] * (1 - tolerance):
+            found.append((name, "throughput_rps", base["throughput_rps"], stats["throughput_rps"]))
+    return found
+
+
+def run(args) -> int:
+    db_path = args.db or database_path(args.scale, args.seed)
+    if not os.path.exists(db_path):
+        print(f"Building synthetic database at {args.scale}x: {db_path}")
+        build_database(db_path, args.scale, args.seed)
+    if args.workload:
+        requests = read_workload(args.workload)
+    else:
+        requests = dashboard_workload(db_path, args.requests + args.warmup, args.seed)
+    if args.save_workload:
+        write_workload(args.save_workload, requests)
+
+    print(f"Replaying {len(requests) - args.warmup} requests ({args.warmup} warm-up) "
+          f"{args.mode} at concurrency {args.concurrency} against {db_path}")
+    if args.mode == "uvicorn":
+        results, sampler, wall = run_uvicorn(requests, args.concurrency, args.warmup, db_path)
+    else:
+        # main.py opens its pool on DB_PATH at import
+        os.environ["MAB_DB_PATH"] = os.path.abspath(db_path)
+        results, sampler, wall = asyncio.run(run_inprocess(requests, args.concurrency, args.warmup))
+
+    report = summarize(results, sampler, wall)
+    report["run"] = {
+        "mode": args.mode, "scale": args.scale, "seed": args.seed, "concurrency": args.concurrency,
+        "db": os.path.abspath(db_path), "workload": args.workload, "engine": os.environ.get("MAB_ENGINE", "sqlite"),
+        "python": platform.python_version(), "sqlite": sqlite3.sqlite_version,
+        "at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+    }
+    baseline = None
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        differs = [k for k in ("mode", "scale", "concurrency", "engine")
+                   if baseline.get("run", {}).get(k) != report["run"][k]]
+        if differs:
+            print(f"Note: baseline differs in {', '.join(differs)}")
+    print_report(report, baseline)
+    if args.save:
+        with open(args.save, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"Report saved to {args.save}")
+    if baseline is None:
+        return 0
+    found = regressions(report, baseline, args.tolerance)
+    for name, metric, before, after in found:
+        print(f"REGRESSION {name} {metric}: {before} -> {after}")
+    print(f"{len(found)} regression(s) beyond {args.tolerance:.0%} of the baseline")
+    return 1 if found else 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    sub = parser.add_subparsers(dest="command", required=True)
+    for name in ("build", "run"):
+        p = sub.add_parser(name)
+        p.add_argument("--scale", type=int, default=1, help="multiple of the table_meta.json row counts (1, 10, 100)")
+        p.add_argument("--seed", type=int, default=0)
+        p.add_argument("--db", help="database path (default: bench/bench_x<scale>_seed<seed>.sqlite)")
+    run_parser = sub.choices["run"]
+    run_parser.add_argument("--mode", choices=["inprocess", "uvicorn"], default="inprocess")
+    run_parser.add_argument("--concurrency", type=int, default=8)
+    run_parser.add_argument("--requests", type=int, default=2000)
+    run_parser.add_argument("--warmup", type=int, default=100)
+    run_parser.add_argument("--workload", help="replay this JSON-lines request file instead of the dashboard mix")
+    run_parser.add_argument("--save-workload", help="write the replayed requests as JSON lines")
+    run_parser.add_argument("--save", help="write the report as JSON")
+    run_parser.add_argument("--baseline", help="compare against a report saved with --save")
+    run_parser.add_argument("--tolerance", type=float, default=0.10,
+                            help="relative change in latency or throughput that counts as a regression")
+    args = parser.parse_args()
+    if args.command == "build":
+        build_database(args.db or database_path(args.scale, args.seed), args.scale, args.seed)
+    else:
+        sys.exit(run(args))
@@ -0,0 +1,164 @@
+"""
+Per-value bitmap index over the filterable columns, for faceted filtering.
+
+Every value of every FILTERABLE_COLUMNS column gets a bitmap of the rows
+holding it, packed eight rows to a byte. A filter combination resolves by
+OR-ing the bitmaps of a column's selected values and AND-ing the columns;
+the counts for every facet then come from one bincount per column over the
+rows passing the other columns' filters, so a whole filter panel is a single
+pass. The index is built from the engine.py tables once per database build,
+in the background (warm_indexes) rather than on a request thread.
+"""
+import os
+import threading
+
+import numpy as np
+
+from engine import Table, store, text_affinity
+from schema import FILTERABLE_COLUMNS, VALID_TABLES, table_type
+
+# Columns with more distinct values than this resolve filters from their
+# codes instead of keeping a bitmap per value
+MAX_BITMAP_VALUES = int(os.environ.get("MAB_BITMAP_MAX_VALUES", "4096"))
+
+_build_lock = threading.Lock()
+
+
+class Facet:
+    """One filterable column: dictionary codes, values and per-value bitmaps"""
+
+    def __init__(self, codes: np.ndarray, values: list, numeric: bool, n_rows: int):
+        self.codes = codes
+        self.values = values
+        self.numeric = numeric
+        self.lookup = {v: i for i, v in enumerate(values)}
+        self.bitmaps = None
+        if len(values) <= MAX_BITMAP_VALUES:
+            rows = np.flatnonzero(codes >= 0)
+            bits = np.zeros((len(values), (n_rows + 7) // 8), dtype=np.uint8)
+            np.bitwise_or.at(bits, (codes[rows], rows >> 3), (0x80 >> (rows & 7)).astype(np.uint8))
+            self.bitmaps = bits
+
+    @property
+    def nbytes(self) -> int:
+        return self.codes.nbytes + (self.bitmaps.nbytes if self.bitmaps is not None else 0)
+
+    def codes_for(self, values: list) -> list:
+        """Codes of the filter values, converted the way SQLite compares them"""
+        if self.numeric:
+            keys = []
+            for v in values:
+                try:
+                    keys.append(float(v))
+                except (TypeError, ValueError):
+                    continue
+        else:
+            keys = map(text_affinity, values)
+        return [self.lookup[k] for k in keys if k in self.lookup]
+
+    def bitmap(self, values: list) -> np.ndarray:
+        """Packed rows holding any of the values: col IN (values)"""
+        codes = self.codes_for(values)
+        if self.bitmaps is not None:
+            return np.bitwise_or.reduce(self.bitmaps[codes], axis=0)
+        return np.packbits(np.isin(self.codes, codes))
+
+    def counts(self, mask: np.ndarray, antibody: np.ndarray, n_antibodies: int) -> dict:
+        """Rows and distinct antibodies per value among the masked rows"""
+        sel = mask & (self.codes >= 0)
+        codes = self.codes[sel].astype(np.int64)
+        rows = np.bincount(codes, minlength=len(self.values))
+        ab = antibody[sel]
+        named = ab >= 0
+        pairs = np.unique(codes[named] * n_antibodies + ab[named])
+        antibodies = np.bincount(pairs // n_antibodies, minlength=len(self.values))
+        return {"values": self.values, "rows": rows.tolist(), "antibodies": antibodies.tolist()}
+
+
+class BitmapIndex:
+    def __init__(self, table: Table):
+        self.table = table
+        self.n_rows = table.n_rows
+        self.facets = {}
+        for col in FILTERABLE_COLUMNS[table_type(table.name)]:
+            column = table.columns.get(col)
+            if column is not None:
+                codes, values = column.dictionary()
+                self.facets[col] = Facet(codes, values, column.numeric, self.n_rows)
+        self.all_rows = np.packbits(np.ones(self.n_rows, dtype=bool))
+
+    @property
+    def nbytes(self) -> int:
+        return sum(f.nbytes for f in self.facets.values())
+
+    def column_bitmap(self, col: str, values: list) -> np.ndarray:
+        facet = self.facets.get(col)
+        if facet is not None:
+            return facet.bitmap(values)
+        return np.packbits(self.table.column(col).isin(values))
+
+    def resolve(self, filters: dict, antibodies=None) -> np.ndarray:
+        """
+        Packed rows matching build_where(filters); antibodies, when given,
+        are the names an antibody search matched.
+        """
+        result = self.all_rows.copy()
+        for col, values in filters.items():
+            if values:
+                result &= self.column_bitmap(col, values)
+        if antibodies is not None:
+            result &= self.column_bitmap("antibody", antibodies)
+        return result
+
+    def mask(self, filters: dict, antibodies=None) -> np.ndarray:
+        return np.unpackbits(self.resolve(filters, antibodies), count=self.n_rows).astype(bool)
+
+    def row_ids(self, filters: dict, antibodies=None) -> np.ndarray:
+        return np.flatnonzero(self.mask(filters, antibodies))
+
+    def facet_counts(self, filters: dict, antibodies=None) -> dict:
+        """
+        Rows and distinct antibodies per value of every facet, each facet
+        counted under the active filters of all the other columns.
+        """
+        active = {col: self.column_bitmap(col, values) for col, values in filters.items() if values}
+        base = self.all_rows.copy()
+        if antibodies is not None:
+            base &= self.column_bitmap("antibody", antibodies)
+        total = base.copy()
+        for bits in active.values():
+            total &= bits
+
+        ab_facet = self.facets.get("antibody")
+        antibody = ab_facet.codes if ab_facet else np.full(self.n_rows, -1, dtype=np.int32)
+        n_antibodies = max(len(ab_facet.values), 1) if ab_facet else 1
+        facets = {}
+        for col, facet in self.facets.items():
+            bits = base.copy()
+            for other, other_bits in active.items():
+                if other != col:
+                    bits &= other_bits
+            mask = np.unpackbits(bits, count=self.n_rows).astype(bool)
+            facets[col] = facet.counts(mask, antibody, n_antibodies)
+        return {"total": int(np.bitwise_count(total).sum()), "facets": facets}
+
+
+def bitmap_index(conn, table: str) -> BitmapIndex:
+    """The index for a table of the connection's database build, loading and building it if need be"""
+    t = store.table(conn, table)
+    with _build_lock:
+        if t.bitmaps is None:
+            t.bitmaps = BitmapIndex(t)
+    return t.bitmaps
+
+
+def built_index(conn, table: str):
+    """The table's index for the connection's build if it is built yet, else None; never loads"""
+    t = store.loaded(conn, table)
+    return t.bitmaps if t is not None else None
+
+
+def warm_indexes(conn):
+    """Load and index every table of the connection's build"""
+    for table in VALID_TABLES:
+        bitmap_index(conn, table)
@@ -0,0 +1,127 @@
+"""
+In-process LRU/TTL cache for computed API responses.
+
+Keys are canonical JSON strings built from the endpoint name, its request
+parameters and the database fingerprint, so a rebuilt database never serves
+stale results; old entries simply age out.
+"""
+import json
+import os
+import threading
+import time
+from collections import Counter, OrderedDict
+
+CACHE_MAX_BYTES = int(os.environ.get("MAB_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+CACHE_TTL = float(os.environ.get("MAB_CACHE_TTL", "3600"))
+# Number of distinct request specs remembered for warming
+POPULAR_LIMIT = 1000
+
+
+def canonical_params(params: dict) -> dict:
+    """Normalize request parameters so equivalent requests share a key"""
+    result = {}
+    for name, value in params.items():
+        if name == "filters" and isinstance(value, dict):
+            value = {
+                col: _sorted_values(vals) if isinstance(vals, list) else vals
+                for col, vals in sorted(value.items()) if vals
+            }
+        result[name] = value
+    return result
+
+
+def _sorted_values(values: list) -> list:
+    # IN (...) ignores order and duplicates
+    try:
+        return sorted(set(values), key=lambda v: (type(v).__name__, v))
+    except TypeError:
+        return values
+
+
+def spec_key(name: str, params: dict) -> str:
+    return json.dumps([name, canonical_params(params)], sort_keys=True, default=str)
+
+
+def cache_key(name: str, params: dict, fingerprint: str) -> str:
+    return json.dumps([fingerprint, name, canonical_params(params)], sort_keys=True, default=str)
+
+
+class ResultCache:
+    def __init__(self, max_bytes: int = CACHE_MAX_BYTES, ttl: float = CACHE_TTL):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._popular = Counter()
+        self._stats = {"hits": 0, "misses": 0, "evictions": 0, "expirations": 0, "oversize": 0}
+
+    def get(self, key: str):
+        """Return (found, value) and refresh the entry's LRU position"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self._stats["misses"] += 1
+                return False, None
+            expires, size, value = entry
+            if expires < time.monotonic():
+                self._drop(key)
+                self._stats["expirations"] += 1
+                self._stats["misses"] += 1
+                return False, None
+            self._entries.move_to_end(key)
+            self._stats["hits"] += 1
+            return True, value
+
+    def __contains__(self, key: str) -> bool:
+        with self._lock:
+            entry = self._entries.get(key)
+            return entry is not None and entry[0] >= time.monotonic()
+
+    def put(self, key: str, value):
+        size = len(key) + len(json.dumps(value, default=str))
+        with self._lock:
+            if key in self._entries:
+                self._drop(key)
+            if size > self.max_bytes:
+                self._stats["oversize"] += 1
+                return
+            self._entries[key] = (time.monotonic() + self.ttl, size, value)
+            self._bytes += size
+            while self._bytes > self.max_bytes:
+                oldest = next(iter(self._entries))
+                self._drop(oldest)
+                self._stats["evictions"] += 1
+
+    def _drop(self, key: str):
+        _, size, _ = self._entries.pop(key)
+        self._bytes -= size
+
+    def note_request(self, spec: str):
+        """Count a request spec so the most common ones can be warmed later"""
+        with self._lock:
+            self._popular[spec] += 1
+            if len(self._popular) > POPULAR_LIMIT:
+                for stale, _ in self._popular.most_common()[POPULAR_LIMIT // 2:]:
+                    del self._popular[stale]
+
+    def most_requested(self, n: int) -> list:
+        with self._lock:
+            return [spec for spec, _ in self._popular.most_common(n)]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def metrics(self) -> dict:
+        with self._lock:
+            lookups = self._stats["hits"] + self._stats["misses"]
+            return {
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "ttl_seconds": self.ttl,
+                **self._stats,
+                "hit_ratio": round(self._stats["hits"] / lookups, 4) if lookups else 0.0,
+            }
@@ -0,0 +1,245 @@
+"""
+SQLite connection handling for the API.
+
+Requests borrow read-only connections from a bounded pool instead of opening
+a fresh handle each time, so SQLite's page cache and mmap survive across
+requests. When ingest.py replaces the database file the pool notices the new
+fingerprint and retires handles to the old file.
+
+SQLite work runs on two dedicated thread pools, one for interactive chart
+and query calls and a smaller one for bulk exports, so a long export can't
+starve the dashboard. An export also holds its connection until the client
+has read the whole body, so exports draw from their own small pool and
+never take connections interactive requests need. deadline() aborts
+statements that overrun their budget.
+"""
+import asyncio
+import contextvars
+import os
+import sqlite3
+import threading
+import time
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+# MAB_DB_PATH points the API at another build, e.g. a benchmark database
+DB_PATH = os.environ.get("MAB_DB_PATH") or os.path.join(os.path.dirname(__file__), "mab_database.sqlite")
+
+INTERACTIVE_WORKERS = int(os.environ.get("MAB_INTERACTIVE_WORKERS", "8"))
+BULK_WORKERS = int(os.environ.get("MAB_BULK_WORKERS", "2"))
+# Enough connections for every worker thread
+POOL_SIZE = int(os.environ.get("MAB_DB_POOL_SIZE", str(INTERACTIVE_WORKERS + BULK_WORKERS)))
+POOL_TIMEOUT = float(os.environ.get("MAB_DB_POOL_TIMEOUT", "10"))
+# Exports streaming at once, each holding a connection of export_pool;
+# further exports are turned away rather than queued
+EXPORT_SLOTS = int(os.environ.get("MAB_EXPORT_SLOTS", str(BULK_WORKERS)))
+# immutable=1 skips locking and change detection, which is only safe because
+# nothing edits the served file: ingest.py and benchmark.py build into a
+# staging file and os.replace() it over the old one, and open handles keep
+# reading the old inode. Set to 0 if anything ever writes the file in place.
+IMMUTABLE = os.environ.get("MAB_DB_IMMUTABLE", "1") == "1"
+MMAP_SIZE = int(os.environ.get("MAB_DB_MMAP_SIZE", str(256 * 1024 * 1024)))
+CACHE_SIZE_KB = int(os.environ.get("MAB_DB_CACHE_SIZE_KB", "65536"))
+# How often (seconds) the pool re-stats the database file to detect a rebuild
+FINGERPRINT_INTERVAL = 1.0
+# Seconds an interactive request may spend queued and in SQLite, and the
+# budget for each batch of an export
+QUERY_TIMEOUT = float(os.environ.get("MAB_QUERY_TIMEOUT", "15"))
+EXPORT_TIMEOUT = float(os.environ.get("MAB_EXPORT_TIMEOUT", "60"))
+# SQLite VM instructions between deadline checks
+PROGRESS_STEPS = 10000
+
+
+class DatabaseMissing(Exception):
+    pass
+
+
+class PoolTimeout(Exception):
+    pass
+
+
+class QueryTimeout(Exception):
+    pass
+
+
+class PooledConnection(sqlite3.Connection):
+    """sqlite3 connection tagged with the database fingerprint it was opened on"""
+    fingerprint = None
+    # SQLite VM instructions run under deadline(), in PROGRESS_STEPS units
+    vm_steps = 0
+
+
+def db_fingerprint(path: str = DB_PATH) -> str:
+    """Identify a database file build by inode, size and mtime"""
+    try:
+        st = os.stat(path)
+    except FileNotFoundError:
+        raise DatabaseMissing(path)
+    return f"{st.st_ino:x}-{st.st_size:x}-{st.st_mtime_ns:x}"
+
+
+def open_readonly(path: str = DB_PATH, factory=PooledConnection) -> PooledConnection:
+    uri = "file:" + urllib.request.pathname2url(os.path.abspath(path)) + "?mode=ro"
+    if IMMUTABLE:
+        uri += "&immutable=1"
+    conn = sqlite3.connect(uri, uri=True, check_same_thread=False, factory=factory)
+    conn.row_factory = sqlite3.Row
+    conn.execute(f"PRAGMA mmap_size = {MMAP_SIZE}")
+    conn.execute(f"PRAGMA cache_size = -{CACHE_SIZE_KB}")
+    conn.execute("PRAGMA temp_store = MEMORY")
+    conn.execute("PRAGMA query_only = ON")
+    return conn
+
+
+class ConnectionPool:
+    def __init__(self, path: str = DB_PATH, size: int = POOL_SIZE, timeout: float = POOL_TIMEOUT,
+                 factory=PooledConnection):
+        self.path = path
+        self.factory = factory
+        self.size = size
+        self.timeout = timeout
+        self._idle = []
+        self._open = 0
+        self._in_use = 0
+        self._cond = threading.Condition()
+        self._fingerprint = None
+        self._checked_at = 0.0
+        self._stats = {
+            "acquired": 0, "created": 0, "closed": 0,
+            "waits": 0, "timeouts": 0, "wait_seconds": 0.0,
+        }
+
+    @property
+    def fingerprint(self) -> str:
+        with self._cond:
+            return self._refresh()
+
+    def _refresh(self) -> str:
+        # Caller holds self._cond
+        now = time.monotonic()
+        if self._fingerprint is None or now - self._checked_at >= FINGERPRINT_INTERVAL:
+            fp = db_fingerprint(self.path)
+            if fp != self._fingerprint:
+                for conn in self._idle:
+                    self._close(conn)
+                self._idle.clear()
+                self._fingerprint = fp
+            self._checked_at = now
+        return self._fingerprint
+
+    def _close(self, conn):
+        conn.close()
+        self._open -= 1
+        self._stats["closed"] += 1
+        self._cond.notify()
+
+    def acquire(self) -> PooledConnection:
+        started = time.monotonic()
+        waited = False
+        with self._cond:
+            while True:
+                fp = self._refresh()
+                while self._idle:
+                    conn = self._idle.pop()
+                    if conn.fingerprint == fp:
+                        self._checkout(started, waited)
+                        return conn
+                    self._close(conn)
+                if self._open < self.size:
+                    self._open += 1
+                    break
+                remaining = self.timeout - (time.monotonic() - started)
+                if remaining <= 0:
+                    self._stats["timeouts"] += 1
+                    raise PoolTimeout(f"No database connection available after {self.timeout}s")
+                if not waited:
+                    waited = True
+                    self._stats["waits"] += 1
+                self._cond.wait(remaining)
+
+        try:
+            conn = open_readonly(self.path, factory=self.factory)
+        except Exception:
+            with self._cond:
+                self._open -= 1
+                self._cond.notify()
+            raise
+        conn.fingerprint = fp
+        with self._cond:
+            self._stats["created"] += 1
+            self._checkout(started, waited)
+        return conn
+
+    def _checkout(self, started: float, waited: bool):
+        self._in_use += 1
+        self._stats["acquired"] += 1
+        if waited:
+            self._stats["wait_seconds"] += time.monotonic() - started
+
+    def release(self, conn: PooledConnection):
+        with self._cond:
+            self._in_use -= 1
+            if conn.fingerprint != self._fingerprint:
+                self._close(conn)
+            else:
+                self._idle.append(conn)
+                self._cond.notify()
+
+    @contextmanager
+    def connection(self):
+        conn = self.acquire()
+        try:
+            yield conn
+        finally:
+            self.release(conn)
+
+    def close_all(self):
+        with self._cond:
+            for conn in self._idle:
+                self._close(conn)
+            self._idle.clear()
+
+    def metrics(self) -> dict:
+        with self._cond:
+            stats = dict(self._stats)
+            waits = stats.pop("wait_seconds")
+            return {
+                "size": self.size,
+                "open": self._open,
+                "in_use": self._in_use,
+                "idle": len(self._idle),
+                **stats,
+                "avg_wait_ms": round(waits * 1000 / stats["waits"], 3) if stats["waits"] else 0.0,
+                "fingerprint": self._fingerprint,
+            }
+
+
+@contextmanager
+def deadline(conn: sqlite3.Connection, expires: float):
+    """Interrupt SQLite work on conn once time.monotonic() passes expires"""
+    def progress():
+        conn.vm_steps += PROGRESS_STEPS
+        return time.monotonic() > expires
+
+    conn.set_progress_handler(progress, PROGRESS_STEPS)
+    try:
+        yield
+    except sqlite3.OperationalError as e:
+        if str(e) == "interrupted":
+            raise QueryTimeout("Query cancelled after exceeding its time budget") from e
+        raise
+    finally:
+        conn.set_progress_handler(None, 0)
+
+
+async def run_in(executor: ThreadPoolExecutor, fn, *args):
+    """Run fn(*args) on executor, carrying over the caller's context variables"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(executor, contextvars.copy_context().run, fn, *args)
+
+
+pool = ConnectionPool()
+export_pool = ConnectionPool(size=EXPORT_SLOTS, timeout=0)
+interactive_executor = ThreadPoolExecutor(INTERACTIVE_WORKERS, thread_name_prefix="sqlite-interactive")
+bulk_executor = ThreadPoolExecutor(BULK_WORKERS, thread_name_prefix="sqlite-bulk")
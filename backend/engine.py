@@ -0,0 +1,334 @@
+"""
+In-memory columnar engine for the AE, comparative and target-aggregation charts.
+
+With MAB_ENGINE=memory each fact table is loaded once per database build into
+NumPy arrays: text columns are dictionary-encoded as int32 codes into a sorted
+list of distinct values (-1 for NULL), numeric columns are float64 with NaN for
+NULL. IN-filters become boolean masks, and group-by averages are summed per
+group with math.fsum, so they don't depend on row order; main.py rounds the
+means of both engines the same way.
+The row producers return the same rows as the SQL in main.py, so the two
+engines share their post-processing and can be diffed against each other.
+"""
+import math
+import os
+import string
+import threading
+
+import numpy as np
+import pandas as pd
+
+from schema import CTGOV_RATE_METRIC, VALID_TABLES
+
+# "sqlite" (default) or "memory"
+ENGINE = os.environ.get("MAB_ENGINE", "sqlite")
+
+_ASCII_LOWER = str.maketrans(string.ascii_uppercase, string.ascii_lowercase)
+
+
+class Unsupported(Exception):
+    """The request needs something only the SQLite path handles"""
+
+
+class Column:
+    __slots__ = ("numeric", "integer", "data", "values", "lookup")
+
+    def __init__(self, raw: list, numeric: bool, integer: bool = False):
+        self.numeric = numeric
+        self.integer = integer
+        if numeric:
+            self.data = np.array([np.nan if v is None else v for v in raw], dtype=np.float64)
+            self.values = None
+            self.lookup = None
+        else:
+            codes, uniques = pd.factorize(pd.Series(raw, dtype=object), sort=True)
+            self.data = codes.astype(np.int32)
+            self.values = list(uniques)
+            self.lookup = {v: i for i, v in enumerate(self.values)}
+
+    @property
+    def nbytes(self) -> int:
+        return self.data.nbytes
+
+    def notnull(self) -> np.ndarray:
+        return ~np.isnan(self.data) if self.numeric else self.data >= 0
+
+    def dictionary(self):
+        """(codes, values): the column dictionary-encoded, numeric columns included"""
+        if not self.numeric:
+            return self.data, self.values
+        valid = ~np.isnan(self.data)
+        uniques, inverse = np.unique(self.data[valid], return_inverse=True)
+        codes = np.full(len(self.data), -1, dtype=np.int32)
+        codes[valid] = inverse
+        convert = int if self.integer else float
+        return codes, [convert(v) for v in uniques]
+
+    def isin(self, values: list) -> np.ndarray:
+        """Rows where col IN (values), with SQLite's affinity conversions"""
+        if self.numeric:
+            wanted = []
+            for v in values:
+                try:
+                    wanted.append(float(v))
+                except (TypeError, ValueError):
+                    continue
+            return np.isin(self.data, wanted)
+        codes = [self.lookup[k] for k in map(text_affinity, values) if k in self.lookup]
+        return np.isin(self.data, codes)
+
+    def equals(self, value) -> np.ndarray:
+        return self.isin([value])
+
+    def contains(self, term: str) -> np.ndarray:
+        """Rows where the value contains term, case-insensitive for ASCII like LIKE"""
+        if self.numeric or "%" in term or "_" in term:
+            raise Unsupported("substring match")
+        needle = term.translate(_ASCII_LOWER)
+        codes = [i for i, v in enumerate(self.values) if needle in v.translate(_ASCII_LOWER)]
+        return np.isin(self.data, codes)
+
+
+def text_affinity(v):
+    # How SQLite stores a bound parameter compared against a TEXT column
+    if v is None:
+        return None
+    if isinstance(v, bool):
+        v = int(v)
+    return v if isinstance(v, str) else str(v)
+
+
+class Table:
+    def __init__(self, name: str, columns: dict, n_rows: int):
+        self.name = name
+        self.columns = columns
+        self.n_rows = n_rows
+        # Built by bitmaps.warm_indexes() in the background
+        self.bitmaps = None
+
+    def column(self, name: str) -> Column:
+        col = self.columns.get(name)
+        if col is None:
+            raise Unsupported(f"no column {name} in {self.name}")
+        return col
+
+    def category(self, name: str) -> Column:
+        col = self.column(name)
+        if col.numeric:
+            raise Unsupported(f"group by numeric column {name}")
+        return col
+
+
+def load_table(conn, name: str) -> Table:
+    info = conn.execute(f"PRAGMA table_info({name})").fetchall()
+    rows = conn.execute(f"SELECT * FROM {name}").fetchall()
+    raw = list(zip(*rows)) if rows else [()] * len(info)
+    columns = {}
+    for (_, col, declared, *_), values in zip(info, raw):
+        declared = (declared or "").upper()
+        integer = "INT" in declared
+        numeric = integer or any(t in declared for t in ("REAL", "FLOA", "DOUB"))
+        columns[col] = Column(list(values), numeric, integer)
+    return Table(name, columns, len(rows))
+
+
+class MemoryStore:
+    """Column tables for the current database build, loaded on first use"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.fingerprint = None
+        self.tables = {}
+
+    def table(self, conn, name: str) -> Table:
+        with self._lock:
+            if self.fingerprint != conn.fingerprint:
+                self.tables = {}
+                self.fingerprint = conn.fingerprint
+            table = self.tables.get(name)
+            if table is None:
+                table = self.tables[name] = load_table(conn, name)
+            return table
+
+    def loaded(self, conn, name: str):
+        """The table if it is already loaded for the connection's build, else None"""
+        with self._lock:
+            return self.tables.get(name) if self.fingerprint == conn.fingerprint else None
+
+    def load_all(self, conn):
+        for name in VALID_TABLES:
+            self.table(conn, name)
+
+    def metrics(self) -> dict:
+        with self._lock:
+            return {
+                "engine": ENGINE,
+                "fingerprint": self.fingerprint,
+                "tables": {name: t.n_rows for name, t in self.tables.items()},
+                "bytes": sum(c.nbytes for t in self.tables.values() for c in t.columns.values()),
+                "bitmap_bytes": sum(t.bitmaps.nbytes for t in self.tables.values() if t.bitmaps),
+            }
+
+
+store = MemoryStore()
+
+
+def filter_mask(table: Table, filters: dict, search=None) -> np.ndarray:
+    """Boolean row mask for build_where(): AND of the IN-filters plus the antibody search"""
+    if table.bitmaps is not None:
+        mask = table.bitmaps.mask(filters)
+    else:
+        mask = np.ones(table.n_rows, dtype=bool)
+        for col, values in filters.items():
+            if values:
+                mask &= table.column(col).isin(values)
+    if search:
+        mask &= table.column("antibody").contains(search)
+    return mask
+
+
+def metric_values(table: Table, metric: str):
+    """(values, rows where the metric is defined), as rollup_metrics() in ingest.py"""
+    if metric == CTGOV_RATE_METRIC:
+        events = table.column("events_ab").data
+        n = table.column("n_ab").data
+        valid = ~np.isnan(events) & (n > 0)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            return events * 100.0 / n, valid
+    col = table.column(metric)
+    if not col.numeric:
+        raise Unsupported(f"non-numeric metric {metric}")
+    return col.data, ~np.isnan(col.data)
+
+
+def group_keys(table: Table, mask: np.ndarray, by: list):
+    """
+    Group the masked rows by the given text columns: returns (inverse, keys)
+    where inverse maps each masked row to its group and keys holds each
+    group's values (None for NULL), groups in value order.
+    """
+    cols = [table.category(c) for c in by]
+    combined = np.zeros(int(mask.sum()), dtype=np.int64)
+    for col in cols:
+        # +1 so NULL (-1) is its own group
+        combined = combined * (len(col.values) + 1) + (col.data[mask].astype(np.int64) + 1)
+    uniq, inverse = np.unique(combined, return_inverse=True)
+    keys = []
+    for col in reversed(cols):
+        codes = uniq % (len(col.values) + 1) - 1
+        uniq = uniq // (len(col.values) + 1)
+        keys.append([col.values[c] if c >= 0 else None for c in codes])
+    return inverse, list(zip(*reversed(keys)))
+
+
+def group_mean(inverse: np.ndarray, n_groups: int, values: np.ndarray) -> list:
+    """
+    AVG(values) per group, skipping NaN like SQL skips NULL. Each group is
+    summed with math.fsum, which doesn't depend on the order the rows are
+    added in, so the mean is the same whatever plan SQLite's AVG ran.
+    """
+    valid = ~np.isnan(values)
+    inverse = inverse[valid]
+    order = np.argsort(inverse, kind="stable")
+    values = values[valid][order].tolist()
+    bounds = np.searchsorted(inverse[order], np.arange(n_groups + 1)).tolist()
+    return [math.fsum(values[a:b]) / (b - a) if b > a else None for a, b in zip(bounds, bounds[1:])]
+
+
+def sql_round(x: np.ndarray, digits: int = 2) -> np.ndarray:
+    """
+    ROUND(x, digits) as SQLite computes it: halves go away from zero (np.round
+    goes to even), and a value like 80.835, stored as 80.83499..., counts as
+    the half it prints as, so the scaled value is cleaned up before flooring.
+    """
+    scale = 10.0 ** digits
+    scaled = np.round(np.abs(x) * scale, 9)
+    return np.sign(x) * np.floor(scaled + 0.5) / scale
+
+
+def _top(rows: list, key: str, limit: int) -> list:
+    # ORDER BY ROUND(key, 2) DESC, category LIMIT n, with NULLs last as in
+    # SQLite. The rows come in category order (group_keys), and the sort is
+    # stable
+    rows.sort(key=lambda r: (r[key] is not None, float(sql_round(r[key])) if r[key] is not None else 0),
+              reverse=True)
+    return rows[:limit]
+
+
+def adverse_event_rows(table: Table, group_by: str, metric: str, filters: dict, search, top_n: int) -> list:
+    """Rows of compute_adverse_events(): category, avg_pct, cnt"""
+    values, valid = metric_values(table, metric)
+    mask = filter_mask(table, filters, search) & valid & table.category(group_by).notnull()
+    inverse, keys = group_keys(table, mask, [group_by])
+    avg = group_mean(inverse, len(keys), values[mask])
+    counts = np.bincount(inverse, minlength=len(keys))
+    rows = [{"category": k[0], "avg_pct": a, "cnt": int(c)} for k, a, c in zip(keys, avg, counts)]
+    return _top(rows, "avg_pct", top_n)
+
+
+def comparative_rows(table: Table, antibody: str, nct_id, group_by: str, filters: dict, top_n: int,
+                     ctgov: bool) -> list:
+    """Rows of compute_comparative() for one antibody, per category"""
+    mask = filter_mask(table, filters) & table.column("antibody").equals(antibody)
+    mask &= table.category(group_by).notnull()
+    if ctgov:
+        if nct_id:
+            mask &= table.column("nct_id").equals(nct_id)
+        n_ab = table.column("n_ab").data
+        mask &= n_ab > 0
+        n_ab = n_ab[mask]
+        n_comp = table.column("n_comp").data[mask]
+        with np.errstate(divide="ignore", invalid="ignore"):
+            comp_pct = np.where(n_comp > 0, table.column("events_comp").data[mask] * 100.0 / n_comp, np.nan)
+        measures = {
+            "ab_pct": table.column("events_ab").data[mask] * 100.0 / n_ab,
+            "comp_pct": comp_pct,
+        }
+    else:
+        measures = {
+            "ab_pct": table.column("all_grades%").data[mask],
+            "comp_pct": table.column("comp_all_grades%").data[mask],
+        }
+    inverse, keys = group_keys(table, mask, [group_by])
+    means = {name: group_mean(inverse, len(keys), v) for name, v in measures.items()}
+    rows = [{"category": k[0], **{name: m[i] for name, m in means.items()}} for i, k in enumerate(keys)]
+    return _top(rows, "ab_pct", top_n)
+
+
+def target_rows(table: Table, target: str, group_by: str, metric: str, filters: dict, top_n: int,
+                top_k) -> list:
+    """
+    Rows of compute_target_aggregation(): the top_n categories by mean rate,
+    each with its stats and its top_k antibodies by rate
+    """
+    values, valid = metric_values(table, metric)
+    mask = filter_mask(table, filters) & table.column("target_1").equals(target)
+    mask &= valid & table.category(group_by).notnull()
+    inverse, keys = group_keys(table, mask, [group_by, "antibody"])
+    if not keys:
+        return []
+    avg = np.array([np.nan if a is None else a for a in group_mean(inverse, len(keys), values[mask])])
+    pct = np.where(np.isnan(avg), 0.0, sql_round(avg))
+
+    # keys are in (category, antibody) order, so category ids follow it too
+    categories = [k[0] for k in keys]
+    starts = np.flatnonzero([i == 0 or categories[i] != categories[i - 1] for i in range(len(keys))])
+    cat = np.repeat(np.arange(len(starts)), np.diff(np.append(starts, len(keys))))
+    counts = np.bincount(cat)
+    means = sql_round(np.bincount(cat, weights=pct) / counts)
+    mins = np.minimum.reduceat(pct, starts)
+    maxs = np.maximum.reduceat(pct, starts)
+
+    # ORDER BY mean DESC, category; then pct DESC, antibody within each
+    order = np.lexsort((np.arange(len(starts)), -means))
+    kept = order[:top_n] if top_n else order
+    rows = []
+    for c in kept.tolist():
+        cells = np.arange(starts[c], starts[c] + counts[c])
+        ranked = cells[np.lexsort((cells, -pct[cells]))]
+        if top_k:
+            ranked = ranked[:top_k]
+        stats = {"category": categories[starts[c]], "mean_pct": float(means[c]), "min_pct": float(mins[c]),
+                 "max_pct": float(maxs[c]), "n_antibodies": int(counts[c])}
+        rows += [{**stats, "antibody": keys[i][1], "pct": float(pct[i])} for i in ranked.tolist()]
+    return rows
@@ -0,0 +1,191 @@
+"""
+Streaming encoders for /api/export.
+
+Rows are pulled from the cursor in fixed-size batches and encoded one batch
+at a time, so memory stays flat no matter how many rows match.
+"""
+import csv
+import io
+import json
+import math
+import zlib
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+    pq = None
+
+from schema import COLUMN_TYPES
+
+EXPORT_BATCH_SIZE = 1000
+# Parquet writes one row group per batch, so columnar formats use larger ones
+COLUMNAR_BATCH_SIZE = 16384
+
+EXPORT_FORMATS = {
+    "csv": ("text/csv", "csv"),
+    "ndjson": ("application/x-ndjson", "ndjson"),
+    "parquet": ("application/vnd.apache.parquet", "parquet"),
+    "arrow": ("application/vnd.apache.arrow.stream", "arrows"),
+}
+ARROW_FORMATS = {"parquet", "arrow"}
+
+
+def csv_chunks(cursor, first_rows: list, columns: list):
+    buf = io.StringIO()
+    writer = csv.writer(buf)
+    writer.writerow(columns)
+    rows = first_rows
+    while rows:
+        writer.writerows(rows)
+        yield buf.getvalue().encode("utf-8")
+        buf.seek(0)
+        buf.truncate(0)
+        rows = cursor.fetchmany(EXPORT_BATCH_SIZE)
+
+
+def gzip_chunks(chunks):
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+def column_types(conn, table: str) -> dict:
+    """
+    Export type per column: the type the column was created with, falling
+    back to COLUMN_TYPES only when it has none. ingest.py stores a
+    COLUMN_TYPES INTEGER column with fractional values as REAL, and the
+    export has to keep those fractions; an INTEGER column that holds any
+    anyway (an undeclared column, or a database built some other way) is
+    exported as REAL too, since the columnar schemas are fixed up front.
+    """
+    result = {}
+    for r in conn.execute(f"PRAGMA table_info({table})").fetchall():
+        declared = (r[2] or "").upper()
+        if not declared and r[1] in COLUMN_TYPES:
+            result[r[1]] = COLUMN_TYPES[r[1]]
+        elif "INT" in declared:
+            result[r[1]] = "INTEGER"
+        elif any(t in declared for t in ("REAL", "FLOA", "DOUB")):
+            result[r[1]] = "REAL"
+        else:
+            result[r[1]] = "TEXT"
+    integers = [c for c, t in result.items() if t == "INTEGER"]
+    if integers:
+        fractional = conn.execute("SELECT " + ", ".join(
+            f"MAX(typeof(\"{c}\") IN ('real', 'text') AND CAST(\"{c}\" AS REAL) <> CAST(\"{c}\" AS INTEGER))"
+            for c in integers
+        ) + f" FROM {table}").fetchone()
+        for c, f in zip(integers, fractional):
+            if f:
+                result[c] = "REAL"
+    return result
+
+
+def _to_int(v):
+    if v is None or isinstance(v, int):
+        return v
+    try:
+        f = float(v)
+    except (TypeError, ValueError):
+        return None
+    return int(f) if f.is_integer() else None
+
+
+def _to_float(v):
+    if v is None:
+        return None
+    try:
+        f = float(v)
+    except (TypeError, ValueError):
+        return None
+    return None if math.isnan(f) else f
+
+
+def _to_text(v):
+    if v is None or isinstance(v, str):
+        return v
+    return str(v)
+
+
+CONVERTERS = {"INTEGER": _to_int, "REAL": _to_float, "TEXT": _to_text}
+
+
+def typed_columns(rows: list, types: list) -> list:
+    """Transpose a batch of rows into per-column lists coerced to their export type"""
+    if not rows:
+        return [[] for _ in types]
+    return [
+        [CONVERTERS[t](v) for v in values]
+        for values, t in zip(zip(*rows), types)
+    ]
+
+
+def ndjson_chunks(cursor, first_rows: list, columns: list, types: list):
+    rows = first_rows
+    while rows:
+        cols = typed_columns(rows, types)
+        lines = [json.dumps(dict(zip(columns, values)), ensure_ascii=False) for values in zip(*cols)]
+        yield ("\n".join(lines) + "\n").encode("utf-8")
+        rows = cursor.fetchmany(EXPORT_BATCH_SIZE)
+
+
+class _ChunkSink:
+    """Write-only file object whose contents are drained after each batch"""
+
+    def __init__(self):
+        self._parts = []
+        self._pos = 0
+        self.closed = False
+
+    def write(self, data):
+        data = bytes(data)
+        self._parts.append(data)
+        self._pos += len(data)
+        return len(data)
+
+    def tell(self):
+        return self._pos
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    def drain(self) -> bytes:
+        data = b"".join(self._parts)
+        self._parts.clear()
+        return data
+
+
+def arrow_schema(columns: list, types: list):
+    arrow_types = {"INTEGER": pa.int64(), "REAL": pa.float64(), "TEXT": pa.string()}
+    return pa.schema([(c, arrow_types[t]) for c, t in zip(columns, types)])
+
+
+def arrow_chunks(cursor, first_rows: list, columns: list, types: list, fmt: str):
+    """Encode batches as Parquet row groups or Arrow IPC stream record batches"""
+    schema = arrow_schema(columns, types)
+    sink = _ChunkSink()
+    if fmt == "parquet":
+        writer = pq.ParquetWriter(sink, schema, compression="zstd")
+    else:
+        writer = pa.ipc.new_stream(sink, schema, options=pa.ipc.IpcWriteOptions(compression="zstd"))
+    rows = first_rows
+    while rows:
+        batch = pa.RecordBatch.from_arrays(
+            [pa.array(values, type=f.type) for values, f in zip(typed_columns(rows, types), schema)],
+            schema=schema,
+        )
+        writer.write_batch(batch)
+        data = sink.drain()
+        if data:
+            yield data
+        rows = cursor.fetchmany(COLUMNAR_BATCH_SIZE)
+    writer.close()
+    yield sink.drain()
@@ -4,11 +4,37 @@ Sheets:
   CTGOV_all                  (source=CTGOV)
   Label_Final, Label_BBW, Label_WAP  (source=FDA)
   Fc Antibody mutations      (Fc mutation information)
+
+Each sheet's content hash is kept in the ingest_state table; a re-run only
+rebuilds the tables whose sheet changed. Work happens in a staging copy that
+is renamed over the live database at the end, so a running API never sees a
+missing or half-built file.
+
+Every fact table carries an antibody_id into antibody_dim, which maps each
+normalized antibody name to the same ID across tables and rebuilds.
 """
+import argparse
+import hashlib
+import itertools
 import sqlite3
 import pandas as pd
 import os
 import json
+import re
+import time
+import zipfile
+from concurrent.futures import ProcessPoolExecutor
+from xml.etree import ElementTree
+
+try:
+    import python_calamine
+except ImportError:
+    python_calamine = None
+
+from schema import (
+    COLUMN_TYPES, CTGOV_RATE_METRIC, FILTERABLE_COLUMNS, LABEL_GRADE_COLUMNS,
+    ROLLUP_DIMENSIONS, ROLLUP_GROUP_COLUMNS, SEARCH_FIELDS, normalize_antibody, table_type,
+)
 
 EXCEL_PATH = os.path.join(os.path.dirname(__file__), "..", "data", "Full_mab_datasets_18Feb26 1.xlsx")
 DB_PATH = os.path.join(os.path.dirname(__file__), "mab_database.sqlite")
@@ -22,7 +48,17 @@ def normalize_col_name(name: str) -> str:
             .replace("?", ""))
 
 
-def clean_df(df: pd.DataFrame) -> pd.DataFrame:
+# Cell values (after trimming) that mean "no value"
+NA_TOKENS = ["NA", "None", ""]
+
+
+def clean_df(df: pd.DataFrame):
+    """
+    Normalize column names and clean every text cell in one pass: trim
+    whitespace, null NA tokens and null formula cells (strings starting with
+    '='). Returns (df, summary) where summary counts, per column, the cells
+    trimmed, NA tokens and formulas that were changed.
+    """
     new_cols = []
     seen = {}
     for c in df.columns:
@@ -34,87 +70,615 @@ def clean_df(df: pd.DataFrame) -> pd.DataFrame:
             seen[normalized] = 0
         new_cols.append(normalized)
     df.columns = new_cols
-    df = df.replace({"NA": None, "None": None, "": None})
-    return df
 
+    text_cols = [c for c in df.columns
+                 if df[c].dtype == object or pd.api.types.is_string_dtype(df[c].dtype)]
+    if not text_cols:
+        return df, {}
+    # All text columns as one column-major Series so each step is a single
+    # vectorized string operation
+    block = df[text_cols].to_numpy(dtype=object)
+    cells = pd.Series(block.ravel(order="F"), dtype=object)
+    stripped = cells.str.strip()
+    is_str = stripped.notna()
+    formula = stripped.str.startswith("=", na=False)
+    na_token = is_str & stripped.isin(NA_TOKENS)
+    trimmed = is_str & ~formula & ~na_token & (stripped != cells)
+    cleaned = stripped.where(is_str, cells).where(~(formula | na_token), None)
+    df[text_cols] = cleaned.to_numpy().reshape(block.shape, order="F")
 
-def ingest():
-    print(f"Reading Excel: {EXCEL_PATH}")
-    sheets = {
-        "ctgov_all": "CTGOV_all",
-        "label_final": "Label_Final",
-        "label_bbw": "Label_BBW",
-        "label_wap": "Label_WAP",
-        "fc_mutations": "Fc Antibody mutations",
+    counts = {
+        name: mask.to_numpy().reshape(block.shape, order="F").sum(axis=0)
+        for name, mask in (("trimmed", trimmed), ("na_tokens", na_token), ("formulas", formula))
     }
+    summary = {}
+    for i, col in enumerate(text_cols):
+        col_counts = {name: int(c[i]) for name, c in counts.items() if c[i]}
+        if col_counts:
+            summary[col] = col_counts
+    return df, summary
+
+
+def coerce_types(df: pd.DataFrame, table_name: str):
+    """
+    Convert the COLUMN_TYPES columns to numbers and declare a SQLite type for
+    every column. Returns (df, schema, failures) where failures maps a column
+    to the number of non-empty cells that could not be read as a number.
+    """
+    schema = {}
+    failures = {}
+    for col in df.columns:
+        declared = COLUMN_TYPES.get(col)
+        if declared is None:
+            dtype = df[col].dtype
+            if pd.api.types.is_bool_dtype(dtype) or pd.api.types.is_integer_dtype(dtype):
+                schema[col] = "INTEGER"
+            elif pd.api.types.is_float_dtype(dtype):
+                schema[col] = "REAL"
+            else:
+                schema[col] = "TEXT"
+            continue
+
+        raw = df[col]
+        text = raw
+        if raw.dtype == object:
+            stripped = raw.str.strip()
+            text = stripped.where(stripped.notna(), raw)
+        numeric = pd.to_numeric(text, errors="coerce")
+        bad = raw.notna() & numeric.isna()
+        if bad.any():
+            failures[col] = int(bad.sum())
+            samples = raw[bad].astype(str).unique()[:5].tolist()
+            print(f"    {table_name}.{col}: {failures[col]} values not numeric, stored as NULL (e.g. {samples})")
+
+        if declared == "INTEGER":
+            present = numeric.dropna()
+            if (present % 1 == 0).all():
+                df[col] = numeric.astype("Int64")
+            else:
+                print(f"    {table_name}.{col}: declared INTEGER but has fractional values, storing as REAL")
+                declared = "REAL"
+                df[col] = numeric.astype("float64")
+        else:
+            df[col] = numeric.astype("float64")
+        schema[col] = declared
+    return df, schema, failures
+
+
+def build_filter_catalog(conn: sqlite3.Connection, table_name: str, columns: list):
+    """Materialize distinct values and row counts of the filterable columns"""
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS filter_catalog (
+            table_name TEXT NOT NULL,
+            column_name TEXT NOT NULL,
+            value,
+            cnt INTEGER NOT NULL
+        )
+    """)
+    conn.execute("DELETE FROM filter_catalog WHERE table_name = ?", [table_name])
+    for col in FILTERABLE_COLUMNS[table_type(table_name)]:
+        if col not in columns:
+            continue
+        conn.execute(
+            f'INSERT INTO filter_catalog (table_name, column_name, value, cnt) '
+            f'SELECT ?, ?, "{col}", COUNT(*) FROM {table_name} WHERE "{col}" IS NOT NULL GROUP BY "{col}"',
+            [table_name, col],
+        )
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_filter_catalog ON filter_catalog(table_name, column_name)")
+
+
+def build_search_index(conn: sqlite3.Connection, table_name: str, columns: list):
+    """Index distinct values of the search fields in a trigram FTS5 table"""
+    conn.execute("""
+        CREATE VIRTUAL TABLE IF NOT EXISTS search_index USING fts5(
+            value, table_name UNINDEXED, field UNINDEXED, cnt UNINDEXED,
+            tokenize = 'trigram'
+        )
+    """)
+    conn.execute("DELETE FROM search_index WHERE table_name = ?", [table_name])
+    for col in SEARCH_FIELDS:
+        if col not in columns:
+            continue
+        conn.execute(
+            f'INSERT INTO search_index (value, table_name, field, cnt) '
+            f'SELECT "{col}", ?, ?, COUNT(*) FROM {table_name} WHERE "{col}" IS NOT NULL GROUP BY "{col}"',
+            [table_name, col],
+        )
+
+
+def rollup_metrics(table_name: str, columns: list) -> list:
+    """(metric name, value expression, row condition) pairs rolled up for a table"""
+    tt = table_type(table_name)
+    if tt == "ctgov":
+        return [(CTGOV_RATE_METRIC, "events_ab * 100.0 / n_ab",
+                 "events_ab IS NOT NULL AND n_ab IS NOT NULL AND n_ab > 0")]
+    if tt == "label":
+        return [(col, f'"{col}"', f'"{col}" IS NOT NULL') for col in LABEL_GRADE_COLUMNS if col in columns]
+    return []
+
+
+def build_rollups(conn: sqlite3.Connection, table_name: str, columns: list):
+    """
+    Materialize count, sum and sum of squares of each AE rate metric per
+    group-by category x antibody x target, so the AE charts can average
+    over the rollup instead of scanning the fact table.
+    """
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS ae_rollup (
+            source_table TEXT NOT NULL,
+            metric TEXT NOT NULL,
+            group_col TEXT NOT NULL,
+            category,
+            antibody,
+            target_1,
+            n INTEGER NOT NULL,
+            total REAL NOT NULL,
+            total_sq REAL NOT NULL
+        )
+    """)
+    conn.execute("DELETE FROM ae_rollup WHERE source_table = ?", [table_name])
+    if not all(d in columns for d in ROLLUP_DIMENSIONS):
+        return
+    dims = ", ".join(ROLLUP_DIMENSIONS)
+    for metric, expr, condition in rollup_metrics(table_name, columns):
+        for g in ROLLUP_GROUP_COLUMNS:
+            if g not in columns:
+                continue
+            conn.execute(
+                f"""INSERT INTO ae_rollup (source_table, metric, group_col, category, {dims}, n, total, total_sq)
+                    SELECT ?, ?, ?, "{g}", {dims}, COUNT(*), SUM({expr}), SUM(({expr}) * ({expr}))
+                    FROM {table_name}
+                    WHERE "{g}" IS NOT NULL AND {condition}
+                    GROUP BY "{g}", {dims}""",
+                [table_name, metric, g],
+            )
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_ae_rollup_antibody ON ae_rollup(source_table, metric, group_col, antibody)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_ae_rollup_target ON ae_rollup(source_table, metric, group_col, target_1)")
+
+
+# Query shapes of the hot endpoints in main.py. An index is derived from each:
+# equality columns first, then the GROUP BY / ORDER BY column, then the columns
+# the query reads, so SQLite can answer it from the index alone. Columns a
+# table lacks are left out of the covering tail; a template whose leading
+# columns are missing is skipped for that table. Only shapes that
+# query_plans.py reports as full scans without their index are listed; check
+# it again before adding one.
+AE_READS = ["events_ab", "n_ab", "events_comp", "n_comp", "all_grades%", "comp_all_grades%"]
+QUERY_TEMPLATES = [
+    # chart_comparative: one antibody, grouped by category. Its leading
+    # antibody column also serves /api/query, /api/studies and the
+    # antibodies-with-comparator list
+    {"eq": ['"antibody"'], "group": ROLLUP_GROUP_COLUMNS, "reads": AE_READS},
+    # chart_cross_dataset (base-table path): one antibody_dim entry
+    {"eq": ['"antibody_id"'], "group": ROLLUP_GROUP_COLUMNS, "reads": ["events_ab", "n_ab", "all_grades%"]},
+    # chart_target_aggregation (base-table path): grouped by category, antibody;
+    # also the DISTINCT target_1 of /api/targets
+    {"eq": ['"target_1"'], "group": ROLLUP_GROUP_COLUMNS, "then": ['"antibody"'],
+     "reads": ["events_ab", "n_ab", "all_grades%"]},
+    # chart_adverse_events: build_where IN (...) on organ_system
+    {"eq": ['"organ_system"'], "reads": ["antibody"]},
+]
+
+
+def _expr_columns(expr: str) -> list:
+    return re.findall(r'"([^"]+)"', expr)
+
+
+def index_plan(columns: list) -> list:
+    """
+    Index key lists for a table. An index whose search columns (everything
+    before the covering tail) lead another index is left out, since SQLite
+    can search that one instead.
+    """
+    present = set(columns)
+    plan = {}
+    for t in QUERY_TEMPLATES:
+        for group in t.get("group") or [None]:
+            search = list(t["eq"])
+            if group:
+                search.append(f'"{group}"')
+            search += t.get("then", [])
+            if not all(c in present for k in search for c in _expr_columns(k)):
+                continue
+            keys = search + [f'"{c}"' for c in t.get("reads", []) if c in present]
+            plan.setdefault(tuple(dict.fromkeys(keys)), list(dict.fromkeys(search)))
+    kept = []
+    for keys in sorted(plan, key=len, reverse=True):
+        search = plan[keys]
+        if not any(list(other[:len(search)]) == search for other in kept):
+            kept.append(keys)
+    return [list(keys) for keys in plan if keys in kept]
+
+
+def index_name(table_name: str, keys: list) -> str:
+    slug = "_".join(re.sub(r"\W+", "_", k.replace("%", "pct")).strip("_").lower() for k in keys)
+    return f"idx_{table_name}_{slug}"
+
+
+def build_indexes(conn: sqlite3.Connection, table_name: str, columns: list) -> list:
+    created = []
+    for keys in index_plan(columns):
+        name = index_name(table_name, keys)
+        conn.execute(f"CREATE INDEX IF NOT EXISTS {name} ON {table_name}({', '.join(keys)})")
+        created.append(name)
+    return created
+
+
+SHEETS = {
+    "ctgov_all": "CTGOV_all",
+    "label_final": "Label_Final",
+    "label_bbw": "Label_BBW",
+    "label_wap": "Label_WAP",
+    "fc_mutations": "Fc Antibody mutations",
+}
+META_PATH = os.path.join(os.path.dirname(__file__), "table_meta.json")
+# calamine (python-calamine) parses xlsx far faster than openpyxl; set
+# MAB_EXCEL_ENGINE=openpyxl to force the pure-Python reader
+EXCEL_ENGINE = os.environ.get("MAB_EXCEL_ENGINE") or ("calamine" if python_calamine else "openpyxl")
+# Worker processes for reading sheets with openpyxl
+LOAD_WORKERS = int(os.environ.get("MAB_INGEST_WORKERS", str(min(len(SHEETS), os.cpu_count() or 1))))
+INSERT_BATCH_SIZE = 5000
+# Key in ingest_state for the hash of the build code itself: a change to
+# ingest.py or schema.py rebuilds every table
+BUILD_KEY = "__build__"
+
+XLSX_NS = "{http://schemas.openxmlformats.org/spreadsheetml/2006/main}"
+XLSX_REL_NS = "{http://schemas.openxmlformats.org/officeDocument/2006/relationships}"
+SHARED_STRING_REF = re.compile(rb'<c\b[^>]*\bt="s"[^>]*>\s*<v>(\d+)</v>')
+
+
+def build_hash() -> str:
+    h = hashlib.sha256()
+    for name in ("ingest.py", "schema.py"):
+        with open(os.path.join(os.path.dirname(__file__), name), "rb") as f:
+            h.update(f.read())
+    return h.hexdigest()
+
+
+def sheet_hashes(path: str) -> dict:
+    """
+    Content hash per sheet, read straight from the xlsx archive: the
+    worksheet XML plus the shared strings its cells reference, so an edit to
+    one sheet doesn't change the others' hashes. Sheets that can't be hashed
+    this way are missing from the result and always rebuilt.
+    """
+    try:
+        with zipfile.ZipFile(path) as z:
+            names = set(z.namelist())
+            workbook = ElementTree.fromstring(z.read("xl/workbook.xml"))
+            rels = ElementTree.fromstring(z.read("xl/_rels/workbook.xml.rels"))
+            targets = {r.get("Id"): r.get("Target") for r in rels}
+            strings = []
+            if "xl/sharedStrings.xml" in names:
+                sst = ElementTree.fromstring(z.read("xl/sharedStrings.xml"))
+                strings = ["".join(t.text or "" for t in si.iter(f"{XLSX_NS}t")).encode("utf-8")
+                           for si in sst.iter(f"{XLSX_NS}si")]
+            hashes = {}
+            for sheet in workbook.iter(f"{XLSX_NS}sheet"):
+                target = targets.get(sheet.get(f"{XLSX_REL_NS}id"), "")
+                member = target.lstrip("/") if target.startswith("/") else "xl/" + target
+                if member not in names:
+                    continue
+                xml = z.read(member)
+                h = hashlib.sha256(xml)
+                for ref in SHARED_STRING_REF.findall(xml):
+                    h.update(b"\0" + strings[int(ref)])
+                hashes[sheet.get("name")] = h.hexdigest()
+    except (zipfile.BadZipFile, KeyError, IndexError, ElementTree.ParseError) as e:
+        print(f"  Could not hash workbook sheets ({e}); rebuilding everything")
+        return {}
+    return {table: hashes[sheet] for table, sheet in SHEETS.items() if sheet in hashes}
+
+
+def previous_state(db_path: str) -> dict:
+    """Sheet hashes recorded by the build currently at db_path"""
+    if not os.path.exists(db_path):
+        return {}
+    conn = sqlite3.connect(db_path)
+    try:
+        return dict(conn.execute("SELECT table_name, sha256 FROM ingest_state").fetchall())
+    except sqlite3.OperationalError:
+        return {}
+    finally:
+        conn.close()
+
 
-    if os.path.exists(DB_PATH):
-        os.remove(DB_PATH)
+def prepare_sheet(table_name: str, df: pd.DataFrame):
+    """Clean a raw sheet and return (df, schema, report) ready to write"""
+    df, cleaning = clean_df(df)
+    totals = {name: sum(c.get(name, 0) for c in cleaning.values())
+              for name in ("trimmed", "na_tokens", "formulas")}
+    print(f"    {table_name}: trimmed {totals['trimmed']} cells, nulled {totals['na_tokens']} "
+          f"NA tokens and {totals['formulas']} formula cells")
+    for col, c in cleaning.items():
+        if c.get("formulas"):
+            print(f"    {table_name}.{col}: nulled {c['formulas']} formula cells")
 
-    conn = sqlite3.connect(DB_PATH)
+    df, schema, failures = coerce_types(df, table_name)
+    return df, schema, {"cleaning": cleaning, "coercion_failures": failures}
+
+
+def load_sheet(path: str, table_name: str):
+    """Read and prepare one sheet (runs in a worker process)"""
+    started = time.perf_counter()
+    df = pd.read_excel(path, sheet_name=SHEETS[table_name], engine="openpyxl")
+    return (table_name, *prepare_sheet(table_name, df), time.perf_counter() - started)
+
+
+def load_sheets(path: str, tables: list) -> dict:
+    """
+    Read the given sheets: table -> (df, schema, report, seconds). calamine
+    parses the workbook once in-process; openpyxl is slow enough that sheets
+    are spread over worker processes instead.
+    """
+    if EXCEL_ENGINE == "openpyxl" and len(tables) > 1 and LOAD_WORKERS > 1:
+        with ProcessPoolExecutor(max_workers=min(LOAD_WORKERS, len(tables))) as executor:
+            results = executor.map(load_sheet, [path] * len(tables), tables)
+            return {r[0]: r[1:] for r in results}
+
+    loaded = {}
+    with pd.ExcelFile(path, engine=EXCEL_ENGINE) as workbook:
+        for table_name in tables:
+            started = time.perf_counter()
+            df = workbook.parse(SHEETS[table_name])
+            loaded[table_name] = (*prepare_sheet(table_name, df), time.perf_counter() - started)
+    return loaded
+
+
+def insert_rows(conn: sqlite3.Connection, table_name: str, df: pd.DataFrame, schema: dict, create: bool = True):
+    """Create a table with the declared column types (unless appending) and bulk-insert df in batches"""
+    if create:
+        cols = ", ".join(f'"{c}" {schema[c]}' for c in df.columns)
+        conn.execute(f"CREATE TABLE {table_name} ({cols})")
+    values = df.astype(object)
+    for col in df.columns:
+        if pd.api.types.is_datetime64_any_dtype(df[col].dtype):
+            # sqlite3 can't bind Timestamps; store them as text like to_sql did
+            values[col] = df[col].astype(str)
+    values = values.where(df.notna(), None)
+    sql = f"INSERT INTO {table_name} VALUES ({', '.join('?' * len(df.columns))})"
+    rows = values.itertuples(index=False, name=None)
+    while batch := list(itertools.islice(rows, INSERT_BATCH_SIZE)):
+        conn.executemany(sql, batch)
+
+
+def previous_antibody_ids(db_path: str) -> dict:
+    """name_norm -> antibody_id of the build currently at db_path, so IDs stay stable"""
+    if not os.path.exists(db_path):
+        return {}
+    conn = sqlite3.connect(db_path)
+    try:
+        return dict(conn.execute("SELECT name_norm, antibody_id FROM antibody_dim").fetchall())
+    except sqlite3.OperationalError:
+        return {}
+    finally:
+        conn.close()
+
+
+def assign_antibody_ids(df: pd.DataFrame, schema: dict, ids: dict):
+    """Add the antibody_id column, giving names not seen before the next free IDs in ids"""
+    if "antibody" not in df.columns:
+        return df, schema
+    keys = df["antibody"].map(normalize_antibody)
+    next_id = max(ids.values(), default=0) + 1
+    for key in sorted(set(keys.dropna()) - ids.keys()):
+        ids[key] = next_id
+        next_id += 1
+    df = df.assign(antibody_id=keys.map(ids).astype("Int64"))
+    return df, {**schema, "antibody_id": "INTEGER"}
+
+
+def build_antibody_dim(conn: sqlite3.Connection, ids: dict):
+    """
+    One row per normalized antibody name across every fact table: the most
+    common spelling and antibody_clean, all raw spellings, and row counts per
+    table. Names no table has any more keep their row so their ID stays put.
+    """
+    spellings, cleaned, counts = {}, {}, {}
+    for table_name in SHEETS:
+        columns = [r[1] for r in conn.execute(f"PRAGMA table_info({table_name})").fetchall()]
+        if "antibody_id" not in columns:
+            continue
+        clean_col = '"antibody_clean"' if "antibody_clean" in columns else "NULL"
+        rows = conn.execute(
+            f"SELECT antibody_id, antibody, {clean_col}, COUNT(*) FROM {table_name} "
+            f"WHERE antibody_id IS NOT NULL GROUP BY 1, 2, 3"
+        ).fetchall()
+        for antibody_id, raw, clean, n in rows:
+            spelling = spellings.setdefault(antibody_id, {})
+            spelling[raw] = spelling.get(raw, 0) + n
+            if clean is not None:
+                names = cleaned.setdefault(antibody_id, {})
+                names[clean] = names.get(clean, 0) + n
+            per_table = counts.setdefault(antibody_id, {})
+            per_table[table_name] = per_table.get(table_name, 0) + n
+
+    def most_common(values: dict):
+        return max(sorted(values), key=values.get) if values else None
+
+    count_cols = [f"n_{t}" for t in SHEETS]
+    conn.execute("DROP TABLE IF EXISTS antibody_dim")
+    conn.execute(f"""
+        CREATE TABLE antibody_dim (
+            antibody_id INTEGER PRIMARY KEY,
+            name_norm TEXT NOT NULL UNIQUE,
+            display TEXT NOT NULL,
+            antibody_clean TEXT,
+            aliases TEXT NOT NULL,
+            {", ".join(f"{c} INTEGER NOT NULL" for c in count_cols)}
+        )
+    """)
+    conn.executemany(
+        f"INSERT INTO antibody_dim VALUES ({', '.join('?' * (5 + len(count_cols)))})",
+        [
+            (antibody_id, name, most_common(spellings.get(antibody_id, {})) or name,
+             most_common(cleaned.get(antibody_id, {})), json.dumps(sorted(spellings.get(antibody_id, {}))),
+             *[counts.get(antibody_id, {}).get(t, 0) for t in SHEETS])
+            for name, antibody_id in sorted(ids.items(), key=lambda item: item[1])
+        ],
+    )
+
+
+def write_table(conn: sqlite3.Connection, table_name: str, df: pd.DataFrame, schema: dict) -> list:
+    """(Re)create a fact table and everything derived from it; returns its indexes"""
+    conn.execute(f"DROP TABLE IF EXISTS {table_name}")
+    insert_rows(conn, table_name, df, schema)
+    return build_derived(conn, table_name, list(df.columns))
+
+
+def build_derived(conn: sqlite3.Connection, table_name: str, columns: list) -> list:
+    """Catalog, search index, rollups and indexes of a written fact table; returns its indexes"""
+    build_filter_catalog(conn, table_name, columns)
+    build_search_index(conn, table_name, columns)
+    build_rollups(conn, table_name, columns)
+    return build_indexes(conn, table_name, columns)
+
+
+def record_state(conn: sqlite3.Connection, state: dict):
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS ingest_state (
+            table_name TEXT PRIMARY KEY,
+            sha256 TEXT,
+            built_at TEXT NOT NULL
+        )
+    """)
+    now = time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime())
+    conn.executemany(
+        "INSERT OR REPLACE INTO ingest_state (table_name, sha256, built_at) VALUES (?, ?, ?)",
+        [(t, h, now) for t, h in state.items()],
+    )
+
+
+def stage_database(db_path: str, incremental: bool) -> str:
+    """Start a staging copy next to db_path: a snapshot of the live build, or empty"""
+    staging = db_path + ".staging"
+    for leftover in (staging, staging + "-journal"):
+        if os.path.exists(leftover):
+            os.remove(leftover)
+    if incremental:
+        src = sqlite3.connect(db_path)
+        dst = sqlite3.connect(staging)
+        try:
+            src.backup(dst)
+        finally:
+            dst.close()
+            src.close()
+    return staging
+
+
+def stage_meta(all_table_info: dict) -> str:
+    """Write the new build's table_meta.json next to it, for publish() to swap in"""
+    staged = META_PATH + ".staging"
+    with open(staged, "w") as f:
+        json.dump(all_table_info, f, indent=2)
+    return staged
+
+
+def publish(staging: str, db_path: str, staged_meta: str):
+    # The staging file is written with synchronous=OFF; make it durable first
+    fd = os.open(staging, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+    # os.replace is an atomic rename: readers see either the old build or
+    # the new one, and handles already open keep reading the old inode
+    # until the connection pool notices the new fingerprint. The metadata
+    # is swapped in right behind it; the API reads columns from the
+    # database itself, never from table_meta.json.
+    os.replace(staging, db_path)
+    os.replace(staged_meta, META_PATH)
+
+
+def ingest(full: bool = False):
+    print(f"Reading Excel: {EXCEL_PATH}")
+    hashes = sheet_hashes(EXCEL_PATH)
+    code_hash = build_hash()
+    previous = {} if full else previous_state(DB_PATH)
+    incremental = bool(previous) and previous.get(BUILD_KEY) == code_hash
+    if incremental:
+        changed = [t for t in SHEETS if hashes.get(t) is None or previous.get(t) != hashes[t]]
+    else:
+        changed = list(SHEETS)
+    if not changed:
+        print("All sheets unchanged; database is up to date")
+        return
 
     all_table_info = {}
+    if incremental and os.path.exists(META_PATH):
+        with open(META_PATH) as f:
+            all_table_info = json.load(f)
+    kept = [t for t in SHEETS if t not in changed]
+    if incremental and any(t not in all_table_info for t in kept):
+        # table_meta.json would lose the tables this run doesn't touch
+        print(f"  No metadata for unchanged tables in {META_PATH}; rebuilding everything")
+        incremental, changed, all_table_info = False, list(SHEETS), {}
+    elif incremental:
+        print(f"  Rebuilding changed sheets only: {', '.join(changed)}")
+
+    staging = stage_database(DB_PATH, incremental)
+    # The staging file is thrown away on failure, so skip the rollback journal
+    # and fsyncs while loading and write everything in one transaction
+    conn = sqlite3.connect(staging, isolation_level=None)
+    conn.execute("PRAGMA journal_mode = MEMORY")
+    conn.execute("PRAGMA synchronous = OFF")
 
-    for table_name, sheet_name in sheets.items():
-        print(f"  Loading sheet: {sheet_name} -> table: {table_name}")
-        df = pd.read_excel(EXCEL_PATH, sheet_name=sheet_name, engine="openpyxl")
-        df = clean_df(df)
-
-        # Drop formula columns (they show up as strings starting with '=')
-        for idx, col in enumerate(df.columns):
-            series = df.iloc[:, idx]
-            if series.dtype == object:
-                sample = series.dropna().head(10)
-                if len(sample) > 0 and sample.astype(str).str.startswith("=").any():
-                    print(f"    Dropping formula column: {col}")
-                    df.iloc[:, idx] = None
-
-        df.to_sql(table_name, conn, if_exists="replace", index=False)
+    started = time.perf_counter()
+    print(f"  Reading {len(changed)} sheet(s) with {EXCEL_ENGINE}")
+    loaded = load_sheets(EXCEL_PATH, changed)
+    antibody_ids = previous_antibody_ids(DB_PATH)
+    conn.execute("BEGIN")
+    for table_name in changed:
+        df, schema, report, read_seconds = loaded.pop(table_name)
+        df, schema = assign_antibody_ids(df, schema, antibody_ids)
+        print(f"  Writing sheet: {SHEETS[table_name]} -> table: {table_name}")
+        write_started = time.perf_counter()
+        indexes = write_table(conn, table_name, df, schema)
         all_table_info[table_name] = {
             "rows": len(df),
             "columns": list(df.columns),
+            "schema": schema,
+            **report,
+            "sha256": hashes.get(table_name),
         }
-        print(f"    -> {len(df)} rows, {len(df.columns)} columns")
-
-    common_indexes = [
-        ("antibody", ["ctgov_all", "label_final", "label_bbw", "label_wap", "fc_mutations"]),
-        ("organ_system", ["ctgov_all", "label_final", "label_bbw", "label_wap"]),
-        ("adverse_event_term", ["ctgov_all", "label_final", "label_bbw", "label_wap"]),
-        ("condition", ["ctgov_all", "label_final", "label_bbw", "label_wap"]),
-        ("general_molecular_category", ["ctgov_all", "label_final", "label_bbw", "label_wap"]),
-        ("record_category", ["ctgov_all", "label_final", "label_bbw", "label_wap"]),
-        ("source", ["ctgov_all"]),
-    ]
-    for col, tables in common_indexes:
-        for t in tables:
-            try:
-                conn.execute(f"CREATE INDEX IF NOT EXISTS idx_{t}_{col} ON {t}({col})")
-            except Exception as e:
-                print(f"    Index skip {t}.{col}: {e}")
-
-    conn.commit()
-
-    # Save metadata
-    meta_path = os.path.join(os.path.dirname(__file__), "table_meta.json")
-    with open(meta_path, "w") as f:
-        json.dump(all_table_info, f, indent=2)
-    print(f"\nMetadata saved to {meta_path}")
+        print(f"    -> {len(df)} rows, {len(df.columns)} columns, {len(indexes)} indexes "
+              f"(read {read_seconds:.2f}s, write {time.perf_counter() - write_started:.2f}s)")
+
+    # Unchanged tables keep their antibody_id values, so the dimension is
+    # rebuilt from all of them whenever any one changes
+    build_antibody_dim(conn, antibody_ids)
+    print(f"  antibody_dim: {len(antibody_ids)} antibodies")
+    record_state(conn, {**{t: hashes.get(t) for t in changed}, BUILD_KEY: code_hash})
+    conn.execute("ANALYZE")
+    conn.execute("COMMIT")
+    if incremental:
+        # Reclaim the pages of the dropped tables
+        conn.execute("VACUUM")
+    print(f"  Built in {time.perf_counter() - started:.2f}s")
 
     # Print unique value counts for key filter fields
     print("\n--- Filter field cardinality ---")
-    for col in ["antibody", "general_molecular_category", "format_general_category",
-                 "isotype_fc", "record_category", "target_1", "moa_new",
-                 "organ_system", "condition", "phase"]:
-        try:
-            cur = conn.execute(f"SELECT COUNT(DISTINCT {col}) FROM ctgov_all WHERE {col} IS NOT NULL")
-            count = cur.fetchone()[0]
-            print(f"  ctgov_all.{col}: {count} distinct values")
-        except Exception:
-            pass
-
+    rows = conn.execute(
+        "SELECT column_name, COUNT(*) FROM filter_catalog WHERE table_name = 'ctgov_all' GROUP BY column_name"
+    ).fetchall()
+    for col, count in rows:
+        print(f"  ctgov_all.{col}: {count} distinct values")
     conn.close()
+    staged_meta = stage_meta({t: all_table_info[t] for t in SHEETS if t in all_table_info})
+
+    print("\n--- Query plan check ---")
+    from query_plans import check_query_plans
+    flagged = check_query_plans(staging)
+    for endpoint, sql, plan in flagged:
+        print(f"  FULL SCAN in {endpoint}: {sql}")
+    print(f"  {len(flagged)} full scan(s) in hot endpoint queries")
+
+    publish(staging, DB_PATH, staged_meta)
     print(f"\nDatabase saved to {DB_PATH}")
+    print(f"Metadata saved to {META_PATH}")
 
 
 if __name__ == "__main__":
-    ingest()
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--full", action="store_true", help="rebuild every sheet even if unchanged")
+    ingest(full=parser.parse_args().full)
@@ -0,0 +1,407 @@
+"""
+Per-request SQL instrumentation: statement timings, slow-query log, metrics.
+
+Pooled connections are InstrumentedConnections, whose cursors time every
+statement from execute() to the last fetch. Each statement is tagged with
+the route of the request that ran it (a context variable set by
+InstrumentationMiddleware and carried onto the SQLite threads by run_in) and
+with its SQL template: the statement with literals and IN-lists folded, so
+the same query shape aggregates across filter values. Statements slower
+than SLOW_QUERY_MS get their EXPLAIN QUERY PLAN written to a rotating JSON
+lines log. Responses carry a Server-Timing header with the request's SQL
+time, and render_metrics() serves everything in Prometheus text format.
+
+Rows scanned aren't visible from Python; vm_steps (SQLite VM instructions,
+counted by the deadline() progress handler in PROGRESS_STEPS units) stands
+in for them.
+"""
+import contextvars
+import functools
+import hashlib
+import json
+import logging
+import logging.handlers
+import os
+import re
+import sqlite3
+import threading
+import time
+
+from starlette.routing import Match
+
+from db import PooledConnection
+
+INSTRUMENT = os.environ.get("MAB_INSTRUMENT", "1") == "1"
+# Statements at least this slow are EXPLAINed and logged
+SLOW_QUERY_MS = float(os.environ.get("MAB_SLOW_QUERY_MS", "250"))
+# Empty to keep slow statements out of a file (they are still counted)
+SLOW_QUERY_LOG = os.environ.get("MAB_SLOW_QUERY_LOG", os.path.join(os.path.dirname(__file__), "slow_queries.log"))
+SLOW_QUERY_LOG_BYTES = int(os.environ.get("MAB_SLOW_QUERY_LOG_BYTES", str(10 * 1024 * 1024)))
+SLOW_QUERY_LOG_BACKUPS = int(os.environ.get("MAB_SLOW_QUERY_LOG_BACKUPS", "5"))
+# Distinct (endpoint, template) series kept before new ones fold into "other"
+MAX_SERIES = 2000
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+PROMETHEUS_CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+_STRING = re.compile(r"'(?:[^']|'')*'")
+_NUMBER = re.compile(r"\b\d+(?:\.\d+)?\b")
+_IN_LIST = re.compile(r"\(\s*\?(?:\s*,\s*\?)+\s*\)")
+
+
+@functools.lru_cache(maxsize=4096)
+def sql_template(sql: str) -> str:
+    """The statement with whitespace collapsed and literals and IN-lists folded to ?"""
+    template = " ".join(sql.split())
+    template = _STRING.sub("?", template)
+    template = _NUMBER.sub("?", template)
+    return _IN_LIST.sub("(?, ...)", template)
+
+
+def template_id(template: str) -> str:
+    return hashlib.sha1(template.encode()).hexdigest()[:12]
+
+
+class Histogram:
+    __slots__ = ("counts", "count", "total")
+
+    def __init__(self):
+        self.counts = [0] * len(BUCKETS)
+        self.count = 0
+        self.total = 0.0
+
+    def observe(self, seconds: float):
+        self.count += 1
+        self.total += seconds
+        for i, bound in enumerate(BUCKETS):
+            if seconds <= bound:
+                self.counts[i] += 1
+                break
+
+
+class Registry:
+    """Request and statement counters, kept in process for /api/metrics"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.requests = {}
+        self.request_seconds = {}
+        self.statements = {}
+        self.templates = {}
+
+    def observe_request(self, method: str, endpoint: str, status: int, seconds: float):
+        with self._lock:
+            key = (method, endpoint, str(status))
+            self.requests[key] = self.requests.get(key, 0) + 1
+            self.request_seconds.setdefault(endpoint, Histogram()).observe(seconds)
+
+    def observe_statement(self, endpoint: str, template: str, seconds: float, rows: int, vm_steps: int, slow: bool):
+        tid = template_id(template)
+        with self._lock:
+            key = (endpoint, tid)
+            series = self.statements.get(key)
+            if series is None:
+                if len(self.statements) >= MAX_SERIES:
+                    key, tid, template = ("other", "other"), "other", "other"
+                    series = self.statements.get(key)
+                if series is None:
+                    series = self.statements[key] = {"hist": Histogram(), "rows": 0, "vm_steps": 0, "slow": 0}
+                self.templates[tid] = template
+            series["hist"].observe(seconds)
+            series["rows"] += rows
+            series["vm_steps"] += vm_steps
+            series["slow"] += slow
+
+    def snapshot(self) -> tuple:
+        with self._lock:
+            copy = lambda h: (list(h.counts), h.count, h.total)
+            return (
+                dict(self.requests),
+                {e: copy(h) for e, h in self.request_seconds.items()},
+                {k: {**s, "hist": copy(s["hist"])} for k, s in self.statements.items()},
+                dict(self.templates),
+            )
+
+
+registry = Registry()
+
+
+class RequestTiming:
+    """SQL time of one request, for its Server-Timing header"""
+
+    def __init__(self, endpoint: str):
+        self.endpoint = endpoint
+        self.started = time.perf_counter()
+        self._lock = threading.Lock()
+        self.sql_seconds = 0.0
+        self.statements = 0
+        self.slow = 0
+
+    def add(self, seconds: float, slow: bool):
+        with self._lock:
+            self.sql_seconds += seconds
+            self.statements += 1
+            self.slow += slow
+
+    def header(self) -> str:
+        with self._lock:
+            desc = f"{self.statements} statements" + (f", {self.slow} slow" if self.slow else "")
+            db = f'db;dur={self.sql_seconds * 1000:.3f};desc="{desc}"'
+        return f"{db}, app;dur={(time.perf_counter() - self.started) * 1000:.3f}"
+
+
+current_request = contextvars.ContextVar("current_request", default=None)
+
+_slow_log = None
+_slow_log_lock = threading.Lock()
+
+
+def slow_query_logger():
+    global _slow_log
+    with _slow_log_lock:
+        if _slow_log is None:
+            logger = logging.getLogger("mab.slow_queries")
+            logger.setLevel(logging.INFO)
+            logger.propagate = False
+            if SLOW_QUERY_LOG:
+                handler = logging.handlers.RotatingFileHandler(
+                    SLOW_QUERY_LOG, maxBytes=SLOW_QUERY_LOG_BYTES, backupCount=SLOW_QUERY_LOG_BACKUPS)
+                handler.setFormatter(logging.Formatter("%(message)s"))
+                logger.addHandler(handler)
+            _slow_log = logger
+        return _slow_log
+
+
+def query_plan(conn: sqlite3.Connection, sql: str, params) -> list:
+    if not sql.lstrip().upper().startswith(("SELECT", "WITH")):
+        return []
+    try:
+        rows = sqlite3.Connection.execute(conn, "EXPLAIN QUERY PLAN " + sql, params).fetchall()
+    except sqlite3.Error as e:
+        return [f"unavailable: {e}"]
+    return [r[3] for r in rows]
+
+
+class Statement:
+    __slots__ = ("conn", "sql", "params", "timing", "endpoint", "vm_start", "seconds", "rows", "failed", "done")
+
+    def __init__(self, conn: PooledConnection, sql: str, params):
+        timing = current_request.get()
+        self.conn = conn
+        self.sql = sql
+        self.params = params
+        self.timing = timing
+        self.endpoint = timing.endpoint if timing else "background"
+        self.vm_start = conn.vm_steps
+        self.seconds = 0.0
+        self.rows = 0
+        self.failed = False
+        self.done = False
+
+    def finish(self):
+        if self.done:
+            return
+        self.done = True
+        template = sql_template(self.sql)
+        vm_steps = self.conn.vm_steps - self.vm_start
+        slow = self.seconds * 1000 >= SLOW_QUERY_MS
+        registry.observe_statement(self.endpoint, template, self.seconds, self.rows, vm_steps, slow)
+        if self.timing is not None:
+            self.timing.add(self.seconds, slow)
+        if slow:
+            slow_query_logger().info(json.dumps({
+                "at": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+                "endpoint": self.endpoint,
+                "ms": round(self.seconds * 1000, 3),
+                "rows": self.rows,
+                "vm_steps": vm_steps,
+                "failed": self.failed,
+                "template": template,
+                "template_id": template_id(template),
+                "params": [p if isinstance(p, (int, float)) or p is None else str(p)[:200]
+                           for p in (self.params or [])][:50],
+                "fingerprint": self.conn.fingerprint,
+                "plan": query_plan(self.conn, self.sql, self.params),
+            }, default=str))
+
+
+class InstrumentedCursor(sqlite3.Cursor):
+    """Cursor that times its statement across execute() and every fetch"""
+    statement = None
+
+    def _timed(self, fn, *args):
+        started = time.perf_counter()
+        try:
+            result = fn(*args)
+        except StopIteration:
+            self.statement.seconds += time.perf_counter() - started
+            raise
+        except BaseException:
+            self.statement.seconds += time.perf_counter() - started
+            self.statement.failed = True
+            self._finish()
+            raise
+        self.statement.seconds += time.perf_counter() - started
+        return result
+
+    def _finish(self):
+        if self.statement is not None:
+            self.statement.finish()
+
+    def execute(self, sql, params=()):
+        self._finish()
+        self.statement = Statement(self.connection, sql, params)
+        self._timed(super().execute, sql, params)
+        if self.description is None:
+            # No result rows to fetch
+            self._finish()
+        return self
+
+    def fetchone(self):
+        row = self._timed(super().fetchone)
+        if row is None:
+            self._finish()
+        else:
+            self.statement.rows += 1
+        return row
+
+    def fetchmany(self, size=None):
+        size = self.arraysize if size is None else size
+        rows = self._timed(super().fetchmany, size)
+        self.statement.rows += len(rows)
+        if len(rows) < size:
+            self._finish()
+        return rows
+
+    def fetchall(self):
+        rows = self._timed(super().fetchall)
+        self.statement.rows += len(rows)
+        self._finish()
+        return rows
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        try:
+            row = self._timed(super().__next__)
+        except StopIteration:
+            self._finish()
+            raise
+        self.statement.rows += 1
+        return row
+
+    def close(self):
+        self._finish()
+        super().close()
+
+    def __del__(self):
+        try:
+            self._finish()
+        except Exception:
+            pass
+
+
+class InstrumentedConnection(PooledConnection):
+    def execute(self, sql, params=()):
+        return self.cursor(InstrumentedCursor).execute(sql, params)
+
+
+def route_template(scope) -> str:
+    """The path template of the route a request matches, so path parameters don't split series"""
+    app = scope.get("app")
+    for route in getattr(getattr(app, "router", None), "routes", []):
+        match, _ = route.matches(scope)
+        if match == Match.FULL:
+            return route.path
+    return "unmatched"
+
+
+class InstrumentationMiddleware:
+    """ASGI middleware: tags a request's SQL with its route and adds Server-Timing"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        timing = RequestTiming(route_template(scope))
+        token = current_request.set(timing)
+        status = 500
+
+        async def send_timed(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                # Streamed bodies run SQL after this point; the header has what ran before
+                headers = [*message.get("headers", []), (b"server-timing", timing.header().encode())]
+                message = {**message, "headers": headers}
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_timed)
+        finally:
+            current_request.reset(token)
+            registry.observe_request(scope["method"], timing.endpoint, status, time.perf_counter() - timing.started)
+
+
+def _label(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(**labels) -> str:
+    return "{" + ",".join(f'{k}="{_label(v)}"' for k, v in labels.items()) + "}"
+
+
+def _histogram(lines: list, name: str, hist: tuple, **labels):
+    counts, count, total = hist
+    cumulative = 0
+    for bound, n in zip(BUCKETS, counts):
+        cumulative += n
+        lines.append(f"{name}_bucket{_labels(**labels, le=bound)} {cumulative}")
+    lines.append(f"{name}_bucket{_labels(**labels, le='+Inf')} {count}")
+    lines.append(f"{name}_sum{_labels(**labels)} {total:.6f}")
+    lines.append(f"{name}_count{_labels(**labels)} {count}")
+
+
+def render_metrics(gauges: dict) -> str:
+    """
+    Prometheus text exposition of the registry; gauges maps a metric prefix
+    to a dict of values (e.g. pool.metrics()), of which the numeric ones are
+    exported as {prefix}_{key}.
+    """
+    requests, request_seconds, statements, templates = registry.snapshot()
+    lines = [
+        "# HELP mab_http_requests_total HTTP requests by route and status.",
+        "# TYPE mab_http_requests_total counter",
+    ]
+    for (method, endpoint, status), n in sorted(requests.items()):
+        lines.append(f"mab_http_requests_total{_labels(method=method, endpoint=endpoint, status=status)} {n}")
+    lines += ["# HELP mab_http_request_duration_seconds HTTP request time until the response completes.",
+              "# TYPE mab_http_request_duration_seconds histogram"]
+    for endpoint, hist in sorted(request_seconds.items()):
+        _histogram(lines, "mab_http_request_duration_seconds", hist, endpoint=endpoint)
+
+    lines += ["# HELP mab_sql_statement_duration_seconds SQLite time per statement, execute through last fetch.",
+              "# TYPE mab_sql_statement_duration_seconds histogram"]
+    for (endpoint, tid), s in sorted(statements.items()):
+        _histogram(lines, "mab_sql_statement_duration_seconds", s["hist"], endpoint=endpoint, template=tid)
+    for name, key, help_text in [
+        ("mab_sql_rows_total", "rows", "Rows fetched."),
+        ("mab_sql_vm_steps_total", "vm_steps", "SQLite VM instructions (approximate), a proxy for rows scanned."),
+        ("mab_sql_slow_statements_total", "slow", f"Statements slower than {SLOW_QUERY_MS:g} ms."),
+    ]:
+        lines += [f"# HELP {name} {help_text}", f"# TYPE {name} counter"]
+        for (endpoint, tid), s in sorted(statements.items()):
+            lines.append(f"{name}{_labels(endpoint=endpoint, template=tid)} {s[key]}")
+    lines += ["# HELP mab_sql_template_info SQL text of each template label.",
+              "# TYPE mab_sql_template_info gauge"]
+    for tid, template in sorted(templates.items()):
+        lines.append(f"mab_sql_template_info{_labels(template=tid, sql=template)} 1")
+
+    for prefix, values in gauges.items():
+        for key, value in values.items():
+            if isinstance(value, (int, float)) and not isinstance(value, bool):
+                name = f"{prefix}_{re.sub(r'[^a-zA-Z0-9_]', '_', key)}"
+                lines += [f"# TYPE {name} gauge", f"{name} {value}"]
+    return "\n".join(lines) + "\n"
@@ -1,47 +1,144 @@
 import sqlite3
-import csv
-import io
+import asyncio
+import base64
+import hashlib
+import json
 import os
-import math
+import threading
+import time
+from contextlib import asynccontextmanager, contextmanager
 from typing import Optional
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Request, Response
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.responses import StreamingResponse, FileResponse
 from fastapi.staticfiles import StaticFiles
-from pydantic import BaseModel
+from pydantic import BaseModel, ValidationError
+import numpy as np
+
+import engine
+import instrument
+import payload
+from bitmaps import built_index, warm_indexes
+from cache import ResultCache, cache_key, spec_key
+from db import (
+    EXPORT_TIMEOUT, QUERY_TIMEOUT, DatabaseMissing, PoolTimeout, QueryTimeout, bulk_executor,
+    deadline, export_pool, interactive_executor, pool, run_in,
+)
+from export import (
+    ARROW_FORMATS, COLUMNAR_BATCH_SIZE, EXPORT_BATCH_SIZE, EXPORT_FORMATS,
+    arrow_chunks, column_types, csv_chunks, gzip_chunks, ndjson_chunks, pa,
+)
+from schema import (
+    CTGOV_RATE_METRIC, FILTERABLE_COLUMNS, LABEL_GRADE_COLUMNS, ROLLUP_DIMENSIONS,
+    ROLLUP_GROUP_COLUMNS, SUMMARY_COLUMNS, VALID_TABLES, normalize_antibody, table_type,
+)
+from stats import MH_SUMS, mantel_haenszel_rr, rounded
 
-DB_PATH = os.path.join(os.path.dirname(__file__), "mab_database.sqlite")
 STATIC_DIR = os.path.join(os.path.dirname(__file__), "static")
-VALID_TABLES = ["ctgov_all", "label_final", "label_bbw", "label_wap", "fc_mutations"]
-
-FILTERABLE_COLUMNS = {
-    "ctgov": [
-        "antibody", "general_molecular_category", "format_general_category",
-        "isotype_fc", "record_category", "target_1", "condition",
-        "organ_system", "phase", "moa_new", "event_type", "source",
-        "target_harmonized_new", "target_supercluster", "mesh_class",
-        "has_comparator", "is_single_arm",
-    ],
-    "label": [
-        "antibody", "general_molecular_category", "format_general_category",
-        "isotype_fc", "record_category", "target_1", "condition",
-        "organ_system", "moa_new", "source", "bbw", "wap",
-    ],
-    "fc_mutations": [
-        "antibody", "heavy_chain", "gene", "species", "effect",
-    ],
-}
+# Answer AE charts from the ae_rollup table when the filters allow; set to 0
+# to force every chart onto the base tables (e.g. to diff the two paths)
+USE_ROLLUPS = os.environ.get("MAB_USE_ROLLUPS", "1") == "1"
+# Answer facet counts from the in-memory bitmap index once it is built in the
+# background (SQL until then); set to 0 to always use the grouped SQL pass
+USE_BITMAP_INDEX = os.environ.get("MAB_BITMAP_INDEX", "1") == "1"
+# How many of the most requested chart specs to recompute after a rebuild
+CACHE_WARM_TOP = int(os.environ.get("MAB_CACHE_WARM_TOP", "50"))
+
+
+def load_memory():
+    """Load the memory engine's tables and build the bitmap indexes, as configured"""
+    with db_connection() as conn:
+        if engine.ENGINE == "memory":
+            engine.store.load_all(conn)
+        if USE_BITMAP_INDEX:
+            warm_indexes(conn)
+
+
+def _load_memory_quietly():
+    try:
+        load_memory()
+    except HTTPException:
+        pass
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # The memory engine and the bitmap indexes load in the background so
+    # startup isn't held up; charts requested before the engine finishes load
+    # what they need, and facet counts use SQL until their index is built.
+    if engine.ENGINE == "memory" or USE_BITMAP_INDEX:
+        bulk_executor.submit(_load_memory_quietly)
+    yield
+
 
-app = FastAPI(title="Therapeutic Antibody Commons API")
+app = FastAPI(title="Therapeutic Antibody Commons API", lifespan=lifespan, default_response_class=payload.JSONBody)
 app.add_middleware(CORSMiddleware, allow_origins=["*"], allow_methods=["*"], allow_headers=["*"])
+if instrument.INSTRUMENT:
+    # Time every statement and tag it with the route that ran it
+    pool.factory = instrument.InstrumentedConnection
+    export_pool.factory = instrument.InstrumentedConnection
+    app.add_middleware(instrument.InstrumentationMiddleware)
+# Outermost, so timings and metrics don't include compressing the body
+app.add_middleware(payload.CompressionMiddleware)
+
+
+def acquire_connection() -> sqlite3.Connection:
+    try:
+        return pool.acquire()
+    except DatabaseMissing:
+        raise HTTPException(500, "Database not found. Run ingest.py first.")
+    except PoolTimeout:
+        raise HTTPException(503, "Database busy, try again shortly.")
 
 
-def get_conn():
-    if not os.path.exists(DB_PATH):
+def acquire_export_connection() -> sqlite3.Connection:
+    try:
+        return export_pool.acquire()
+    except DatabaseMissing:
         raise HTTPException(500, "Database not found. Run ingest.py first.")
-    conn = sqlite3.connect(DB_PATH)
-    conn.row_factory = sqlite3.Row
-    return conn
+    except PoolTimeout:
+        raise HTTPException(503, "Too many exports in progress, try again shortly.")
+
+
+@contextmanager
+def db_connection():
+    conn = acquire_connection()
+    try:
+        yield conn
+    finally:
+        pool.release(conn)
+
+
+def with_db(fn, args: tuple, expires: float):
+    """Run fn(conn, *args) on a pooled connection, cancelling SQLite work at expires"""
+    if time.monotonic() > expires:
+        raise HTTPException(503, "Server busy, try again shortly.")
+    with db_connection() as conn:
+        try:
+            with deadline(conn, expires):
+                return fn(conn, *args)
+        except QueryTimeout:
+            raise HTTPException(504, "Query took too long and was cancelled.")
+
+
+async def run_query(fn, *args, timeout: float = QUERY_TIMEOUT):
+    """Await fn(conn, *args) on the interactive executor; the timeout counts queueing too"""
+    return await run_in(interactive_executor, with_db, fn, args, time.monotonic() + timeout)
+
+
+def current_fingerprint() -> str:
+    try:
+        return pool.fingerprint
+    except DatabaseMissing:
+        raise HTTPException(500, "Database not found. Run ingest.py first.")
+
+
+def etag_matches(request: Request, etag: str) -> bool:
+    header = request.headers.get("if-none-match")
+    if not header:
+        return False
+    tags = [t.strip().removeprefix("W/") for t in header.split(",")]
+    return "*" in tags or etag in tags
 
 
 def validate_table(table: str):
@@ -53,13 +150,26 @@ def quote_col(col: str) -> str:
     return f'"{col}"'
 
 
-def table_type(table: str) -> str:
-    if table.startswith("ctgov"):
-        return "ctgov"
-    elif table == "fc_mutations":
-        return "fc_mutations"
-    else:
-        return "label"
+def antibody_search_clause(table: str, term: str):
+    """Substring match on antibody, resolved through the trigram search_index"""
+    # LIKE on a trigram FTS5 column is answered from the index, and the
+    # resulting handful of antibody names then hit the antibody-led indexes.
+    clause = (f'{quote_col("antibody")} IN (SELECT value FROM search_index '
+              f"WHERE value LIKE ? AND table_name = ? AND field = 'antibody')")
+    return clause, [f"%{term}%", table]
+
+
+def search_antibodies(conn: sqlite3.Connection, table: str, term: str) -> list:
+    """Antibody names an antibody search matches, as antibody_search_clause() does"""
+    rows = conn.execute(
+        "SELECT value FROM search_index WHERE value LIKE ? AND table_name = ? AND field = 'antibody'",
+        [f"%{term}%", table],
+    ).fetchall()
+    return [r[0] for r in rows]
+
+
+def fts_phrase(term: str) -> str:
+    return '"' + term.replace('"', '""') + '"'
 
 
 def build_where(table: str, filters: dict, search: Optional[str] = None):
@@ -72,12 +182,58 @@ def build_where(table: str, filters: dict, search: Optional[str] = None):
         clauses.append(f'{quote_col(col)} IN ({placeholders})')
         params.extend(values)
     if search:
-        clauses.append(f'{quote_col("antibody")} LIKE ?')
-        params.append(f"%{search}%")
+        clause, search_params = antibody_search_clause(table, search)
+        clauses.append(clause)
+        params.extend(search_params)
     where = " WHERE " + " AND ".join(clauses) if clauses else ""
     return where, params
 
 
+def memory_rows(conn: sqlite3.Connection, table: str, produce, *args):
+    """
+    Rows from the in-memory engine when MAB_ENGINE=memory, or None when the
+    SQLite path should answer (engine off, or a request it doesn't cover).
+    """
+    if engine.ENGINE != "memory":
+        return None
+    try:
+        return produce(engine.store.table(conn, table), *args)
+    except engine.Unsupported:
+        return None
+
+
+def rounded_pct(value) -> float:
+    """
+    A mean rate to 2 places, halves away from zero like SQL ROUND, and 0 for
+    NULL. A mean that sits on a half comes out of SQLite's AVG and the memory
+    engine's fsum a rounding error apart; this gives both the same cent.
+    """
+    return float(engine.sql_round(value)) if value else 0
+
+
+def rollup_where(table: str, metric: str, group_by: str, filters: dict, search: Optional[str] = None):
+    """
+    WHERE clause selecting the ae_rollup rows equivalent to filtering the
+    base table, or None when the group-by or a filter isn't rolled up.
+    """
+    if not USE_ROLLUPS or group_by not in ROLLUP_GROUP_COLUMNS:
+        return None
+    active = {col: values for col, values in filters.items() if values}
+    if any(col not in ROLLUP_DIMENSIONS for col in active):
+        return None
+    clauses = ["source_table = ?", "metric = ?", "group_col = ?"]
+    params = [table, metric, group_by]
+    for col, values in active.items():
+        placeholders = ",".join(["?"] * len(values))
+        clauses.append(f'{quote_col(col)} IN ({placeholders})')
+        params.extend(values)
+    if search:
+        clause, search_params = antibody_search_clause(table, search)
+        clauses.append(clause)
+        params.extend(search_params)
+    return " WHERE " + " AND ".join(clauses), params
+
+
 class QueryRequest(BaseModel):
     table: str = "ctgov_all"
     filters: dict = {}
@@ -86,6 +242,23 @@ class QueryRequest(BaseModel):
     page_size: int = 50
     sort_by: Optional[str] = None
     sort_dir: str = "asc"
+    # Opaque next_cursor from the previous page; seeks instead of using OFFSET
+    cursor: Optional[str] = None
+    include_total: bool = True
+    # Columns to return, in this order: None for the table's summary
+    # columns, ["*"] for all of them
+    columns: Optional[list[str]] = None
+    # Older name for columns
+    fields: Optional[list[str]] = None
+    # "records" (one object per row) or "columnar" (columns + rows arrays)
+    format: str = "records"
+
+
+class DistributionRequest(BaseModel):
+    table: str = "ctgov_all"
+    column: str = "general_molecular_category"
+    filters: dict = {}
+    search: Optional[str] = None
 
 
 class AEChartRequest(BaseModel):
@@ -119,161 +292,397 @@ class TargetAggregationRequest(BaseModel):
     group_by: str = "organ_system"
     filters: dict = {}
     top_n: int = 15
+    # Antibodies listed per category; None lists them all
+    top_k: Optional[int] = None
 
 
-def calc_relative_risk(ab_events, ab_n, comp_events, comp_n):
-    """Calculate Relative Risk and 95% CI"""
-    if not ab_n or not comp_n or ab_n == 0 or comp_n == 0:
-        return None, None, None
-    
-    ab_rate = ab_events / ab_n
-    comp_rate = comp_events / comp_n
-    
-    if comp_rate == 0:
-        return None, None, None
-    
-    rr = ab_rate / comp_rate
-    
-    if ab_events <= 0 or comp_events <= 0:
-        return round(rr, 3), None, None
-    
-    try:
-        ln_rr = math.log(rr)
-        se = math.sqrt(1/ab_events - 1/ab_n + 1/comp_events - 1/comp_n)
-        ci_lower = math.exp(ln_rr - 1.96 * se)
-        ci_upper = math.exp(ln_rr + 1.96 * se)
-        return round(rr, 3), round(ci_lower, 3), round(ci_upper, 3)
-    except (ValueError, ZeroDivisionError):
-        return round(rr, 3), None, None
+class TargetAntibodiesRequest(BaseModel):
+    table: str = "ctgov_all"
+    target: str
+    group_by: str = "organ_system"
+    category: str
+    filters: dict = {}
+    page: int = 1
+    page_size: int = 50
 
 
-@app.get("/api/tables")
-def list_tables():
-    conn = get_conn()
+class RRMatrixRequest(BaseModel):
+    table: str = "ctgov_all"
+    group_by: str = "organ_system"
+    filters: dict = {}
+    # Cells pooled from fewer records are left empty
+    min_strata: int = 1
+
+
+class FacetRequest(BaseModel):
+    table: str = "ctgov_all"
+    filters: dict = {}
+    search: Optional[str] = None
+
+
+def count_table_rows(conn: sqlite3.Connection) -> dict:
     result = []
     for t in VALID_TABLES:
         row = conn.execute(f"SELECT COUNT(*) as cnt FROM {t}").fetchone()
         result.append({"name": t, "rows": row["cnt"]})
-    conn.close()
     return {"tables": result}
 
 
+@app.get("/api/tables")
+async def list_tables():
+    return await run_query(count_table_rows)
+
+
+@app.get("/api/stats")
+async def service_stats():
+    return {"pool": pool.metrics(), "export_pool": export_pool.metrics(), "chart_cache": chart_cache.metrics(),
+            "engine": engine.store.metrics()}
+
+
+@app.get("/api/metrics")
+async def prometheus_metrics():
+    """Request and per-statement SQL metrics in Prometheus text format"""
+    gauges = {"mab_db_pool": pool.metrics(), "mab_export_pool": export_pool.metrics(),
+              "mab_chart_cache": chart_cache.metrics()}
+    return Response(instrument.render_metrics(gauges), media_type=instrument.PROMETHEUS_CONTENT_TYPE)
+
+
+# Filter options only change when ingest.py rebuilds the database, so they
+# are read from the precomputed filter_catalog once per database build.
+_filter_options_cache = {"fingerprint": None, "tables": {}}
+
+
+def load_filter_options(conn: sqlite3.Connection, table: str) -> dict:
+    cols = FILTERABLE_COLUMNS[table_type(table)]
+    result = {col: [] for col in cols}
+    rows = conn.execute(
+        "SELECT column_name, value FROM filter_catalog WHERE table_name = ? ORDER BY column_name, value",
+        [table],
+    ).fetchall()
+    for r in rows:
+        if r["column_name"] in result:
+            result[r["column_name"]].append(r["value"])
+    return result
+
+
+def facet_options(values: list, facet: Optional[dict]) -> list:
+    """Catalog values of a column with their facet counts (0 when nothing matches)"""
+    counts = {}
+    if facet:
+        counts = {v: {"rows": r, "antibodies": a} for v, r, a in zip(facet["values"], facet["rows"], facet["antibodies"])}
+    return [{"value": v, **counts.get(v, {"rows": 0, "antibodies": 0})} for v in values]
+
+
 @app.get("/api/filter-options")
-def filter_options(table: str = "ctgov_all"):
+async def filter_options(request: Request, table: str = "ctgov_all",
+                         filters: Optional[str] = None, search: Optional[str] = None):
+    """
+    Distinct values of each filterable column. Given the current filters
+    (and search), each value instead comes with the rows and antibodies it
+    would match under the other columns' active filters.
+    """
     validate_table(table)
-    conn = get_conn()
-    tt = table_type(table)
-    cols = FILTERABLE_COLUMNS[tt]
-    result = {}
-    for col in cols:
+    faceted = filters is not None or bool(search)
+    filter_dict = {}
+    if filters:
         try:
-            rows = conn.execute(
-                f'SELECT DISTINCT {quote_col(col)} FROM {table} WHERE {quote_col(col)} IS NOT NULL ORDER BY {quote_col(col)}'
-            ).fetchall()
-            result[col] = [r[0] for r in rows]
+            filter_dict = json.loads(filters)
         except Exception:
-            result[col] = []
-    conn.close()
-    return result
+            pass
+    fp = current_fingerprint()
+    tag = f"{fp}:{table}"
+    if faceted:
+        tag += ":" + json.dumps([filter_dict, search], sort_keys=True, default=str)
+    etag = '"' + hashlib.sha1(tag.encode()).hexdigest()[:20] + '"'
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+    if etag_matches(request, etag):
+        return Response(status_code=304, headers=headers)
+
+    cache = _filter_options_cache
+    if cache["fingerprint"] != fp:
+        cache["fingerprint"] = fp
+        cache["tables"] = {}
+    result = cache["tables"].get(table)
+    if result is None:
+        result = await run_query(load_filter_options, table)
+        cache["tables"][table] = result
+    if faceted:
+        counts = await cached_chart("facet-counts", FacetRequest(table=table, filters=filter_dict, search=search))
+        result = {col: facet_options(values, counts["facets"].get(col)) for col, values in result.items()}
+    return payload.JSONBody(result, headers=headers)
+
+
+
+_table_columns_cache = {}
+
+
+def table_columns(conn: sqlite3.Connection, table: str) -> list:
+    key = (conn.fingerprint, table)
+    cols = _table_columns_cache.get(key)
+    if cols is None:
+        cols = [r[1] for r in conn.execute(f"PRAGMA table_info({table})").fetchall()]
+        _table_columns_cache[key] = cols
+    return cols
+
+
+def query_projection(conn: sqlite3.Connection, req: QueryRequest) -> list:
+    """
+    The columns a query returns, checked against the live table: its schema
+    is read once per database build, so a rebuild that adds or drops a
+    column is seen as soon as the pool moves to the new file
+    """
+    columns = table_columns(conn, req.table)
+    requested = req.columns or req.fields
+    if not requested:
+        return [c for c in SUMMARY_COLUMNS[table_type(req.table)] if c in columns] or columns
+    if "*" in requested:
+        return columns
+    for col in requested:
+        if col not in columns:
+            raise HTTPException(400, f"Invalid column: {col}")
+    return requested
+
+
+def query_signature(req: QueryRequest) -> str:
+    """Short hash of everything that determines a query's row order"""
+    spec = spec_key("query", {
+        "table": req.table, "filters": req.filters, "search": req.search,
+        "sort_by": req.sort_by, "sort_dir": req.sort_dir.lower(),
+    })
+    return hashlib.sha1(spec.encode()).hexdigest()[:12]
+
+
+def encode_cursor(req: QueryRequest, value, rowid: int) -> str:
+    payload = json.dumps({"q": query_signature(req), "v": value, "r": rowid})
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip("=")
+
+
+def decode_cursor(req: QueryRequest) -> tuple:
+    try:
+        padded = req.cursor + "=" * (-len(req.cursor) % 4)
+        payload = json.loads(base64.urlsafe_b64decode(padded))
+        value, rowid = payload["v"], int(payload["r"])
+    except Exception:
+        raise HTTPException(400, "Malformed cursor")
+    if payload.get("q") != query_signature(req):
+        raise HTTPException(400, "Cursor does not match this query's table, filters or sort")
+    return value, rowid
+
+
+def seek_clause(sort_by: Optional[str], direction: str, value, rowid: int):
+    """Predicate selecting rows after (value, rowid) in ORDER BY sort_by, rowid"""
+    if not sort_by:
+        return "rowid > ?", [rowid]
+    col = quote_col(sort_by)
+    # SQLite sorts NULLs first ascending and last descending
+    if direction == "ASC":
+        if value is None:
+            return f"(({col} IS NULL AND rowid > ?) OR {col} IS NOT NULL)", [rowid]
+        return f"({col} > ? OR ({col} = ? AND rowid > ?))", [value, value, rowid]
+    if value is None:
+        return f"({col} IS NULL AND rowid < ?)", [rowid]
+    return f"({col} < ? OR ({col} = ? AND rowid < ?) OR {col} IS NULL)", [value, value, rowid]
+
+
+def count_rows(conn: sqlite3.Connection, req: QueryRequest, where: str, params: list) -> int:
+    """Filtered row count, cached per filter set so page flips don't recount"""
+    key = cache_key("query-count", {"table": req.table, "filters": req.filters, "search": req.search},
+                    conn.fingerprint)
+    found, total = chart_cache.get(key)
+    if not found:
+        total = conn.execute(f"SELECT COUNT(*) as cnt FROM {req.table}{where}", params).fetchone()["cnt"]
+        chart_cache.put(key, total)
+    return total
+
+
+QUERY_FORMATS = ("records", "columnar")
+
+
+def fetch_page(conn: sqlite3.Connection, req: QueryRequest) -> dict:
+    if req.sort_by and req.sort_by not in table_columns(conn, req.table):
+        raise HTTPException(400, f"Invalid sort column: {req.sort_by}")
+    if req.format not in QUERY_FORMATS:
+        raise HTTPException(400, f"Invalid format: {req.format}. Use one of {', '.join(QUERY_FORMATS)}")
+    fields = query_projection(conn, req)
+    select = "rowid, " + ", ".join(quote_col(f) for f in fields)
+    if req.sort_by:
+        # The sort value rides along so the cursor works when it isn't projected
+        select += f", {quote_col(req.sort_by)}"
+    where, params = build_where(req.table, req.filters, req.search)
+    total = count_rows(conn, req, where, params) if req.include_total else None
+
+    direction = "DESC" if req.sort_dir.lower() == "desc" else "ASC"
+    if req.sort_by:
+        order = f" ORDER BY {quote_col(req.sort_by)} {direction}, rowid {direction}"
+    else:
+        order = " ORDER BY rowid"
+
+    if req.cursor:
+        value, rowid = decode_cursor(req)
+        clause, seek_params = seek_clause(req.sort_by, direction, value, rowid)
+        seek_where = f"{where} AND {clause}" if where else f" WHERE {clause}"
+        sql = f"SELECT {select} FROM {req.table}{seek_where}{order} LIMIT ?"
+        cursor = conn.execute(sql, params + seek_params + [req.page_size])
+    else:
+        offset = (req.page - 1) * req.page_size
+        sql = f"SELECT {select} FROM {req.table}{where}{order} LIMIT ? OFFSET ?"
+        cursor = conn.execute(sql, params + [req.page_size, offset])
+    # Plain tuples rather than sqlite3.Row: values are sliced out by position
+    cursor.row_factory = None
+    rows = cursor.fetchall()
+
+    n = len(fields)
+    next_cursor = None
+    if rows and len(rows) == req.page_size:
+        last = rows[-1]
+        next_cursor = encode_cursor(req, last[n + 1] if req.sort_by else None, last[0])
+    rowids = [r[0] for r in rows]
+    values = [r[1:n + 1] for r in rows]
+    # A cursor page has no page number
+    page = {"rowids": rowids, "total": total, "page": None if req.cursor else req.page,
+            "page_size": req.page_size, "next_cursor": next_cursor}
+    if req.format == "columnar":
+        # Column names once, then each row as an array of values
+        return {"columns": fields, "rows": values, **page}
+    return {"data": [dict(zip(fields, v)) for v in values], **page}
 
 
 @app.post("/api/query")
-def query_data(req: QueryRequest):
+async def query_data(req: QueryRequest):
     validate_table(req.table)
-    conn = get_conn()
-    where, params = build_where(req.table, req.filters, req.search)
+    # Already JSON-safe, so skip FastAPI's per-value jsonable_encoder pass
+    return payload.JSONBody(await run_query(fetch_page, req))
 
-    count_row = conn.execute(f"SELECT COUNT(*) as cnt FROM {req.table}{where}", params).fetchone()
-    total = count_row["cnt"]
 
-    order = ""
-    if req.sort_by:
-        direction = "DESC" if req.sort_dir.lower() == "desc" else "ASC"
-        order = f" ORDER BY {quote_col(req.sort_by)} {direction}"
+def fetch_record(conn: sqlite3.Connection, table: str, rowid: int) -> dict:
+    row = conn.execute(f"SELECT * FROM {table} WHERE rowid = ?", [rowid]).fetchone()
+    if row is None:
+        raise HTTPException(404, f"No row {rowid} in {table}")
+    return dict(row)
+
+
+@app.get("/api/record/{table}/{rowid}")
+async def record_detail(table: str, rowid: int):
+    """Every column of one row, by a rowid from an /api/query page"""
+    validate_table(table)
+    return payload.JSONBody(await run_query(fetch_record, table, rowid))
 
-    offset = (req.page - 1) * req.page_size
-    sql = f"SELECT * FROM {req.table}{where}{order} LIMIT ? OFFSET ?"
-    rows = conn.execute(sql, params + [req.page_size, offset]).fetchall()
-    data = [dict(r) for r in rows]
-    conn.close()
-    return {"data": data, "total": total, "page": req.page, "page_size": req.page_size}
+
+def compute_distribution(conn: sqlite3.Connection, req: DistributionRequest) -> dict:
+    where, params = build_where(req.table, req.filters, req.search)
+    column = req.column
+    sql = f'SELECT {quote_col(column)} as label, COUNT(DISTINCT {quote_col("antibody")}) as cnt FROM {req.table}{where} AND {quote_col(column)} IS NOT NULL GROUP BY {quote_col(column)} ORDER BY cnt DESC, label'
+    if not where:
+        sql = f'SELECT {quote_col(column)} as label, COUNT(DISTINCT {quote_col("antibody")}) as cnt FROM {req.table} WHERE {quote_col(column)} IS NOT NULL GROUP BY {quote_col(column)} ORDER BY cnt DESC, label'
+
+    rows = conn.execute(sql, params).fetchall()
+    return {"labels": [r["label"] for r in rows], "values": [r["cnt"] for r in rows]}
 
 
 @app.get("/api/chart/distribution")
-def chart_distribution(table: str = "ctgov_all", column: str = "general_molecular_category",
+async def chart_distribution(table: str = "ctgov_all", column: str = "general_molecular_category",
                        filters: Optional[str] = None, search: Optional[str] = None):
     validate_table(table)
-    conn = get_conn()
 
     filter_dict = {}
     if filters:
-        import json
         try:
             filter_dict = json.loads(filters)
         except Exception:
             pass
 
-    where, params = build_where(table, filter_dict, search)
-    sql = f'SELECT {quote_col(column)} as label, COUNT(DISTINCT {quote_col("antibody")}) as cnt FROM {table}{where} AND {quote_col(column)} IS NOT NULL GROUP BY {quote_col(column)} ORDER BY cnt DESC'
-    if not where:
-        sql = f'SELECT {quote_col(column)} as label, COUNT(DISTINCT {quote_col("antibody")}) as cnt FROM {table} WHERE {quote_col(column)} IS NOT NULL GROUP BY {quote_col(column)} ORDER BY cnt DESC'
-
-    rows = conn.execute(sql, params).fetchall()
-    conn.close()
-    return {"labels": [r["label"] for r in rows], "values": [r["cnt"] for r in rows]}
+    req = DistributionRequest(table=table, column=column, filters=filter_dict, search=search)
+    return await cached_chart("distribution", req)
 
 
-@app.post("/api/chart/adverse-events")
-def chart_adverse_events(req: AEChartRequest):
-    validate_table(req.table)
-    conn = get_conn()
-    where, params = build_where(req.table, req.filters, req.search)
+def compute_adverse_events(conn: sqlite3.Connection, req: AEChartRequest) -> dict:
     tt = table_type(req.table)
     gcol = quote_col(req.group_by)
+    # Validate grade column to prevent SQL injection
+    grade_col = req.grade_col if req.grade_col in LABEL_GRADE_COLUMNS else "all_grades%"
+    metric = CTGOV_RATE_METRIC if tt == "ctgov" else grade_col
 
-    if tt == "ctgov":
+    plan = rollup_where(req.table, metric, req.group_by, req.filters, req.search)
+    if plan:
+        where, params = plan
+        sql = f'''
+            SELECT category,
+                   SUM(total) / SUM(n) as avg_pct,
+                   SUM(n) as cnt
+            FROM ae_rollup{where}
+            GROUP BY category
+            ORDER BY ROUND(avg_pct, 2) DESC, category
+            LIMIT ?
+        '''
+    elif tt == "ctgov":
+        where, params = build_where(req.table, req.filters, req.search)
         base_where = where if where else " WHERE 1=1"
         sql = f'''
             SELECT {gcol} as category,
-                   AVG(CAST(events_ab AS REAL) * 100.0 / CAST(n_ab AS REAL)) as avg_pct,
-                   COUNT(*) as record_count
+                   AVG(events_ab * 100.0 / n_ab) as avg_pct,
+                   COUNT(*) as cnt
             FROM {req.table}{base_where} AND {gcol} IS NOT NULL AND events_ab IS NOT NULL AND n_ab IS NOT NULL AND n_ab > 0
             GROUP BY {gcol}
-            ORDER BY avg_pct DESC
+            ORDER BY ROUND(avg_pct, 2) DESC, category
             LIMIT ?
         '''
-        rows = conn.execute(sql, params + [req.top_n]).fetchall()
-        categories = [r["category"] for r in rows]
-        proportions = [round(r["avg_pct"], 2) if r["avg_pct"] else 0 for r in rows]
-        counts = [r["record_count"] for r in rows]
     else:
+        where, params = build_where(req.table, req.filters, req.search)
         base_where = where if where else " WHERE 1=1"
-        # Validate grade column to prevent SQL injection
-        valid_grade_cols = ["all_grades%", "grade_3_4%", "grade_5%"]
-        grade_col = req.grade_col if req.grade_col in valid_grade_cols else "all_grades%"
         pct_col = quote_col(grade_col)
         sql = f'''
             SELECT {gcol} as category,
-                   AVG(CAST({pct_col} AS REAL)) as avg_pct,
+                   AVG({pct_col}) as avg_pct,
                    COUNT(*) as cnt
             FROM {req.table}{base_where} AND {gcol} IS NOT NULL AND {pct_col} IS NOT NULL
             GROUP BY {gcol}
-            ORDER BY avg_pct DESC
+            ORDER BY ROUND(avg_pct, 2) DESC, category
             LIMIT ?
         '''
-        rows = conn.execute(sql, params + [req.top_n]).fetchall()
-        categories = [r["category"] for r in rows]
-        proportions = [round(r["avg_pct"], 2) if r["avg_pct"] else 0 for r in rows]
-        counts = [r["cnt"] for r in rows]
 
-    conn.close()
+    rows = memory_rows(conn, req.table, engine.adverse_event_rows,
+                       req.group_by, metric, req.filters, req.search, req.top_n)
+    if rows is None:
+        rows = conn.execute(sql, params + [req.top_n]).fetchall()
+    categories = [r["category"] for r in rows]
+    proportions = [rounded_pct(r["avg_pct"]) for r in rows]
+    counts = [r["cnt"] for r in rows]
     return {"categories": categories, "proportions": proportions, "counts": counts}
 
 
-@app.post("/api/chart/comparative")
-def chart_comparative(req: ComparativeRequest):
+@app.post("/api/chart/adverse-events")
+async def chart_adverse_events(req: AEChartRequest):
     validate_table(req.table)
-    conn = get_conn()
+    return await cached_chart("adverse-events", req)
+
+
+# Records usable as Mantel-Haenszel strata: both arms sized, both event counts known
+ARM_COUNTS_PRESENT = "n_ab > 0 AND n_comp > 0 AND events_ab IS NOT NULL AND events_comp IS NOT NULL"
+
+
+def pooled_relative_risk(conn: sqlite3.Connection, table: str, gcol: str, categories: list,
+                         where: str, params: list):
+    """
+    Mantel-Haenszel RR and 95% CI per category, pooled over the per-study arm
+    counts of the records that where/params select.
+    """
+    if not categories:
+        return [], [], []
+    placeholders = ",".join(["?"] * len(categories))
+    rows = conn.execute(
+        f"SELECT {gcol} AS category, {MH_SUMS} FROM {table}{where} "
+        f"AND {gcol} IN ({placeholders}) AND {ARM_COUNTS_PRESENT} GROUP BY {gcol}",
+        params + categories,
+    ).fetchall()
+    sums = np.zeros((len(categories), 3))
+    index = {c: i for i, c in enumerate(categories)}
+    for r in rows:
+        sums[index[r["category"]]] = (r["mh_r"], r["mh_s"], r["mh_p"])
+    rr, lower, upper = mantel_haenszel_rr(*sums.T)
+    return rounded(rr), rounded(lower), rounded(upper)
+
+
+def compute_comparative(conn: sqlite3.Connection, req: ComparativeRequest) -> dict:
     tt = table_type(req.table)
     gcol = quote_col(req.group_by)
 
@@ -299,21 +708,21 @@ def chart_comparative(req: ComparativeRequest):
 
         sql = f'''
             SELECT {gcol} as category,
-                   AVG(CAST(events_ab AS REAL) * 100.0 / CAST(n_ab AS REAL)) as ab_pct,
-                   AVG(CASE WHEN n_comp > 0 THEN CAST(events_comp AS REAL) * 100.0 / CAST(n_comp AS REAL) ELSE NULL END) as comp_pct,
-                   AVG(CAST(events_ab AS REAL)) as avg_ab_events,
-                   AVG(CAST(n_ab AS REAL)) as avg_ab_n,
-                   AVG(CAST(events_comp AS REAL)) as avg_comp_events,
-                   AVG(CAST(n_comp AS REAL)) as avg_comp_n
+                   AVG(events_ab * 100.0 / n_ab) as ab_pct,
+                   AVG(CASE WHEN n_comp > 0 THEN events_comp * 100.0 / n_comp ELSE NULL END) as comp_pct
             FROM {req.table}{where}
             GROUP BY {gcol}
-            ORDER BY ab_pct DESC
+            ORDER BY ROUND(ab_pct, 2) DESC, category
             LIMIT ?
         '''
-        rows = conn.execute(sql, params + [req.top_n]).fetchall()
+        rows = memory_rows(conn, req.table, engine.comparative_rows,
+                           req.antibody, req.nct_id, req.group_by, req.filters, req.top_n, True)
+        if rows is None:
+            rows = conn.execute(sql, params + [req.top_n]).fetchall()
         categories = [r["category"] for r in rows]
-        ab_proportions = [round(r["ab_pct"], 2) if r["ab_pct"] else 0 for r in rows]
-        comp_proportions = [round(r["comp_pct"], 2) if r["comp_pct"] else 0 for r in rows]
+        ab_proportions = [rounded_pct(r["ab_pct"]) for r in rows]
+        comp_proportions = [rounded_pct(r["comp_pct"]) for r in rows]
+        rr_values, rr_ci_lower, rr_ci_upper = pooled_relative_risk(conn, req.table, gcol, categories, where, params)
     else:
         pct_col = quote_col("all_grades%")
         comp_pct_col = quote_col("comp_all_grades%")
@@ -325,43 +734,27 @@ def chart_comparative(req: ComparativeRequest):
 
         sql = f'''
             SELECT {gcol} as category,
-                   AVG(CAST({pct_col} AS REAL)) as ab_pct,
-                   AVG(CAST({comp_pct_col} AS REAL)) as comp_pct
+                   AVG({pct_col}) as ab_pct,
+                   AVG({comp_pct_col}) as comp_pct
             FROM {req.table}{where}
             GROUP BY {gcol}
-            ORDER BY ab_pct DESC
+            ORDER BY ROUND(ab_pct, 2) DESC, category
             LIMIT ?
         '''
-        rows = conn.execute(sql, params + [req.top_n]).fetchall()
+        rows = memory_rows(conn, req.table, engine.comparative_rows,
+                           req.antibody, None, req.group_by, req.filters, req.top_n, False)
+        if rows is None:
+            rows = conn.execute(sql, params + [req.top_n]).fetchall()
         categories = [r["category"] for r in rows]
-        ab_proportions = [round(r["ab_pct"], 2) if r["ab_pct"] else 0 for r in rows]
-        comp_proportions = [round(r["comp_pct"], 2) if r["comp_pct"] else 0 for r in rows]
+        ab_proportions = [rounded_pct(r["ab_pct"]) for r in rows]
+        comp_proportions = [rounded_pct(r["comp_pct"]) for r in rows]
 
-    rr_values = []
-    rr_ci_lower = []
-    rr_ci_upper = []
-    
-    if tt == "ctgov":
-        for r in rows:
-            rr, ci_l, ci_u = calc_relative_risk(
-                r["avg_ab_events"], r["avg_ab_n"], r["avg_comp_events"], r["avg_comp_n"]
-            )
-            rr_values.append(rr)
-            rr_ci_lower.append(ci_l)
-            rr_ci_upper.append(ci_u)
-    else:
-        for r in rows:
-            ab_pct = r["ab_pct"] if r["ab_pct"] else 0
-            comp_pct = r["comp_pct"] if r["comp_pct"] else 0
-            if comp_pct > 0:
-                rr = round(ab_pct / comp_pct, 3)
-                rr_values.append(rr)
-            else:
-                rr_values.append(None)
-            rr_ci_lower.append(None)
-            rr_ci_upper.append(None)
+        # Labels only report incidence percentages, so RR is their ratio
+        rr_values = [float(engine.sql_round((r["ab_pct"] or 0) / r["comp_pct"], 3)) if r["comp_pct"] else None
+                     for r in rows]
+        rr_ci_lower = [None] * len(rows)
+        rr_ci_upper = [None] * len(rows)
 
-    conn.close()
     return {
         "ab_arm": {"categories": categories, "proportions": ab_proportions},
         "comp_arm": {"categories": categories, "proportions": comp_proportions},
@@ -369,9 +762,13 @@ def chart_comparative(req: ComparativeRequest):
     }
 
 
-@app.post("/api/chart/cross-dataset")
-def chart_cross_dataset(req: CrossDatasetRequest):
-    conn = get_conn()
+@app.post("/api/chart/comparative")
+async def chart_comparative(req: ComparativeRequest):
+    validate_table(req.table)
+    return await cached_chart("comparative", req)
+
+
+def compute_cross_dataset(conn: sqlite3.Connection, req: CrossDatasetRequest) -> dict:
     gcol = quote_col(req.group_by)
     
     # Build filter conditions
@@ -387,27 +784,55 @@ def chart_cross_dataset(req: CrossDatasetRequest):
     if filter_clauses:
         filter_sql = " AND " + " AND ".join(filter_clauses)
     
-    ctgov_sql = f'''
-        SELECT {gcol} as category,
-               AVG(CAST(events_ab AS REAL) * 100.0 / CAST(n_ab AS REAL)) as avg_pct
-        FROM ctgov_all
-        WHERE LOWER({quote_col("antibody")}) = LOWER(?) AND {gcol} IS NOT NULL 
-              AND events_ab IS NOT NULL AND n_ab IS NOT NULL AND n_ab > 0{filter_sql}
-        GROUP BY {gcol}
-    '''
-    ctgov_rows = conn.execute(ctgov_sql, [req.antibody] + filter_params).fetchall()
-    ctgov_data = {r["category"]: round(r["avg_pct"], 2) if r["avg_pct"] else 0 for r in ctgov_rows}
+    # Every spelling of the antibody resolves to one antibody_dim entry
+    dim = conn.execute(
+        "SELECT antibody_id, aliases FROM antibody_dim WHERE name_norm = ?", [normalize_antibody(req.antibody)]
+    ).fetchone()
+    antibody_id = dim["antibody_id"] if dim else None
+    aliases = json.loads(dim["aliases"]) if dim else []
+    alias_sql = ",".join(["?"] * len(aliases))
+
+    plan = rollup_where("ctgov_all", CTGOV_RATE_METRIC, req.group_by, req.filters)
+    if plan:
+        where, params = plan
+        ctgov_sql = f'''
+            SELECT category, SUM(total) / SUM(n) as avg_pct
+            FROM ae_rollup{where} AND antibody IN ({alias_sql})
+            GROUP BY category
+        '''
+        ctgov_rows = conn.execute(ctgov_sql, params + aliases).fetchall()
+    else:
+        ctgov_sql = f'''
+            SELECT {gcol} as category,
+                   AVG(events_ab * 100.0 / n_ab) as avg_pct
+            FROM ctgov_all
+            WHERE antibody_id = ? AND {gcol} IS NOT NULL
+                  AND events_ab IS NOT NULL AND n_ab IS NOT NULL AND n_ab > 0{filter_sql}
+            GROUP BY {gcol}
+        '''
+        ctgov_rows = conn.execute(ctgov_sql, [antibody_id] + filter_params).fetchall()
+    ctgov_data = {r["category"]: rounded_pct(r["avg_pct"]) for r in ctgov_rows}
     
-    pct_col = quote_col("all_grades%")
-    label_sql = f'''
-        SELECT {gcol} as category,
-               AVG(CAST({pct_col} AS REAL)) as avg_pct
-        FROM label_final
-        WHERE LOWER({quote_col("antibody")}) = LOWER(?) AND {gcol} IS NOT NULL AND {pct_col} IS NOT NULL{filter_sql}
-        GROUP BY {gcol}
-    '''
-    label_rows = conn.execute(label_sql, [req.antibody] + filter_params).fetchall()
-    label_data = {r["category"]: round(r["avg_pct"], 2) if r["avg_pct"] else 0 for r in label_rows}
+    plan = rollup_where("label_final", "all_grades%", req.group_by, req.filters)
+    if plan:
+        where, params = plan
+        label_sql = f'''
+            SELECT category, SUM(total) / SUM(n) as avg_pct
+            FROM ae_rollup{where} AND antibody IN ({alias_sql})
+            GROUP BY category
+        '''
+        label_rows = conn.execute(label_sql, params + aliases).fetchall()
+    else:
+        pct_col = quote_col("all_grades%")
+        label_sql = f'''
+            SELECT {gcol} as category,
+                   AVG({pct_col}) as avg_pct
+            FROM label_final
+            WHERE antibody_id = ? AND {gcol} IS NOT NULL AND {pct_col} IS NOT NULL{filter_sql}
+            GROUP BY {gcol}
+        '''
+        label_rows = conn.execute(label_sql, [antibody_id] + filter_params).fetchall()
+    label_data = {r["category"]: rounded_pct(r["avg_pct"]) for r in label_rows}
     
     all_categories = sorted(set(ctgov_data.keys()) | set(label_data.keys()))
     
@@ -416,7 +841,6 @@ def chart_cross_dataset(req: CrossDatasetRequest):
         category_max.sort(key=lambda x: x[1], reverse=True)
         all_categories = [c[0] for c in category_max[:req.top_n]]
     
-    conn.close()
     return {
         "categories": all_categories,
         "ctgov": {"values": [ctgov_data.get(c, None) for c in all_categories]},
@@ -425,13 +849,64 @@ def chart_cross_dataset(req: CrossDatasetRequest):
     }
 
 
-@app.post("/api/chart/target-aggregation")
-def chart_target_aggregation(req: TargetAggregationRequest):
+def compute_rr_matrix(conn: sqlite3.Connection, req: RRMatrixRequest) -> dict:
+    """Mantel-Haenszel RR of every antibody x category cell, pooled in one pass"""
+    if table_type(req.table) != "ctgov":
+        raise HTTPException(400, "Relative risk needs arm counts, which only the CTGOV tables have")
+    gcol = quote_col(req.group_by)
+    where, params = build_where(req.table, req.filters)
+    base_where = where if where else " WHERE 1=1"
+    rows = conn.execute(
+        f"SELECT antibody, {gcol} AS category, {MH_SUMS} FROM {req.table}{base_where} "
+        f"AND antibody IS NOT NULL AND {gcol} IS NOT NULL AND {ARM_COUNTS_PRESENT} "
+        f"GROUP BY antibody, {gcol}",
+        params,
+    ).fetchall()
+    if not rows:
+        return {"antibodies": [], "categories": [], "rr": [], "ci_lower": [], "ci_upper": [], "strata": []}
+
+    antibodies, ab_index = np.unique(np.array([r["antibody"] for r in rows], dtype=object), return_inverse=True)
+    categories, cat_index = np.unique(np.array([r["category"] for r in rows], dtype=object), return_inverse=True)
+    shape = (len(antibodies), len(categories))
+    # Cells with no strata stay at zero and come out NaN
+    sums = np.zeros(shape + (3,))
+    strata = np.zeros(shape, dtype=np.int64)
+    sums[ab_index, cat_index] = [(r["mh_r"], r["mh_s"], r["mh_p"]) for r in rows]
+    strata[ab_index, cat_index] = [r["strata"] for r in rows]
+    rr, lower, upper = mantel_haenszel_rr(sums[..., 0], sums[..., 1], sums[..., 2])
+    sparse = strata < max(req.min_strata, 1)
+    for values in (rr, lower, upper):
+        values[sparse] = np.nan
+    return {
+        "antibodies": antibodies.tolist(),
+        "categories": categories.tolist(),
+        "rr": [rounded(row) for row in rr.reshape(shape)],
+        "ci_lower": [rounded(row) for row in lower.reshape(shape)],
+        "ci_upper": [rounded(row) for row in upper.reshape(shape)],
+        "strata": strata.reshape(shape).tolist(),
+    }
+
+
+@app.post("/api/chart/rr-matrix")
+async def chart_rr_matrix(req: RRMatrixRequest):
     validate_table(req.table)
-    conn = get_conn()
+    return await cached_chart("rr-matrix", req)
+
+
+@app.post("/api/chart/cross-dataset")
+async def chart_cross_dataset(req: CrossDatasetRequest):
+    return await cached_chart("cross-dataset", req)
+
+
+def target_cells(req, category: Optional[str] = None) -> tuple:
+    """
+    (sql, params, metric) of the mean AE rate per (category, antibody) for
+    req.target, from the rollup when the filters allow; category limits it
+    to one group-by value.
+    """
     tt = table_type(req.table)
     gcol = quote_col(req.group_by)
-    
+
     # Build filter conditions
     filter_clauses = []
     filter_params = []
@@ -440,112 +915,513 @@ def chart_target_aggregation(req: TargetAggregationRequest):
             placeholders = ",".join(["?"] * len(values))
             filter_clauses.append(f'{quote_col(col)} IN ({placeholders})')
             filter_params.extend(values)
-    
+    if category is not None:
+        filter_clauses.append(f"{gcol} = ?")
+        filter_params.append(category)
+
     filter_sql = ""
     if filter_clauses:
         filter_sql = " AND " + " AND ".join(filter_clauses)
-    
-    if tt == "ctgov":
+
+    metric = CTGOV_RATE_METRIC if tt == "ctgov" else "all_grades%"
+    plan = rollup_where(req.table, metric, req.group_by, req.filters)
+    if plan:
+        where, params = plan
+        category_sql = " AND category = ?" if category is not None else ""
+        sql = f'''
+            SELECT category, antibody, SUM(total) / SUM(n) as avg_pct
+            FROM ae_rollup{where} AND target_1 = ?{category_sql}
+            GROUP BY category, antibody
+        '''
+        params = params + [req.target] + ([category] if category is not None else [])
+    elif tt == "ctgov":
         sql = f'''
             SELECT {gcol} as category,
                    antibody,
-                   AVG(CAST(events_ab AS REAL) * 100.0 / CAST(n_ab AS REAL)) as avg_pct
+                   AVG(events_ab * 100.0 / n_ab) as avg_pct
             FROM {req.table}
             WHERE {quote_col("target_1")} = ? AND {gcol} IS NOT NULL 
                   AND events_ab IS NOT NULL AND n_ab IS NOT NULL AND n_ab > 0{filter_sql}
             GROUP BY {gcol}, antibody
         '''
-        rows = conn.execute(sql, [req.target] + filter_params).fetchall()
-        
-        category_stats = {}
-        antibody_data = {}
-        for r in rows:
-            cat = r["category"]
-            ab = r["antibody"]
-            pct = round(r["avg_pct"], 2) if r["avg_pct"] else 0
-            if cat not in category_stats:
-                category_stats[cat] = []
-                antibody_data[cat] = []
-            category_stats[cat].append(pct)
-            antibody_data[cat].append({"antibody": ab, "proportion": pct})
+        params = [req.target] + filter_params
     else:
         pct_col = quote_col("all_grades%")
         sql = f'''
             SELECT {gcol} as category,
                    antibody,
-                   AVG(CAST({pct_col} AS REAL)) as avg_pct
+                   AVG({pct_col}) as avg_pct
             FROM {req.table}
             WHERE {quote_col("target_1")} = ? AND {gcol} IS NOT NULL AND {pct_col} IS NOT NULL{filter_sql}
             GROUP BY {gcol}, antibody
         '''
-        rows = conn.execute(sql, [req.target] + filter_params).fetchall()
-        
-        category_stats = {}
-        antibody_data = {}
-        for r in rows:
-            cat = r["category"]
-            ab = r["antibody"]
-            pct = round(r["avg_pct"], 2) if r["avg_pct"] else 0
-            if cat not in category_stats:
-                category_stats[cat] = []
-                antibody_data[cat] = []
-            category_stats[cat].append(pct)
-            antibody_data[cat].append({"antibody": ab, "proportion": pct})
-    
+        params = [req.target] + filter_params
+    return sql, params, metric
+
+
+MAX_TARGET_PAGE_SIZE = 500
+
+# Each antibody's rate in a category, rounded to 2 places as the chart shows
+# it; the category statistics are taken over these rounded values.
+TARGET_PCT_SQL = "SELECT category, antibody, CASE WHEN avg_pct THEN ROUND(avg_pct, 2) ELSE 0 END AS pct FROM cells"
+
+
+def compute_target_aggregation(conn: sqlite3.Connection, req: TargetAggregationRequest) -> dict:
+    """
+    Mean, min, max and count of the antibody rates per category, the top_n
+    categories by mean, each with its antibodies ranked by rate (the top_k
+    when set; /api/chart/target-aggregation/antibodies pages the rest).
+    """
+    cells, params, metric = target_cells(req)
+    rows = memory_rows(conn, req.table, engine.target_rows, req.target, req.group_by, metric, req.filters,
+                       req.top_n, req.top_k)
+    if rows is None:
+        rank_sql = " WHERE r.ab_rank <= ?" if req.top_k else ""
+        rows = conn.execute(f'''
+            WITH cells AS ({cells}),
+            pcts AS ({TARGET_PCT_SQL}),
+            categories AS (
+                SELECT category, ROUND(AVG(pct), 2) AS mean_pct, MIN(pct) AS min_pct, MAX(pct) AS max_pct,
+                       COUNT(*) AS n_antibodies
+                FROM pcts
+                GROUP BY category
+                ORDER BY mean_pct DESC, category
+                LIMIT ?
+            ),
+            ranked AS (
+                SELECT category, antibody, pct,
+                       ROW_NUMBER() OVER (PARTITION BY category ORDER BY pct DESC, antibody) AS ab_rank
+                FROM pcts
+                WHERE category IN (SELECT category FROM categories)
+            )
+            SELECT c.category, c.mean_pct, c.min_pct, c.max_pct, c.n_antibodies, r.antibody, r.pct
+            FROM categories c JOIN ranked r ON r.category = c.category{rank_sql}
+            ORDER BY c.mean_pct DESC, c.category, r.ab_rank
+        ''', params + [req.top_n or -1] + ([req.top_k] if req.top_k else [])).fetchall()
+
     result = []
-    for cat, values in category_stats.items():
-        if values:
-            # Sort antibodies by proportion descending
-            ab_list = sorted(antibody_data.get(cat, []), key=lambda x: x["proportion"], reverse=True)
+    for r in rows:
+        if not result or result[-1]["category"] != r["category"]:
             result.append({
-                "category": cat,
-                "mean": round(sum(values) / len(values), 2),
-                "min": round(min(values), 2),
-                "max": round(max(values), 2),
-                "count": len(values),
-                "antibodies": ab_list,
+                "category": r["category"],
+                "mean": r["mean_pct"],
+                "min": r["min_pct"],
+                "max": r["max_pct"],
+                "count": r["n_antibodies"],
+                "antibodies": [],
             })
-    
-    result.sort(key=lambda x: x["mean"], reverse=True)
-    if req.top_n:
-        result = result[:req.top_n]
-    
-    conn.close()
+        result[-1]["antibodies"].append({"antibody": r["antibody"], "proportion": r["pct"]})
+
     return {
         "target": req.target,
         "data": result,
     }
 
 
-@app.get("/api/overlapping-antibodies")
-def get_overlapping_antibodies():
-    conn = get_conn()
-    ctgov_abs = set(r[0].lower().strip() for r in conn.execute(
-        "SELECT DISTINCT antibody FROM ctgov_all WHERE antibody IS NOT NULL AND antibody != ''"
-    ).fetchall())
-    label_abs = set(r[0].lower().strip() for r in conn.execute(
-        "SELECT DISTINCT antibody FROM label_final WHERE antibody IS NOT NULL AND antibody != ''"
-    ).fetchall())
-    overlap = sorted(ctgov_abs & label_abs)
-    conn.close()
+def compute_target_antibodies(conn: sqlite3.Connection, req: TargetAntibodiesRequest) -> dict:
+    """One category of the target aggregation: a page of its antibodies ranked by rate"""
+    if req.page < 1 or not 1 <= req.page_size <= MAX_TARGET_PAGE_SIZE:
+        raise HTTPException(400, f"page must be >= 1 and page_size between 1 and {MAX_TARGET_PAGE_SIZE}")
+    offset = (req.page - 1) * req.page_size
+    cells, params, metric = target_cells(req, req.category)
+    ranked = memory_rows(conn, req.table, engine.target_rows, req.target, req.group_by, metric,
+                         {**req.filters, req.group_by: [req.category]}, 1, None)
+    if ranked is not None:
+        total = len(ranked)
+        rows = ranked[offset:offset + req.page_size]
+    else:
+        rows = conn.execute(f'''
+            WITH cells AS ({cells}),
+            pcts AS ({TARGET_PCT_SQL})
+            SELECT antibody, pct, COUNT(*) OVER () AS total
+            FROM pcts
+            ORDER BY pct DESC, antibody
+            LIMIT ? OFFSET ?
+        ''', params + [req.page_size, offset]).fetchall()
+        if rows:
+            total = rows[0]["total"]
+        else:
+            total = conn.execute(f"WITH cells AS ({cells}) SELECT COUNT(*) FROM cells", params).fetchone()[0]
+    return {
+        "target": req.target,
+        "category": req.category,
+        "total": total,
+        "page": req.page,
+        "page_size": req.page_size,
+        "data": [
+            {"antibody": r["antibody"], "proportion": r["pct"], "rank": offset + i + 1}
+            for i, r in enumerate(rows)
+        ],
+    }
+
+
+@app.post("/api/chart/target-aggregation")
+async def chart_target_aggregation(req: TargetAggregationRequest):
+    validate_table(req.table)
+    return await cached_chart("target-aggregation", req)
+
+
+@app.post("/api/chart/target-aggregation/antibodies")
+async def chart_target_antibodies(req: TargetAntibodiesRequest):
+    validate_table(req.table)
+    return await cached_chart("target-antibodies", req)
+
+
+def sql_facet_counts(conn: sqlite3.Connection, req: FacetRequest) -> dict:
+    """
+    compute_facet_counts() without the bitmap index: the rows failing at most
+    one active filter are materialized once, with a match flag per filter,
+    and grouped once per facet over the rows passing the other filters.
+    """
+    present = table_columns(conn, req.table)
+    active = {col: values for col, values in req.filters.items() if values}
+    missing = set(active) - set(present)
+    if missing:
+        raise HTTPException(400, f"Invalid filters: no column(s) {sorted(missing)} in {req.table}")
+    facets = [c for c in FILTERABLE_COLUMNS[table_type(req.table)] if c in present]
+
+    flags, params = [], []
+    for i, (col, values) in enumerate(active.items()):
+        flags.append(f'COALESCE({quote_col(col)} IN ({",".join(["?"] * len(values))}), 0) AS m{i}')
+        params.extend(values)
+    where, search_params = build_where(req.table, {}, req.search)
+    params.extend(search_params)
+    cols = ", ".join([quote_col(c) for c in sorted(set(facets) | {"antibody"})] + flags)
+    misses = " + ".join(f"(m{i} = 0)" for i in range(len(active))) or "0"
+
+    def passing(skip=None):
+        return " AND ".join(f"m{i}" for i, col in enumerate(active) if col != skip) or "1"
+
+    branches = [f"SELECT -1, NULL, COUNT(*), NULL FROM f WHERE {passing()}"]
+    for i, col in enumerate(facets):
+        branches.append(
+            f"SELECT {i}, {quote_col(col)}, COUNT(*), COUNT(DISTINCT antibody) FROM f "
+            f"WHERE {quote_col(col)} IS NOT NULL AND {passing(col)} GROUP BY {quote_col(col)}"
+        )
+    sql = (f"WITH m AS (SELECT {cols} FROM {req.table}{where}), "
+           f"f AS MATERIALIZED (SELECT * FROM m WHERE {misses} <= 1) " + " UNION ALL ".join(branches))
+    groups = {i: {} for i in range(len(facets))}
+    total = 0
+    for r in conn.execute(sql, params).fetchall():
+        if r[0] < 0:
+            total = r[2]
+        else:
+            groups[r[0]][r[1]] = (r[2], r[3])
+
+    catalog = load_filter_options(conn, req.table)
+    result = {}
+    for i, col in enumerate(facets):
+        values = catalog[col]
+        counts = [groups[i].get(v, (0, 0)) for v in values]
+        result[col] = {"values": values, "rows": [c[0] for c in counts], "antibodies": [c[1] for c in counts]}
+    return {"total": total, "facets": result}
+
+
+def compute_facet_counts(conn: sqlite3.Connection, req: FacetRequest) -> dict:
+    index = built_index(conn, req.table) if USE_BITMAP_INDEX else None
+    if index is None:
+        return sql_facet_counts(conn, req)
+    antibodies = search_antibodies(conn, req.table, req.search) if req.search else None
+    try:
+        return index.facet_counts(req.filters, antibodies)
+    except engine.Unsupported as e:
+        raise HTTPException(400, f"Invalid filters: {e}")
+
+
+@app.post("/api/facet-counts")
+async def facet_counts(req: FacetRequest):
+    validate_table(req.table)
+    return await cached_chart("facet-counts", req)
+
+
+CHART_ENDPOINTS = {
+    "distribution": (DistributionRequest, compute_distribution),
+    "adverse-events": (AEChartRequest, compute_adverse_events),
+    "comparative": (ComparativeRequest, compute_comparative),
+    "cross-dataset": (CrossDatasetRequest, compute_cross_dataset),
+    "target-aggregation": (TargetAggregationRequest, compute_target_aggregation),
+    "target-antibodies": (TargetAntibodiesRequest, compute_target_antibodies),
+    "rr-matrix": (RRMatrixRequest, compute_rr_matrix),
+    "facet-counts": (FacetRequest, compute_facet_counts),
+}
+
+# Charts the dashboard requests on every table switch, before any filtering
+DEFAULT_WARM_SPECS = [
+    ("distribution", {"table": t, "column": c})
+    for t in ["ctgov_all", "label_final", "label_bbw", "label_wap"]
+    for c in ["record_category", "general_molecular_category", "moa_new", "target_1"]
+] + [
+    ("adverse-events", {"table": t, "group_by": g})
+    for t in ["ctgov_all", "label_final", "label_bbw", "label_wap"]
+    for g in ["organ_system", "adverse_event_term"]
+]
+
+chart_cache = ResultCache()
+_warm_state = {"fingerprint": None, "lock": threading.Lock()}
+
+
+def lookup_chart(name: str, req: BaseModel):
+    """Count the request for warming and return (key, found, value) from the cache"""
+    params = req.model_dump()
+    fp = current_fingerprint()
+    if _warm_state["fingerprint"] != fp:
+        start_cache_warm(fp)
+    chart_cache.note_request(spec_key(name, params))
+    key = cache_key(name, params, fp)
+    return (key, *chart_cache.get(key))
+
+
+async def cached_chart(name: str, req: BaseModel) -> dict:
+    key, found, value = lookup_chart(name, req)
+    if found:
+        return value
+    value = await run_query(CHART_ENDPOINTS[name][1], req)
+    chart_cache.put(key, value)
+    return value
+
+
+def warm_chart_cache(limit: int = CACHE_WARM_TOP) -> int:
+    """Precompute default and most requested charts for the current database"""
+    fp = current_fingerprint()
+    specs = list(DEFAULT_WARM_SPECS)
+    for spec in chart_cache.most_requested(limit):
+        name, params = json.loads(spec)
+        specs.append((name, params))
+
+    warmed = 0
+    with db_connection() as conn:
+        for name, params in specs:
+            key = cache_key(name, params, fp)
+            if key in chart_cache:
+                continue
+            model, compute = CHART_ENDPOINTS[name]
+            try:
+                chart_cache.put(key, compute(conn, model(**params)))
+            except Exception:
+                continue
+            warmed += 1
+    return warmed
+
+
+def start_cache_warm(fp: str):
+    with _warm_state["lock"]:
+        if _warm_state["fingerprint"] == fp:
+            return
+        _warm_state["fingerprint"] = fp
+    bulk_executor.submit(_warm_quietly)
+
+
+def _warm_quietly():
+    try:
+        # A new build: its tables and indexes first, so the charts use them
+        load_memory()
+        warm_chart_cache()
+    except HTTPException:
+        pass
+
+
+@app.post("/api/cache/warm")
+async def cache_warm(limit: int = CACHE_WARM_TOP):
+    warmed = await run_in(bulk_executor, warm_chart_cache, limit)
+    return {"warmed": warmed, "cache": chart_cache.metrics()}
+
+
+def fetch_overlapping_antibodies(conn: sqlite3.Connection) -> dict:
+    rows = conn.execute(
+        "SELECT name_norm FROM antibody_dim WHERE n_ctgov_all > 0 AND n_label_final > 0 ORDER BY name_norm"
+    ).fetchall()
+    overlap = [r[0] for r in rows]
     return {"antibodies": overlap, "count": len(overlap)}
 
 
-@app.get("/api/targets")
-def get_targets(table: str = "ctgov_all"):
-    validate_table(table)
-    conn = get_conn()
+MAX_BATCH_SPECS = 32
+
+
+class BatchRequest(BaseModel):
+    table: str = "ctgov_all"
+    filters: dict = {}
+    search: Optional[str] = None
+    # Each spec is {"type": <chart name or "query">, ...that request's fields};
+    # table, filters and search are shared and filled in from the batch
+    specs: list[dict]
+
+
+def batch_item(req: BatchRequest, spec: dict):
+    """Build the request model a batch spec stands for"""
+    params = dict(spec)
+    name = params.pop("type", None)
+    if name == "query":
+        model = QueryRequest
+    elif name in CHART_ENDPOINTS:
+        model = CHART_ENDPOINTS[name][0]
+    else:
+        raise HTTPException(400, f"Invalid batch spec type: {name}. Must be one of {['query', *CHART_ENDPOINTS]}")
+    shared = {"table": req.table, "filters": req.filters, "search": req.search}
+    params.update({k: v for k, v in shared.items() if k in model.model_fields})
+    try:
+        return name, model(**params)
+    except ValidationError as e:
+        raise HTTPException(400, f"Invalid {name} spec: {e.errors()[0]['msg']}")
+
+
+def fused_branch(index: int, name: str, req: BaseModel):
+    """
+    SELECT over the shared filtered set f answering a distribution or base-table
+    AE spec, plus the columns it reads; None if the spec isn't fused.
+    """
+    if name == "distribution":
+        col = quote_col(req.column)
+        sql = (f'SELECT {index} AS spec, {col} AS label, COUNT(DISTINCT "antibody") AS value, NULL AS cnt '
+               f"FROM f WHERE {col} IS NOT NULL GROUP BY {col}")
+        return sql, [req.column, "antibody"]
+    if name != "adverse-events" or engine.ENGINE == "memory":
+        return None
+    tt = table_type(req.table)
+    grade_col = req.grade_col if req.grade_col in LABEL_GRADE_COLUMNS else "all_grades%"
+    metric = CTGOV_RATE_METRIC if tt == "ctgov" else grade_col
+    if rollup_where(req.table, metric, req.group_by, req.filters, req.search):
+        return None
+    gcol = quote_col(req.group_by)
+    if tt == "ctgov":
+        sql = (f"SELECT {index}, {gcol}, AVG(events_ab * 100.0 / n_ab), COUNT(*) FROM f "
+               f"WHERE {gcol} IS NOT NULL AND events_ab IS NOT NULL AND n_ab IS NOT NULL AND n_ab > 0 "
+               f"GROUP BY {gcol}")
+        return sql, [req.group_by, "events_ab", "n_ab"]
+    pct_col = quote_col(grade_col)
+    sql = (f"SELECT {index}, {gcol}, AVG({pct_col}), COUNT(*) FROM f "
+           f"WHERE {gcol} IS NOT NULL AND {pct_col} IS NOT NULL GROUP BY {gcol}")
+    return sql, [req.group_by, grade_col]
+
+
+def compute_batch_item(conn: sqlite3.Connection, name: str, item: BaseModel) -> dict:
+    if name == "query":
+        return fetch_page(conn, item)
+    return CHART_ENDPOINTS[name][1](conn, item)
+
+
+def batch_item_result(conn: sqlite3.Connection, name: str, item: BaseModel) -> dict:
+    """compute_batch_item(), with a failure as {"error": ...}"""
+    try:
+        return compute_batch_item(conn, name, item)
+    except HTTPException as e:
+        return {"error": e.detail}
+    except sqlite3.Error as e:
+        if str(e) == "interrupted":
+            raise
+        return {"error": str(e)}
+
+
+def compute_batch(conn: sqlite3.Connection, req: BatchRequest, items: list) -> dict:
+    """
+    Answer (index, name, request) items on one connection. Distribution and
+    base-table AE specs share a single statement that filters the table once
+    into a materialized CTE and groups it once per spec. A spec that fails
+    gets {"error": ...} in place of its result.
+    """
+    results = {}
+    branches, fused, needed = [], {}, set()
+    columns = set(table_columns(conn, req.table))
+    for index, name, item in items:
+        branch = fused_branch(index, name, item)
+        if not branch:
+            results[index] = batch_item_result(conn, name, item)
+            continue
+        missing = set(branch[1]) - columns
+        if missing:
+            results[index] = {"error": f"Invalid column(s) for {req.table}: {sorted(missing)}"}
+            continue
+        branches.append(branch[0])
+        needed.update(branch[1])
+        fused[index] = (name, item)
+
+    if branches:
+        where, params = build_where(req.table, req.filters, req.search)
+        cols = ", ".join(quote_col(c) for c in sorted(needed))
+        sql = f"WITH f AS MATERIALIZED (SELECT {cols} FROM {req.table}{where}) " + " UNION ALL ".join(branches)
+        groups = {index: [] for index in fused}
+        try:
+            for r in conn.execute(sql, params).fetchall():
+                groups[r[0]].append(r)
+        except sqlite3.Error as e:
+            if str(e) == "interrupted":
+                raise
+            # One bad branch fails the whole statement: answer the fused specs
+            # one at a time instead, so only that spec reports the error
+            for index, (name, item) in fused.items():
+                results[index] = batch_item_result(conn, name, item)
+            return results
+        for index, (name, item) in fused.items():
+            if name == "distribution":
+                # Same ordering as the single-chart query: ORDER BY value DESC,
+                # label, where SQLite sorts numbers before text
+                rows = sorted(groups[index], key=lambda r: (isinstance(r[1], str), r[1]))
+                rows = sorted(rows, key=lambda r: r[2], reverse=True)
+                results[index] = {"labels": [r[1] for r in rows], "values": [r[2] for r in rows]}
+            else:
+                # ORDER BY ROUND(avg_pct, 2) DESC, category
+                rows = sorted(groups[index], key=lambda r: r[1])
+                rows = sorted(rows, key=lambda r: rounded_pct(r[2]), reverse=True)[:item.top_n]
+                results[index] = {
+                    "categories": [r[1] for r in rows],
+                    "proportions": [rounded_pct(r[2]) for r in rows],
+                    "counts": [r[3] for r in rows],
+                }
+    return results
+
+
+@app.post("/api/batch")
+async def batch(req: BatchRequest):
+    """Several chart/query specs over one filter set, answered in one round-trip"""
+    validate_table(req.table)
+    if len(req.specs) > MAX_BATCH_SPECS:
+        raise HTTPException(400, f"At most {MAX_BATCH_SPECS} specs per batch")
+    items = [batch_item(req, spec) for spec in req.specs]
+
+    results = [None] * len(items)
+    keys, misses = {}, []
+    for index, (name, item) in enumerate(items):
+        if name in CHART_ENDPOINTS:
+            key, found, value = lookup_chart(name, item)
+            if found:
+                results[index] = value
+                continue
+            keys[index] = key
+        misses.append((index, name, item))
+
+    if misses:
+        computed = await run_query(compute_batch, req, misses)
+        for index, value in computed.items():
+            results[index] = value
+            if index in keys and "error" not in value:
+                chart_cache.put(keys[index], value)
+    return {"results": results}
+
+
+@app.get("/api/overlapping-antibodies")
+async def get_overlapping_antibodies():
+    # One read of antibody_dim per database build
+    key = cache_key("overlapping-antibodies", {}, current_fingerprint())
+    found, value = chart_cache.get(key)
+    if not found:
+        value = await run_query(fetch_overlapping_antibodies)
+        chart_cache.put(key, value)
+    return value
+
+
+def fetch_targets(conn: sqlite3.Connection, table: str) -> dict:
     rows = conn.execute(
         f'SELECT DISTINCT {quote_col("target_1")} FROM {table} WHERE {quote_col("target_1")} IS NOT NULL ORDER BY {quote_col("target_1")}'
     ).fetchall()
-    conn.close()
     return {"targets": [r[0] for r in rows]}
 
 
-@app.get("/api/antibodies-with-comparator")
-def get_antibodies_with_comparator(table: str = "ctgov_all"):
+@app.get("/api/targets")
+async def get_targets(table: str = "ctgov_all"):
     validate_table(table)
-    conn = get_conn()
+    return await run_query(fetch_targets, table)
+
+
+def fetch_antibodies_with_comparator(conn: sqlite3.Connection, table: str) -> dict:
     tt = table_type(table)
     
     if tt == "ctgov":
@@ -565,57 +1441,175 @@ def get_antibodies_with_comparator(table: str = "ctgov_all"):
                 ORDER BY {quote_col("antibody")}'''
         ).fetchall()
     
-    conn.close()
     return {"antibodies": [r[0] for r in rows]}
 
 
-@app.get("/api/studies")
-def list_studies(table: str = "ctgov_all", antibody: str = ""):
+@app.get("/api/antibodies-with-comparator")
+async def get_antibodies_with_comparator(table: str = "ctgov_all"):
     validate_table(table)
-    if table_type(table) != "ctgov":
-        return {"studies": []}
-    conn = get_conn()
-    where = f' WHERE {quote_col("antibody")} LIKE ?' if antibody else ""
-    params = [f"%{antibody}%"] if antibody else []
+    return await run_query(fetch_antibodies_with_comparator, table)
+
+
+def fetch_studies(conn: sqlite3.Connection, table: str, antibody: str) -> dict:
+    where, params = "", []
+    if antibody:
+        clause, params = antibody_search_clause(table, antibody)
+        where = f" WHERE {clause}"
     rows = conn.execute(
         f'SELECT DISTINCT nct_id FROM {table}{where} ORDER BY nct_id', params
     ).fetchall()
-    conn.close()
     return {"studies": [r["nct_id"] for r in rows]}
 
 
+@app.get("/api/studies")
+async def list_studies(table: str = "ctgov_all", antibody: str = ""):
+    validate_table(table)
+    if table_type(table) != "ctgov":
+        return {"studies": []}
+    return await run_query(fetch_studies, table, antibody)
+
+
+# Trigram matching needs at least three characters; shorter terms fall back
+# to LIKE over the (small) distinct-value index.
+MIN_FTS_TERM = 3
+
+
+def fetch_search_results(conn: sqlite3.Connection, term: str, table: Optional[str],
+                         field_list: list, limit: int) -> list:
+    clauses, params = [], []
+    if len(term) >= MIN_FTS_TERM:
+        clauses.append("search_index MATCH ?")
+        params.append("value : " + fts_phrase(term))
+        score = "bm25(search_index)"
+    else:
+        clauses.append("value LIKE ?")
+        params.append(f"%{term}%")
+        score = "0.0"
+    if table:
+        clauses.append("table_name = ?")
+        params.append(table)
+    if field_list:
+        clauses.append(f"field IN ({','.join(['?'] * len(field_list))})")
+        params.extend(field_list)
+
+    sql = f"""
+        SELECT table_name, field, value, cnt, {score} AS score
+        FROM search_index
+        WHERE {" AND ".join(clauses)}
+        ORDER BY lower(value) = lower(?) DESC, value LIKE ? DESC, score, cnt DESC
+        LIMIT ?
+    """
+    rows = conn.execute(sql, params + [term, f"{term}%", limit]).fetchall()
+    return [
+        {"table": r["table_name"], "field": r["field"], "value": r["value"],
+         "count": r["cnt"], "score": round(r["score"], 4)}
+        for r in rows
+    ]
+
+
+@app.get("/api/search")
+async def search(q: str, table: Optional[str] = None, fields: Optional[str] = None, limit: int = 20):
+    """Ranked substring search over antibody, condition, AE term and target values"""
+    term = q.strip()
+    if not term:
+        return {"query": q, "results": []}
+    if table:
+        validate_table(table)
+    field_list = [f.strip() for f in fields.split(",") if f.strip()] if fields else []
+    return {"query": q, "results": await run_query(fetch_search_results, term, table, field_list, limit)}
+
+
+def export_chunks(conn: sqlite3.Connection, table: str, where: str, params: list, format: str, gzip: bool):
+    """Encoded export body; the first step runs the query and 404s on no rows"""
+    batch_size = COLUMNAR_BATCH_SIZE if format in ARROW_FORMATS else EXPORT_BATCH_SIZE
+    cursor = conn.execute(f"SELECT * FROM {table}{where}", params)
+    first_rows = cursor.fetchmany(batch_size)
+    if not first_rows:
+        raise HTTPException(404, "No data matching filters")
+    columns = [d[0] for d in cursor.description]
+    if format == "csv":
+        chunks = csv_chunks(cursor, first_rows, columns)
+    else:
+        types = column_types(conn, table)
+        col_types = [types.get(c, "TEXT") for c in columns]
+        if format == "ndjson":
+            chunks = ndjson_chunks(cursor, first_rows, columns, col_types)
+        else:
+            chunks = arrow_chunks(cursor, first_rows, columns, col_types, format)
+    if gzip:
+        chunks = gzip_chunks(chunks)
+    yield from chunks
+
+
+def next_chunk(conn: sqlite3.Connection, chunks):
+    """Encode the next export batch, allowing each batch EXPORT_TIMEOUT in SQLite"""
+    try:
+        with deadline(conn, time.monotonic() + EXPORT_TIMEOUT):
+            return next(chunks, None)
+    except QueryTimeout:
+        raise HTTPException(504, "Export query took too long and was cancelled.")
+
+
+async def stream_export(conn: sqlite3.Connection, chunks):
+    """Pull chunks on the bulk executor, returning conn to export_pool once streaming ends"""
+    pending = None
+    try:
+        while True:
+            pending = asyncio.ensure_future(run_in(bulk_executor, next_chunk, conn, chunks))
+            chunk = await asyncio.shield(pending)
+            if chunk is None:
+                break
+            yield chunk
+    finally:
+        # If the client went away mid-batch, let the worker finish with the
+        # connection before closing the generator and pooling it again
+        if pending is not None and not pending.done():
+            await asyncio.wait([pending])
+        chunks.close()
+        export_pool.release(conn)
+
+
+async def prepend(head: bytes, body):
+    yield head
+    async for chunk in body:
+        yield chunk
+
+
 @app.get("/api/export")
-def export_csv(table: str = "ctgov_all", filters: Optional[str] = None, search: Optional[str] = None):
+async def export_data(table: str = "ctgov_all", filters: Optional[str] = None, search: Optional[str] = None,
+                      format: str = "csv", gzip: bool = False):
     validate_table(table)
-    conn = get_conn()
+    if format not in EXPORT_FORMATS:
+        raise HTTPException(400, f"Invalid format: {format}. Must be one of {list(EXPORT_FORMATS)}")
+    if format in ARROW_FORMATS and pa is None:
+        raise HTTPException(501, f"{format} export requires pyarrow, which is not installed")
+    # Parquet and Arrow IPC are compressed per column already
+    gzip = gzip and format not in ARROW_FORMATS
 
     filter_dict = {}
     if filters:
-        import json
         try:
             filter_dict = json.loads(filters)
         except Exception:
             pass
 
     where, params = build_where(table, filter_dict, search)
-    rows = conn.execute(f"SELECT * FROM {table}{where}", params).fetchall()
-    if not rows:
-        conn.close()
-        raise HTTPException(404, "No data matching filters")
-
-    columns = rows[0].keys()
-    output = io.StringIO()
-    writer = csv.writer(output)
-    writer.writerow(columns)
-    for r in rows:
-        writer.writerow([r[c] for c in columns])
-    conn.close()
-
-    output.seek(0)
+    conn = await run_in(bulk_executor, acquire_export_connection)
+    body = stream_export(conn, export_chunks(conn, table, where, params, format, gzip))
+    # Pull the first chunk here so a 404 or timeout is still a proper error
+    # response, and so the generator's finally clause releases the connection
+    # even if the client disconnects before the first read.
+    head = await body.__anext__()
+
+    media_type, ext = EXPORT_FORMATS[format]
+    filename = f"{table}_export.{ext}"
+    if gzip:
+        media_type = "application/gzip"
+        filename += ".gz"
     return StreamingResponse(
-        iter([output.getvalue()]),
-        media_type="text/csv",
-        headers={"Content-Disposition": f"attachment; filename={table}_export.csv"},
+        prepend(head, body),
+        media_type=media_type,
+        headers={"Content-Disposition": f"attachment; filename={filename}"},
     )
 
 
@@ -0,0 +1,144 @@
+"""
+Response encoding: JSON bodies serialized with orjson, and gzip/brotli
+compression negotiated from each request's Accept-Encoding.
+
+Both dependencies are optional. Without orjson bodies fall back to the
+standard json module, and without brotli only gzip is offered. Clients that
+send no Accept-Encoding get the same uncompressed bytes as before.
+"""
+import gzip
+import os
+
+from starlette.responses import JSONResponse
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# Compress JSON/text responses at least this large; set to 0 to disable
+COMPRESS_MIN_BYTES = int(os.environ.get("MAB_COMPRESS_MIN_BYTES", "1024"))
+GZIP_LEVEL = int(os.environ.get("MAB_GZIP_LEVEL", "6"))
+BROTLI_QUALITY = int(os.environ.get("MAB_BROTLI_QUALITY", "5"))
+
+COMPRESSIBLE_TYPES = ("application/json", "text/", "application/x-ndjson", "image/svg+xml")
+
+if orjson is not None:
+    ORJSON_OPTIONS = orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY
+
+
+class JSONBody(JSONResponse):
+    """JSONResponse rendered with orjson when it is installed"""
+
+    def render(self, content) -> bytes:
+        if orjson is None:
+            return super().render(content)
+        return orjson.dumps(content, option=ORJSON_OPTIONS)
+
+
+def accepted_encodings(header: str) -> dict:
+    """{coding: q} from an Accept-Encoding header"""
+    accepted = {}
+    for part in header.split(","):
+        coding, _, params = part.strip().partition(";")
+        if not coding:
+            continue
+        q = 1.0
+        for param in params.split(";"):
+            name, _, value = param.strip().partition("=")
+            if name == "q":
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        accepted[coding.strip().lower()] = q
+    return accepted
+
+
+def choose_encoding(header: str):
+    """The coding to use for a response, brotli first; None for identity"""
+    accepted = accepted_encodings(header)
+    wildcard = accepted.get("*", 0.0)
+    offered = ["br", "gzip"] if brotli is not None else ["gzip"]
+    best = max(offered, key=lambda c: accepted.get(c, wildcard))
+    return best if accepted.get(best, wildcard) > 0 else None
+
+
+def compress(body: bytes, encoding: str) -> bytes:
+    if encoding == "br":
+        return brotli.compress(body, quality=BROTLI_QUALITY)
+    return gzip.compress(body, compresslevel=GZIP_LEVEL, mtime=0)
+
+
+def negotiated(headers: list, encoding) -> list:
+    """Headers for a response that varies by Accept-Encoding, encoded with encoding"""
+    vary = [v for n, v in headers if n == b"vary"]
+    headers = [(n, v) for n, v in headers if n != b"vary"]
+    headers.append((b"vary", b", ".join([*vary, b"Accept-Encoding"])))
+    if encoding:
+        # The compressed bytes differ, so the representation's ETag is only weak
+        headers = [(n, b"W/" + v if n == b"etag" and not v.startswith(b"W/") else v) for n, v in headers]
+    return headers
+
+
+def compressible(headers: list) -> bool:
+    content_type = ""
+    for name, value in headers:
+        if name == b"content-encoding":
+            return False
+        if name == b"content-type":
+            content_type = value.decode("latin-1")
+    return content_type.startswith(COMPRESSIBLE_TYPES)
+
+
+class CompressionMiddleware:
+    """
+    ASGI middleware compressing whole JSON/text bodies with the client's
+    preferred coding. Streamed bodies (exports) pass through as they are,
+    since /api/export has its own gzip option.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or COMPRESS_MIN_BYTES <= 0:
+            return await self.app(scope, receive, send)
+        header = ""
+        for name, value in scope["headers"]:
+            if name == b"accept-encoding":
+                header = value.decode("latin-1")
+        encoding = choose_encoding(header) if header else None
+        start = None
+
+        async def send_compressed(message):
+            nonlocal start
+            if message["type"] == "http.response.start":
+                if message["status"] == 304:
+                    # Must carry the same ETag the compressed 200 had
+                    headers = negotiated(message.get("headers", []), encoding)
+                    return await send({**message, "headers": headers})
+                if not compressible(message.get("headers", [])):
+                    return await send(message)
+                start = message
+                return
+            if start is None or message["type"] != "http.response.body":
+                return await send(message)
+            started, start = start, None
+            body = message.get("body", b"")
+            if encoding and not message.get("more_body") and len(body) >= COMPRESS_MIN_BYTES:
+                body = compress(body, encoding)
+                headers = [(n, v) for n, v in negotiated(started.get("headers", []), encoding) if n != b"content-length"]
+                headers += [(b"content-encoding", encoding.encode()), (b"content-length", str(len(body)).encode())]
+                message = {**message, "body": body}
+            else:
+                headers = negotiated(started.get("headers", []), None)
+            await send({**started, "headers": headers})
+            await send(message)
+
+        await self.app(scope, receive, send_compressed)
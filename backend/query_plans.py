@@ -0,0 +1,112 @@
+"""
+EXPLAIN QUERY PLAN check for the hot API endpoints.
+
+Runs representative requests through the endpoint functions in main.py on a
+recording connection and reports every filtered statement whose plan reads
+a table in full instead of searching an index.
+
+    python query_plans.py [path/to/mab_database.sqlite]
+"""
+import re
+import sys
+
+from db import DB_PATH, PooledConnection, db_fingerprint, open_readonly
+
+# A whole-table read, directly or through every entry of an index
+FULL_SCAN = re.compile(r"^SCAN (?:TABLE )?(\w+)(?: USING (?:COVERING )?INDEX \w+)?$")
+# An index walked only by a range (the col>? of IS NOT NULL): still every
+# row, which matters when the statement has an equality the index can't use
+RANGE_ONLY = re.compile(r"^SEARCH (\w+) USING (?:COVERING )?INDEX \w+ \(\w+[<>]\?(?: AND \w+[<>]\?)?\)$")
+EQUALITY = re.compile(r"= \?|\bIN \(", re.IGNORECASE)
+
+
+class PlanRecorder(PooledConnection):
+    """Connection that records the query plan of every SELECT it executes"""
+    endpoint = None
+
+    def execute(self, sql, params=()):
+        if self.endpoint and sql.lstrip().upper().startswith(("SELECT", "WITH")):
+            plan = super().execute("EXPLAIN QUERY PLAN " + sql, params).fetchall()
+            self.plans.append((self.endpoint, sql, [r["detail"] for r in plan]))
+        return super().execute(sql, params)
+
+
+def _sample(conn, sql, params=()):
+    row = conn.execute(sql, params).fetchone()
+    return row[0] if row else None
+
+
+def workload(conn) -> list:
+    """(endpoint, call) pairs covering the query shapes in ingest.QUERY_TEMPLATES"""
+    import main
+
+    antibody = _sample(conn, "SELECT antibody FROM ctgov_all WHERE n_comp > 0 GROUP BY antibody ORDER BY COUNT(*) DESC")
+    label_antibody = _sample(conn, "SELECT antibody FROM label_final GROUP BY antibody ORDER BY COUNT(*) DESC")
+    target = _sample(conn, "SELECT target_1 FROM ctgov_all GROUP BY target_1 ORDER BY COUNT(*) DESC")
+    nct_id = _sample(conn, "SELECT nct_id FROM ctgov_all WHERE antibody = ?", [antibody])
+    calls = []
+    for table in ["ctgov_all", "label_final"]:
+        ab = antibody if table == "ctgov_all" else label_antibody
+        filters = {"antibody": [ab]}
+        calls += [
+            ("query", lambda c, t=table, f=filters: main.fetch_page(c, main.QueryRequest(table=t, filters=f))),
+            ("distribution", lambda c, t=table, f=filters: main.compute_distribution(
+                c, main.DistributionRequest(table=t, column="record_category", filters=f))),
+            ("adverse-events", lambda c, t=table: main.compute_adverse_events(
+                c, main.AEChartRequest(table=t, filters={"organ_system": ["Cardiac disorders"]}))),
+            ("comparative", lambda c, t=table, a=ab: main.compute_comparative(
+                c, main.ComparativeRequest(table=t, antibody=a))),
+            ("target-aggregation", lambda c, t=table: main.compute_target_aggregation(
+                c, main.TargetAggregationRequest(table=t, target=target))),
+            ("targets", lambda c, t=table: main.fetch_targets(c, t)),
+            ("antibodies-with-comparator", lambda c, t=table: main.fetch_antibodies_with_comparator(c, t)),
+        ]
+    calls += [
+        ("comparative", lambda c: main.compute_comparative(
+            c, main.ComparativeRequest(antibody=antibody, nct_id=nct_id))),
+        ("cross-dataset", lambda c: main.compute_cross_dataset(
+            c, main.CrossDatasetRequest(antibody=antibody.upper()))),
+        ("studies", lambda c: main.fetch_studies(c, "ctgov_all", antibody)),
+    ]
+    return calls
+
+
+def check_query_plans(path: str = DB_PATH) -> list:
+    """Return (endpoint, sql, plan) for each filtered statement that does a full scan"""
+    import main
+
+    conn = open_readonly(path, factory=PlanRecorder)
+    conn.fingerprint = db_fingerprint(path)
+    conn.plans = []
+    use_rollups = main.USE_ROLLUPS
+    try:
+        # Check the base-table paths, which the rollups otherwise hide
+        main.USE_ROLLUPS = False
+        for endpoint, call in workload(conn):
+            conn.endpoint = endpoint
+            call(conn)
+    finally:
+        main.USE_ROLLUPS = use_rollups
+        conn.close()
+
+    tables = set(main.VALID_TABLES)
+    flagged = []
+    for endpoint, sql, plan in conn.plans:
+        if " WHERE " not in sql.upper():
+            continue
+        scans = [d for d in plan if (m := FULL_SCAN.match(d)) and m.group(1) in tables]
+        if EQUALITY.search(sql):
+            scans += [d for d in plan if (m := RANGE_ONLY.match(d)) and m.group(1) in tables]
+        if scans:
+            flagged.append((endpoint, " ".join(sql.split()), plan))
+    return flagged
+
+
+if __name__ == "__main__":
+    flagged = check_query_plans(sys.argv[1] if len(sys.argv) > 1 else DB_PATH)
+    for endpoint, sql, plan in flagged:
+        print(f"FULL SCAN in {endpoint}: {sql}")
+        for detail in plan:
+            print(f"    {detail}")
+    print(f"{len(flagged)} full scan(s) in hot endpoint queries")
+    sys.exit(1 if flagged else 0)
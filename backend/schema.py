@@ -0,0 +1,97 @@
+"""
+Table layout shared by ingest.py and the API.
+"""
+
+VALID_TABLES = ["ctgov_all", "label_final", "label_bbw", "label_wap", "fc_mutations"]
+
+FILTERABLE_COLUMNS = {
+    "ctgov": [
+        "antibody", "general_molecular_category", "format_general_category",
+        "isotype_fc", "record_category", "target_1", "condition",
+        "organ_system", "phase", "moa_new", "event_type", "source",
+        "target_harmonized_new", "target_supercluster", "mesh_class",
+        "has_comparator", "is_single_arm",
+    ],
+    "label": [
+        "antibody", "general_molecular_category", "format_general_category",
+        "isotype_fc", "record_category", "target_1", "condition",
+        "organ_system", "moa_new", "source", "bbw", "wap",
+    ],
+    "fc_mutations": [
+        "antibody", "heavy_chain", "gene", "species", "effect",
+    ],
+}
+
+# Columns /api/query returns when a request doesn't pick its own: what the
+# data table shows up front, leaving out long text like rationale and
+# description_comment (those come with the full record from /api/record)
+SUMMARY_COLUMNS = {
+    "ctgov": [
+        "nct_id", "antibody", "condition", "organ_system", "adverse_event_term",
+        "general_molecular_category", "target_1", "moa_new", "record_category",
+        "duration", "phase", "n_ab", "events_ab", "n_comp", "events_comp", "source",
+    ],
+    "label": [
+        "antibody", "condition", "organ_system", "adverse_event_term",
+        "general_molecular_category", "target_1", "moa_new", "record_category",
+        "dose_mg", "dose_mg_kg", "frequency_days", "median_duration_days",
+        "all_grades%", "grade_3_4%", "grade_5%", "source",
+    ],
+    "fc_mutations": [
+        "antibody", "heavy_chain", "gene", "species", "imgt_nomenclature",
+        "eu_numbering", "effect",
+    ],
+}
+
+# Free-text fields indexed for substring search, where a table has them
+SEARCH_FIELDS = [
+    "antibody", "antibody_clean", "condition", "adverse_event_term",
+    "target_1", "target_2", "target_harmonized_new",
+]
+
+# ae_rollup pre-aggregates the adverse-event rate metrics by these group-by
+# columns and filter dimensions
+ROLLUP_GROUP_COLUMNS = ["organ_system", "adverse_event_term"]
+ROLLUP_DIMENSIONS = ["antibody", "target_1"]
+LABEL_GRADE_COLUMNS = ["all_grades%", "grade_3_4%", "grade_5%"]
+# CTGOV event rate per record: events_ab * 100 / n_ab
+CTGOV_RATE_METRIC = "event_pct"
+
+# Columns ingest.py coerces to numbers; other columns keep the type pandas
+# inferred from the workbook (INTEGER, REAL or TEXT)
+COLUMN_TYPES = {
+    # CTGOV arm counts
+    "events_ab": "INTEGER",
+    "n_ab": "INTEGER",
+    "events_comp": "INTEGER",
+    "n_comp": "INTEGER",
+    # FDA label incidence
+    "all_grades%": "REAL",
+    "all_gradesn": "INTEGER",
+    "grade_3_4%": "REAL",
+    "grade_3_4n": "INTEGER",
+    "grade_5%": "REAL",
+    "grade_5n": "INTEGER",
+    "comp_all_grades%": "REAL",
+    "comp_all_gradesn": "INTEGER",
+    "comp_grade_3_4%": "REAL",
+    "comp_grade_3_4n": "INTEGER",
+    "comp_grade_5%": "REAL",
+    "comp_grade_5n": "INTEGER",
+}
+
+
+def table_type(table: str) -> str:
+    if table.startswith("ctgov"):
+        return "ctgov"
+    elif table == "fc_mutations":
+        return "fc_mutations"
+    else:
+        return "label"
+
+
+def normalize_antibody(name):
+    """Key that spellings of an antibody name share across tables (antibody_dim.name_norm)"""
+    if name is None or not isinstance(name, str):
+        return None
+    return name.strip().lower() or None
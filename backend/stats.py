@@ -0,0 +1,50 @@
+"""
+Relative risk pooled across studies.
+
+Each ctgov record holds the events and sizes of the antibody and comparator
+arms for one reported term of one study. The records in a group (a category,
+or an antibody x category cell) are the strata of a Mantel-Haenszel estimate,
+with the Greenland-Robins variance for its 95% CI. The per-stratum terms are
+summed in SQL with MH_SUMS under a GROUP BY, so only one aggregated row per
+group reaches mantel_haenszel_rr.
+"""
+import math
+
+import numpy as np
+
+Z_95 = 1.959963984540054
+
+# Per-group sums of the Mantel-Haenszel terms over strata with
+# n_ab > 0 and n_comp > 0:
+#   R = a*n2/T, S = c*n1/T, P = (n1*n2*(a+c) - a*c*T)/T^2
+MH_SUMS = """
+    SUM(events_ab * 1.0 * n_comp / (n_ab + n_comp)) AS mh_r,
+    SUM(events_comp * 1.0 * n_ab / (n_ab + n_comp)) AS mh_s,
+    SUM((n_ab * 1.0 * n_comp * (events_ab + events_comp) - events_ab * 1.0 * events_comp * (n_ab + n_comp))
+        / ((n_ab + n_comp) * 1.0 * (n_ab + n_comp))) AS mh_p,
+    COUNT(*) AS strata
+"""
+
+
+def mantel_haenszel_rr(r, s, p):
+    """
+    (rr, ci_lower, ci_upper): float arrays from the per-group MH_SUMS, with
+    NaN where the estimate is undefined.
+    """
+    r = np.asarray(r, dtype=np.float64)
+    s = np.asarray(s, dtype=np.float64)
+    p = np.asarray(p, dtype=np.float64)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        rr = np.where(s > 0, r / s, np.nan)
+        # The CI needs events in both arms; RR alone only in the comparator
+        defined = (r > 0) & (s > 0)
+        se = np.sqrt(np.where(defined, p / (r * s), np.nan))
+        log_rr = np.log(np.where(defined, rr, np.nan))
+        lower = np.exp(log_rr - Z_95 * se)
+        upper = np.exp(log_rr + Z_95 * se)
+    return rr, lower, upper
+
+
+def rounded(values, digits: int = 3) -> list:
+    """Array to a JSON-ready list: rounded floats, None for NaN"""
+    return [None if math.isnan(v) else round(v, digits) for v in np.asarray(values, dtype=np.float64).tolist()]
@@ -0,0 +1,58 @@
+import json
+import os
+import sqlite3
+import sys
+
+import pytest
+
+# The backend modules import each other as top-level modules
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+# Rows per table in the synthetic build; enough for ties and empty groups
+SYNTHETIC_ROWS = 3000
+
+
+def open_build(path, fingerprint=None):
+    """A pooled-style connection on a build, as db.ConnectionPool hands out"""
+    from db import PooledConnection
+
+    conn = sqlite3.connect(path, factory=PooledConnection)
+    conn.row_factory = sqlite3.Row
+    conn.fingerprint = fingerprint or str(path)
+    return conn
+
+
+@pytest.fixture(scope="session")
+def synthetic_db(tmp_path_factory):
+    """Path of a small build of benchmark.py's synthetic data, through the ingest steps"""
+    import benchmark
+    from ingest import (
+        META_PATH, SHEETS, assign_antibody_ids, build_antibody_dim, build_derived, coerce_types, insert_rows,
+    )
+
+    with open(META_PATH) as f:
+        meta = json.load(f)
+    path = tmp_path_factory.mktemp("synthetic") / "mab_database.sqlite"
+    conn = sqlite3.connect(path, isolation_level=None)
+    conn.execute("BEGIN")
+    vocab = benchmark.Vocabulary(1, 0)
+    antibody_ids = {}
+    for table_name in SHEETS:
+        info = meta[table_name]
+        rows = min(info["rows"], SYNTHETIC_ROWS)
+        for i, df in enumerate(benchmark.synthetic_chunks(table_name, info["columns"], rows, vocab)):
+            df, schema, _ = coerce_types(df, table_name)
+            df, schema = assign_antibody_ids(df, schema, antibody_ids)
+            insert_rows(conn, table_name, df, schema, create=i == 0)
+        build_derived(conn, table_name, list(df.columns))
+    build_antibody_dim(conn, antibody_ids)
+    conn.execute("COMMIT")
+    conn.close()
+    return path
+
+
+@pytest.fixture
+def synthetic_conn(synthetic_db):
+    conn = open_build(synthetic_db)
+    yield conn
+    conn.close()
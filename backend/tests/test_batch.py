@@ -0,0 +1,66 @@
+import pytest
+
+import main
+
+SPECS = [
+    {"type": "distribution", "column": "record_category"},
+    {"type": "distribution", "column": "target_1"},
+    {"type": "adverse-events", "group_by": "organ_system"},
+    {"type": "adverse-events", "group_by": "adverse_event_term", "top_n": 10},
+    {"type": "rr-matrix"},
+    {"type": "facet-counts"},
+    {"type": "query", "page_size": 20, "sort_by": "n_ab"},
+]
+
+
+def batch_items(req: main.BatchRequest) -> list:
+    return [(index, *main.batch_item(req, spec)) for index, spec in enumerate(req.specs)]
+
+
+def one_by_one(conn, items: list) -> dict:
+    return {index: main.compute_batch_item(conn, name, item) for index, name, item in items}
+
+
+@pytest.mark.parametrize("use_rollups", [False, True])
+@pytest.mark.parametrize("table, filters", [
+    ("ctgov_all", {}),
+    ("ctgov_all", {"phase": ["Phase 2", "Phase 3"]}),
+    ("label_final", {"organ_system": ["Cardiac disorders", "Eye disorders"]}),
+])
+def test_batch_matches_the_single_endpoints(monkeypatch, synthetic_conn, use_rollups, table, filters):
+    monkeypatch.setattr(main, "USE_ROLLUPS", use_rollups)
+    specs = [s for s in SPECS if table == "ctgov_all" or s["type"] != "rr-matrix"]
+    req = main.BatchRequest(table=table, filters=filters, specs=specs)
+    items = batch_items(req)
+    assert main.compute_batch(synthetic_conn, req, items) == one_by_one(synthetic_conn, items)
+
+
+def test_a_failing_fused_branch_only_fails_its_spec(monkeypatch, synthetic_conn):
+    monkeypatch.setattr(main, "USE_ROLLUPS", False)
+    fused_branch = main.fused_branch
+
+    def broken(index, name, req):
+        branch = fused_branch(index, name, req)
+        if branch and index == 1:
+            return "SELECT 1, label, value, cnt FROM no_such_table", branch[1]
+        return branch
+
+    req = main.BatchRequest(table="ctgov_all", specs=SPECS)
+    items = batch_items(req)
+    expected = one_by_one(synthetic_conn, items)
+
+    monkeypatch.setattr(main, "fused_branch", broken)
+    # The statement fails as a whole; every spec is answered on its own
+    assert main.compute_batch(synthetic_conn, req, items) == expected
+
+
+def test_a_failing_spec_reports_its_error(monkeypatch, synthetic_conn):
+    monkeypatch.setattr(main, "USE_ROLLUPS", False)
+    req = main.BatchRequest(table="ctgov_all", specs=[
+        {"type": "distribution", "column": "record_category"},
+        {"type": "distribution", "column": "no_such_column"},
+        {"type": "query", "sort_by": "no_such_column"},
+    ])
+    results = main.compute_batch(synthetic_conn, req, batch_items(req))
+    assert results[0] == main.compute_distribution(synthetic_conn, batch_items(req)[0][2])
+    assert "error" in results[1] and "error" in results[2]
@@ -0,0 +1,165 @@
+"""
+The in-memory engine must return the same charts as the SQLite queries it
+stands in for, including SQLite's rounding of half-way rates.
+"""
+import sqlite3
+
+import numpy as np
+import pytest
+
+import bitmaps
+import engine
+import main
+from db import PooledConnection
+
+# (antibody, target_1, organ_system, events_ab, n_ab): rates like 7.525 and
+# 80.835 sit on a rounding half, where np.round and SQLite's ROUND disagree
+ROWS = [
+    ("abamab", "T1", "Cardiac disorders", 752, 10000),
+    ("abamab", "T1", "Cardiac disorders", 753, 10000),
+    ("bebumab", "T1", "Cardiac disorders", 80835, 100000),
+    ("cabamab", "T1", "Cardiac disorders", 17985, 100000),
+    ("abamab", "T1", "Hepatic disorders", 7525, 100000),
+    ("bebumab", "T1", "Hepatic disorders", 3, 40),
+    ("cabamab", "T1", "Skin disorders", 1, 8),
+    ("cabamab", "T1", "Skin disorders", 5, 0),
+    ("dabimab", "T2", "Cardiac disorders", 50, 100),
+    ("dabimab", "T1", None, 50, 100),
+]
+
+
+@pytest.fixture
+def conn(tmp_path):
+    path = tmp_path / "fixture.sqlite"
+    setup = sqlite3.connect(path)
+    setup.execute(
+        "CREATE TABLE ctgov_all (antibody TEXT, target_1 TEXT, organ_system TEXT, "
+        "adverse_event_term TEXT, events_ab INTEGER, n_ab INTEGER)"
+    )
+    setup.executemany("INSERT INTO ctgov_all VALUES (?, ?, ?, 'term', ?, ?)", ROWS)
+    setup.commit()
+    setup.close()
+    conn = sqlite3.connect(path, factory=PooledConnection)
+    conn.row_factory = sqlite3.Row
+    conn.fingerprint = str(path)
+    yield conn
+    conn.close()
+
+
+def both_engines(monkeypatch, compute, conn, req):
+    # The fixture has no ae_rollup, so the SQLite path reads the base table
+    monkeypatch.setattr(main, "USE_ROLLUPS", False)
+    results = []
+    for name in ("sqlite", "memory"):
+        monkeypatch.setattr(engine, "ENGINE", name)
+        results.append(compute(conn, req))
+    return results
+
+
+@pytest.mark.parametrize("top_n, top_k", [(15, None), (2, None), (0, 1)])
+def test_target_aggregation_engines_agree(monkeypatch, conn, top_n, top_k):
+    req = main.TargetAggregationRequest(table="ctgov_all", target="T1", top_n=top_n, top_k=top_k)
+    sql, memory = both_engines(monkeypatch, main.compute_target_aggregation, conn, req)
+    assert memory == sql
+
+
+def test_target_aggregation_rounds_halves_up(monkeypatch, conn):
+    req = main.TargetAggregationRequest(table="ctgov_all", target="T1")
+    sql, memory = both_engines(monkeypatch, main.compute_target_aggregation, conn, req)
+    rates = {d["category"]: {a["antibody"]: a["proportion"] for a in d["antibodies"]} for d in memory["data"]}
+    assert rates["Cardiac disorders"] == {"abamab": 7.53, "bebumab": 80.84, "cabamab": 17.99}
+    assert rates["Hepatic disorders"]["abamab"] == 7.53
+
+
+def test_target_antibodies_engines_agree(monkeypatch, conn):
+    req = main.TargetAntibodiesRequest(table="ctgov_all", target="T1", category="Cardiac disorders", page_size=2)
+    sql, memory = both_engines(monkeypatch, main.compute_target_antibodies, conn, req)
+    assert memory == sql
+    assert memory["total"] == 3
+
+
+@pytest.mark.parametrize("values", [
+    [80.835, 7.525, 17.985, 0.125, 2.675, 1.005, 12.345],
+    [v / 8 for v in range(-200, 200)],
+    [a * 100.0 / b for a in range(0, 60, 7) for b in range(1, 120, 3)],
+])
+def test_sql_round_matches_sqlite(values):
+    db = sqlite3.connect(":memory:")
+    expected = [db.execute("SELECT ROUND(?, 2)", [v]).fetchone()[0] for v in values]
+    assert engine.sql_round(np.array(values)).tolist() == expected
+
+
+def chart_requests(conn) -> list:
+    """(endpoint, request) pairs covering every chart over the synthetic build"""
+    def top(table, col, n):
+        return [r[0] for r in conn.execute(
+            f'SELECT "{col}" FROM {table} WHERE "{col}" IS NOT NULL GROUP BY 1 ORDER BY COUNT(*) DESC, 1 LIMIT {n}')]
+
+    requests = []
+    for table in ("ctgov_all", "label_final"):
+        antibodies, targets = top(table, "antibody", 3), top(table, "target_1", 3)
+        for group_by in ("organ_system", "adverse_event_term"):
+            for top_n in (5, 25):
+                requests.append(("adverse-events", main.AEChartRequest(table=table, group_by=group_by, top_n=top_n)))
+                for target in targets:
+                    requests.append(("adverse-events", main.AEChartRequest(
+                        table=table, group_by=group_by, top_n=top_n, filters={"target_1": [target]})))
+                for antibody in antibodies:
+                    requests.append(("comparative", main.ComparativeRequest(
+                        table=table, antibody=antibody, group_by=group_by, top_n=top_n)))
+            for target in targets:
+                requests.append(("target-aggregation", main.TargetAggregationRequest(
+                    table=table, target=target, group_by=group_by, top_k=3)))
+                category = top(table, group_by, 1)[0]
+                requests.append(("target-antibodies", main.TargetAntibodiesRequest(
+                    table=table, target=target, group_by=group_by, category=category)))
+        requests.append(("distribution", main.DistributionRequest(table=table, column="target_1")))
+        requests.append(("facet-counts", main.FacetRequest(table=table, filters={"antibody": antibodies[:1]})))
+    requests.append(("cross-dataset", main.CrossDatasetRequest(antibody=top("label_final", "antibody", 1)[0])))
+    requests.append(("rr-matrix", main.RRMatrixRequest()))
+    return requests
+
+
+def test_every_chart_agrees_across_engines(monkeypatch, synthetic_conn):
+    requests = chart_requests(synthetic_conn)
+    assert {name for name, _ in requests} == set(main.CHART_ENDPOINTS)
+    for name, req in requests:
+        compute = main.CHART_ENDPOINTS[name][1]
+        sql, memory = both_engines(monkeypatch, compute, synthetic_conn, req)
+        assert memory == sql, (name, req)
+
+
+def test_tied_means_keep_the_same_categories(monkeypatch, tmp_path):
+    # 0.1 + 0.2 and 0.3 are the same mean a rounding error apart; the tie at
+    # the top_n cutoff goes to the first category in either engine
+    path = tmp_path / "ties.sqlite"
+    setup = sqlite3.connect(path)
+    setup.execute('CREATE TABLE label_final (antibody TEXT, organ_system TEXT, "all_grades%" REAL)')
+    setup.executemany("INSERT INTO label_final VALUES ('abamab', ?, ?)", [
+        ("Renal", 0.1), ("Renal", 0.2), ("Cardiac", 0.15), ("Cardiac", 0.15), ("Hepatic", 0.3), ("Hepatic", 0.0),
+    ])
+    setup.commit()
+    setup.close()
+    conn = sqlite3.connect(path, factory=PooledConnection)
+    conn.row_factory = sqlite3.Row
+    conn.fingerprint = str(path)
+    for top_n in (1, 2, 3):
+        req = main.AEChartRequest(table="label_final", top_n=top_n)
+        sql, memory = both_engines(monkeypatch, main.compute_adverse_events, conn, req)
+        assert memory == sql
+        assert memory["categories"] == ["Cardiac", "Hepatic", "Renal"][:top_n]
+    conn.close()
+
+
+def test_facet_counts_use_sql_until_the_index_is_built(monkeypatch, synthetic_conn):
+    monkeypatch.setattr(main, "USE_BITMAP_INDEX", True)
+    monkeypatch.setattr(engine.store, "fingerprint", None)
+    monkeypatch.setattr(engine.store, "tables", {})
+    req = main.FacetRequest(table="ctgov_all", filters={"phase": ["Phase 2", "Phase 3"]})
+    before = main.compute_facet_counts(synthetic_conn, req)
+    # Answering from SQL loads nothing on the request thread
+    assert engine.store.tables == {}
+
+    bitmaps.warm_indexes(synthetic_conn)
+    assert bitmaps.built_index(synthetic_conn, "ctgov_all") is not None
+    assert main.compute_facet_counts(synthetic_conn, req) == before
@@ -0,0 +1,48 @@
+import io
+import json
+import sqlite3
+
+import pytest
+
+from export import arrow_chunks, column_types, ndjson_chunks
+
+
+def test_declared_type_wins_over_column_types():
+    # ingest.py stores n_ab as REAL when the sheet has fractional counts
+    conn = sqlite3.connect(":memory:")
+    conn.execute("CREATE TABLE ctgov_all (antibody TEXT, n_ab REAL, events_ab INTEGER, dose)")
+    conn.execute("INSERT INTO ctgov_all VALUES ('abamab', 12.5, 3, '1')")
+    types = column_types(conn, "ctgov_all")
+    assert types == {"antibody": "TEXT", "n_ab": "REAL", "events_ab": "INTEGER", "dose": "TEXT"}
+
+    cursor = conn.execute("SELECT * FROM ctgov_all")
+    columns = [d[0] for d in cursor.description]
+    body = b"".join(ndjson_chunks(cursor, cursor.fetchmany(10), columns, [types[c] for c in columns]))
+    assert json.loads(body) == {"antibody": "abamab", "n_ab": 12.5, "events_ab": 3, "dose": "1"}
+
+
+def test_column_types_fills_in_undeclared_columns():
+    conn = sqlite3.connect(":memory:")
+    conn.execute("CREATE TABLE label_final (antibody, n_ab, note)")
+    assert column_types(conn, "label_final") == {"antibody": "TEXT", "n_ab": "INTEGER", "note": "TEXT"}
+
+
+def test_fractional_values_in_integer_columns_export_as_real():
+    pq = pytest.importorskip("pyarrow.parquet")
+    conn = sqlite3.connect(":memory:")
+    conn.execute("CREATE TABLE ctgov_all (antibody TEXT, n_ab, events_ab INTEGER, n_comp INTEGER)")
+    conn.executemany("INSERT INTO ctgov_all VALUES (?, ?, ?, ?)", [
+        ("abamab", 12, 3, 40), ("bezmab", "12.5", 2.5, 41), ("cotmab", None, None, None),
+    ])
+    types = column_types(conn, "ctgov_all")
+    assert types == {"antibody": "TEXT", "n_ab": "REAL", "events_ab": "REAL", "n_comp": "INTEGER"}
+
+    cursor = conn.execute("SELECT * FROM ctgov_all")
+    columns = [d[0] for d in cursor.description]
+    body = b"".join(arrow_chunks(cursor, cursor.fetchmany(10), columns, [types[c] for c in columns], "parquet"))
+    assert pq.read_table(io.BytesIO(body)).to_pydict() == {
+        "antibody": ["abamab", "bezmab", "cotmab"],
+        "n_ab": [12.0, 12.5, None],
+        "events_ab": [3.0, 2.5, None],
+        "n_comp": [40, 41, None],
+    }
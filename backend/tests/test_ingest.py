@@ -0,0 +1,104 @@
+import json
+import sqlite3
+
+import pandas as pd
+import pytest
+
+import benchmark
+import ingest
+
+ROWS = 40
+
+
+def write_workbook(path, frames: dict):
+    with pd.ExcelWriter(path, engine="openpyxl") as writer:
+        for table_name, df in frames.items():
+            df.to_excel(writer, sheet_name=ingest.SHEETS[table_name], index=False)
+
+
+@pytest.fixture
+def workspace(tmp_path, monkeypatch):
+    """Synthetic sheets, and ingest pointed at a workbook, database and table_meta.json under tmp_path"""
+    with open(ingest.META_PATH) as f:
+        meta = json.load(f)
+    vocab = benchmark.Vocabulary(1, 0)
+    frames = {t: next(benchmark.synthetic_chunks(t, meta[t]["columns"], ROWS, vocab)).drop(columns="antibody_id")
+              for t in ingest.SHEETS}
+    paths = {"excel": tmp_path / "workbook.xlsx", "db": tmp_path / "mab_database.sqlite",
+             "meta": tmp_path / "table_meta.json"}
+    monkeypatch.setattr(ingest, "EXCEL_PATH", str(paths["excel"]))
+    monkeypatch.setattr(ingest, "DB_PATH", str(paths["db"]))
+    monkeypatch.setattr(ingest, "META_PATH", str(paths["meta"]))
+    monkeypatch.setattr(ingest, "LOAD_WORKERS", 1)
+
+    written = []
+    write_table = ingest.write_table
+
+    def record(conn, table_name, df, schema):
+        written.append(table_name)
+        return write_table(conn, table_name, df, schema)
+
+    monkeypatch.setattr(ingest, "write_table", record)
+    return frames, paths, written
+
+
+def build_state(paths) -> tuple:
+    with open(paths["meta"]) as f:
+        meta = json.load(f)
+    conn = sqlite3.connect(paths["db"])
+    state = dict(conn.execute("SELECT table_name, sha256 FROM ingest_state").fetchall())
+    rows = {t: conn.execute(f"SELECT COUNT(*) FROM {t}").fetchone()[0] for t in ingest.SHEETS}
+    conn.close()
+    return meta, state, rows
+
+
+def assert_in_step(paths):
+    """table_meta.json describes every table with the hash and row count the build has"""
+    meta, state, rows = build_state(paths)
+    assert list(meta) == list(ingest.SHEETS)
+    for table_name, info in meta.items():
+        assert info["sha256"] == state[table_name]
+        assert info["rows"] == rows[table_name]
+    assert not (paths["db"].parent / "mab_database.sqlite.staging").exists()
+    assert not (paths["meta"].parent / "table_meta.json.staging").exists()
+
+
+def test_incremental_rebuild_only_touches_the_changed_sheet(workspace):
+    frames, paths, written = workspace
+    write_workbook(paths["excel"], frames)
+    ingest.ingest()
+    assert written == list(ingest.SHEETS)
+    assert_in_step(paths)
+    meta_before, state_before, _ = build_state(paths)
+
+    # Nothing changed: nothing is rebuilt or republished
+    written.clear()
+    ingest.ingest()
+    assert written == []
+
+    frames["label_bbw"] = frames["label_bbw"].iloc[:-5]
+    write_workbook(paths["excel"], frames)
+    ingest.ingest()
+    assert written == ["label_bbw"]
+    assert_in_step(paths)
+    meta, state, rows = build_state(paths)
+    assert rows["label_bbw"] == ROWS - 5
+    assert state["label_bbw"] != state_before["label_bbw"]
+    for table_name in ingest.SHEETS:
+        if table_name != "label_bbw":
+            assert meta[table_name] == meta_before[table_name]
+            assert state[table_name] == state_before[table_name]
+
+
+def test_missing_table_meta_falls_back_to_a_full_rebuild(workspace):
+    frames, paths, written = workspace
+    write_workbook(paths["excel"], frames)
+    ingest.ingest()
+    paths["meta"].unlink()
+
+    written.clear()
+    frames["label_wap"] = frames["label_wap"].iloc[:-3]
+    write_workbook(paths["excel"], frames)
+    ingest.ingest()
+    assert written == list(ingest.SHEETS)
+    assert_in_step(paths)
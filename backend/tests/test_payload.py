@@ -0,0 +1,118 @@
+import gzip
+
+import pytest
+from starlette.applications import Starlette
+from starlette.responses import JSONResponse, Response, StreamingResponse
+from starlette.routing import Route
+from starlette.testclient import TestClient
+
+import payload
+from export import gzip_chunks
+
+ROWS = [{"antibody": f"mab{i}", "n_ab": i} for i in range(200)]
+
+
+def rows(request):
+    return JSONResponse(ROWS, headers={"ETag": '"rows-1"'})
+
+
+def small(request):
+    return JSONResponse({"ok": True})
+
+
+def export(request):
+    # As /api/export?gzip=true streams it
+    chunks = gzip_chunks(line.encode() for line in ["antibody,n_ab\n", *(f"mab{i},{i}\n" for i in range(500))])
+    return StreamingResponse(chunks, media_type="application/gzip")
+
+
+def precompressed(request):
+    body = gzip.compress(b'{"cached": true}' * 200)
+    return Response(body, media_type="application/json", headers={"Content-Encoding": "gzip"})
+
+
+def not_modified(request):
+    return Response(status_code=304, headers={"ETag": '"rows-1"'})
+
+
+@pytest.fixture
+def client():
+    app = Starlette(routes=[Route(f"/{f.__name__}", f) for f in (rows, small, export, precompressed, not_modified)])
+    app.add_middleware(payload.CompressionMiddleware)
+    return TestClient(app)
+
+
+def get(client, path, accept_encoding):
+    # httpx decodes gzip/br bodies itself; the headers say what was sent
+    return client.get(path, headers={"Accept-Encoding": accept_encoding})
+
+
+@pytest.mark.parametrize("header, expected", [
+    ("gzip", "gzip"),
+    ("gzip, br", "gzip"),
+    ("br;q=0, gzip;q=0.5", "gzip"),
+    ("*", "gzip"),
+    ("gzip;q=0", None),
+    ("identity", None),
+    ("deflate", None),
+])
+def test_gzip_without_brotli(monkeypatch, header, expected):
+    monkeypatch.setattr(payload, "brotli", None)
+    assert payload.choose_encoding(header) == expected
+
+
+def test_brotli_preferred_when_installed():
+    pytest.importorskip("brotli")
+    assert payload.choose_encoding("gzip, br") == "br"
+    assert payload.choose_encoding("gzip, br;q=0.5") == "gzip"
+    assert payload.choose_encoding("*") == "br"
+
+
+@pytest.mark.parametrize("encoding", ["gzip", "br"])
+def test_json_is_compressed_with_the_negotiated_coding(monkeypatch, client, encoding):
+    if encoding == "br":
+        pytest.importorskip("brotli")
+    else:
+        monkeypatch.setattr(payload, "brotli", None)
+    response = get(client, "/rows", f"{encoding}, br;q=0.1" if encoding == "gzip" else "gzip;q=0.5, br")
+    assert response.headers["content-encoding"] == encoding
+    assert response.headers["vary"] == "Accept-Encoding"
+    assert response.headers["etag"] == 'W/"rows-1"'
+    assert response.json() == ROWS
+
+
+def test_identity_responses_still_vary(client):
+    response = get(client, "/rows", "identity")
+    assert "content-encoding" not in response.headers
+    assert response.headers["vary"] == "Accept-Encoding"
+    # The bytes are the representation's own, so the ETag stays strong
+    assert response.headers["etag"] == '"rows-1"'
+    assert response.json() == ROWS
+
+
+def test_small_bodies_are_not_compressed(client):
+    response = get(client, "/small", "gzip")
+    assert "content-encoding" not in response.headers
+    assert response.headers["vary"] == "Accept-Encoding"
+    assert response.json() == {"ok": True}
+
+
+def test_gzip_exports_pass_through(client):
+    response = get(client, "/export", "gzip")
+    assert "content-encoding" not in response.headers
+    assert "vary" not in response.headers
+    assert gzip.decompress(response.content).decode().startswith("antibody,n_ab\nmab0,0\n")
+
+
+def test_already_encoded_bodies_pass_through(client):
+    response = get(client, "/precompressed", "gzip")
+    assert response.headers["content-encoding"] == "gzip"
+    assert "vary" not in response.headers
+    assert response.content == b'{"cached": true}' * 200
+
+
+def test_not_modified_carries_the_compressed_etag(client):
+    response = get(client, "/not_modified", "gzip")
+    assert response.status_code == 304
+    assert response.headers["vary"] == "Accept-Encoding"
+    assert response.headers["etag"] == 'W/"rows-1"'
@@ -0,0 +1,96 @@
+import sqlite3
+
+import pytest
+from fastapi import HTTPException
+
+import main
+from db import PooledConnection
+
+
+def open_build(path, fingerprint):
+    conn = sqlite3.connect(path, factory=PooledConnection)
+    conn.row_factory = sqlite3.Row
+    conn.fingerprint = fingerprint
+    return conn
+
+
+def test_projection_follows_the_live_schema(tmp_path):
+    path = tmp_path / "build.sqlite"
+    setup = sqlite3.connect(path)
+    setup.execute("CREATE TABLE label_final (antibody TEXT, condition TEXT, rationale TEXT)")
+    setup.execute("INSERT INTO label_final VALUES ('abamab', 'asthma', 'long text')")
+    setup.commit()
+
+    conn = open_build(path, "build-1")
+    page = main.fetch_page(conn, main.QueryRequest(table="label_final"))
+    assert page["data"] == [{"antibody": "abamab", "condition": "asthma"}]
+    with pytest.raises(HTTPException) as err:
+        main.fetch_page(conn, main.QueryRequest(table="label_final", columns=["dose_mg"]))
+    assert err.value.status_code == 400
+
+    # A rebuild that adds a column is served as soon as the pool moves to it
+    setup.execute("ALTER TABLE label_final ADD COLUMN dose_mg REAL")
+    setup.execute("UPDATE label_final SET dose_mg = 2.5")
+    setup.commit()
+    setup.close()
+    conn = open_build(path, "build-2")
+    page = main.fetch_page(conn, main.QueryRequest(table="label_final", columns=["antibody", "dose_mg"]))
+    assert page["data"] == [{"antibody": "abamab", "dose_mg": 2.5}]
+    page = main.fetch_page(conn, main.QueryRequest(table="label_final", columns=["*"], format="columnar"))
+    assert page["columns"] == ["antibody", "condition", "rationale", "dose_mg"]
+
+
+def all_pages(conn, req: main.QueryRequest, keyset: bool) -> list:
+    """Every (rowid, row) of a query, page by page through cursors or page numbers"""
+    rows, page = [], 1
+    while True:
+        result = main.fetch_page(conn, req if keyset else req.model_copy(update={"page": page}))
+        rows += list(zip(result["rowids"], result["data"]))
+        if len(result["rowids"]) < req.page_size:
+            return rows
+        if keyset:
+            req = req.model_copy(update={"cursor": result["next_cursor"]})
+        page += 1
+
+
+@pytest.fixture
+def nullable_conn(tmp_path):
+    path = tmp_path / "nulls.sqlite"
+    setup = sqlite3.connect(path)
+    setup.execute('CREATE TABLE label_final (antibody TEXT, n_ab INTEGER, "all_grades%" REAL)')
+    # Repeated values and NULLs in every column, so ties and the NULL edge are crossed mid-page
+    setup.executemany("INSERT INTO label_final VALUES (?, ?, ?)", [
+        (["abamab", None, "bebumab", "abamab", None][i % 5], [None, 3, 3, 10][i % 4], [1.5, None, 0.25][i % 3])
+        for i in range(23)
+    ])
+    setup.commit()
+    setup.close()
+    conn = open_build(path, "nulls")
+    yield conn
+    conn.close()
+
+
+@pytest.mark.parametrize("sort_dir", ["asc", "desc"])
+@pytest.mark.parametrize("sort_by", [None, "antibody", "n_ab", "all_grades%"])
+def test_keyset_pages_match_offset_pages(nullable_conn, sort_by, sort_dir):
+    req = main.QueryRequest(table="label_final", columns=["*"], sort_by=sort_by, sort_dir=sort_dir,
+                            page_size=4, include_total=False)
+    offset = all_pages(nullable_conn, req, keyset=False)
+    assert len(offset) == 23
+    assert all_pages(nullable_conn, req, keyset=True) == offset
+
+
+@pytest.mark.parametrize("sort_dir", ["asc", "desc"])
+def test_keyset_pages_match_offset_pages_on_every_column(synthetic_conn, sort_dir):
+    for sort_by in main.table_columns(synthetic_conn, "ctgov_all"):
+        req = main.QueryRequest(table="ctgov_all", filters={"phase": ["Phase 2", "Phase 3"]}, sort_by=sort_by,
+                                sort_dir=sort_dir, page_size=250, include_total=False)
+        assert all_pages(synthetic_conn, req, keyset=True) == all_pages(synthetic_conn, req, keyset=False), sort_by
+
+
+def test_cursor_pages_have_no_page_number(nullable_conn):
+    req = main.QueryRequest(table="label_final", page=3, page_size=4)
+    first = main.fetch_page(nullable_conn, req)
+    assert first["page"] == 3
+    following = main.fetch_page(nullable_conn, req.model_copy(update={"cursor": first["next_cursor"]}))
+    assert following["page"] is None
@@ -0,0 +1,88 @@
+import sqlite3
+
+import numpy as np
+import pytest
+
+import main
+from db import PooledConnection
+from stats import mantel_haenszel_rr
+
+# (antibody, organ_system, events_ab, n_ab, events_comp, n_comp): three strata
+# for abamab/cardiac, one with no antibody-arm events
+RECORDS = [
+    ("abamab", "cardiac", 10, 100, 5, 100),
+    ("abamab", "cardiac", 4, 50, 2, 60),
+    ("abamab", "cardiac", 0, 30, 3, 30),
+    # No comparator events: RR undefined
+    ("abamab", "renal", 3, 40, 0, 40),
+    # No antibody events: RR is 0, the CI undefined
+    ("bobimab", "cardiac", 0, 20, 4, 20),
+    # Not a stratum: no comparator arm
+    ("bobimab", "renal", 2, 25, 1, 0),
+    ("bobimab", "renal", 6, 30, 3, 30),
+]
+
+# Worked by hand from the three abamab/cardiac strata:
+# R = 10*100/200 + 4*60/110 + 0 = 7.1818, S = 5*100/200 + 2*50/110 + 3*30/60 = 4.9091
+# P (Greenland-Robins) = 5.6649, SE(log RR) = sqrt(P / (R*S)) = 0.4006
+CARDIAC_RR, CARDIAC_LOWER, CARDIAC_UPPER = 1.462963, 0.666857, 3.209475
+
+
+@pytest.fixture
+def conn(tmp_path):
+    path = tmp_path / "rr.sqlite"
+    setup = sqlite3.connect(path)
+    setup.execute(
+        "CREATE TABLE ctgov_all (antibody TEXT, organ_system TEXT, "
+        "events_ab INTEGER, n_ab INTEGER, events_comp INTEGER, n_comp INTEGER)"
+    )
+    setup.executemany("INSERT INTO ctgov_all VALUES (?, ?, ?, ?, ?, ?)", RECORDS)
+    setup.commit()
+    setup.close()
+    conn = sqlite3.connect(path, factory=PooledConnection)
+    conn.row_factory = sqlite3.Row
+    conn.fingerprint = str(path)
+    return conn
+
+
+def test_mantel_haenszel_on_summed_strata():
+    strata = np.array([(10, 100, 5, 100), (4, 50, 2, 60), (0, 30, 3, 30)], dtype=np.float64)
+    a, n1, c, n2 = strata.T
+    total = n1 + n2
+    r = (a * n2 / total).sum()
+    s = (c * n1 / total).sum()
+    p = ((n1 * n2 * (a + c) - a * c * total) / total ** 2).sum()
+    rr, lower, upper = mantel_haenszel_rr([r], [s], [p])
+    assert rr[0] == pytest.approx(CARDIAC_RR, abs=1e-6)
+    assert lower[0] == pytest.approx(CARDIAC_LOWER, abs=1e-6)
+    assert upper[0] == pytest.approx(CARDIAC_UPPER, abs=1e-6)
+
+
+def test_zero_cells():
+    rr, lower, upper = mantel_haenszel_rr([1.5, 0.0, 0.0], [0.0, 2.0, 0.0], [0.7, 0.9, 0.0])
+    assert np.isnan(rr[0]) and np.isnan(lower[0]) and np.isnan(upper[0])
+    assert rr[1] == 0 and np.isnan(lower[1]) and np.isnan(upper[1])
+    assert np.isnan(rr[2])
+
+
+def test_rr_matrix_pools_strata_in_sql(conn):
+    result = main.compute_rr_matrix(conn, main.RRMatrixRequest())
+    assert result["antibodies"] == ["abamab", "bobimab"]
+    assert result["categories"] == ["cardiac", "renal"]
+    assert result["strata"] == [[3, 1], [1, 1]]
+    assert result["rr"] == [[round(CARDIAC_RR, 3), None], [0.0, 2.0]]
+    assert result["ci_lower"][0][0] == round(CARDIAC_LOWER, 3)
+    assert result["ci_upper"][0][0] == round(CARDIAC_UPPER, 3)
+    assert result["ci_lower"][1][0] is None
+
+    result = main.compute_rr_matrix(conn, main.RRMatrixRequest(min_strata=2))
+    assert result["rr"] == [[round(CARDIAC_RR, 3), None], [None, None]]
+
+
+def test_comparative_pools_the_same_strata(conn):
+    rr, lower, upper = main.pooled_relative_risk(
+        conn, "ctgov_all", '"organ_system"', ["cardiac", "renal", "hepatic"], " WHERE antibody = ?", ["abamab"]
+    )
+    assert rr == [round(CARDIAC_RR, 3), None, None]
+    assert lower == [round(CARDIAC_LOWER, 3), None, None]
+    assert upper == [round(CARDIAC_UPPER, 3), None, None]
@@ -13,12 +13,23 @@ export function fetchTables() {
   return request('/tables');
 }
 
-export function fetchFilterOptions(table) {
-  return request(`/filter-options?table=${table}`);
+export function fetchFilterOptions(table, { filters, search } = {}) {
+  const params = new URLSearchParams({ table });
+  // With the current selections, each value comes back with its facet counts
+  if (filters) params.set('filters', JSON.stringify(filters));
+  if (search) params.set('search', search);
+  return request(`/filter-options?${params}`);
+}
+
+// A columnar /query page ({ columns, rows }) as the { data } records shape
+export function toRecords({ columns, rows, ...page }) {
+  const data = rows.map(row => Object.fromEntries(columns.map((col, i) => [col, row[i]])));
+  return { data, ...page };
 }
 
-export function queryData({ table, filters, search, page, pageSize, sortBy, sortDir }) {
-  return request('/query', {
+export async function queryData({ table, filters, search, page, pageSize, sortBy, sortDir, cursor, includeTotal }) {
+  // Columnar pages send each column name once instead of once per row
+  const result = await request('/query', {
     method: 'POST',
     body: JSON.stringify({
       table,
@@ -28,8 +39,17 @@ export function queryData({ table, filters, search, page, pageSize, sortBy, sort
       page_size: pageSize || 50,
       sort_by: sortBy || null,
       sort_dir: sortDir || 'asc',
+      cursor: cursor || null,
+      include_total: includeTotal ?? true,
+      format: 'columnar',
     }),
   });
+  return toRecords(result);
+}
+
+// Every column of one row; rowids come with each query page
+export function fetchRecord(table, rowid) {
+  return request(`/record/${table}/${rowid}`);
 }
 
 export function fetchDistribution(table, column, filters, search) {
@@ -53,6 +73,21 @@ export function fetchAdverseEvents({ table, groupBy, filters, search, topN, grad
   });
 }
 
+// specs: [{ type: 'query' | 'distribution' | 'adverse-events' | ..., ...fields }]
+// sharing one table/filters/search; resolves to the results in spec order.
+export async function fetchBatch({ table, filters, search, specs }) {
+  const res = await request('/batch', {
+    method: 'POST',
+    body: JSON.stringify({
+      table,
+      filters: filters || {},
+      search: search || null,
+      specs,
+    }),
+  });
+  return res.results;
+}
+
 export function fetchComparative({ table, antibody, nctId, groupBy, filters, topN }) {
   return request('/chart/comparative', {
     method: 'POST',
@@ -67,12 +102,21 @@ export function fetchComparative({ table, antibody, nctId, groupBy, filters, top
   });
 }
 
+export function searchValues(q, { table, fields, limit } = {}) {
+  const params = new URLSearchParams({ q });
+  if (table) params.set('table', table);
+  if (fields) params.set('fields', fields.join(','));
+  if (limit) params.set('limit', limit);
+  return request(`/search?${params}`);
+}
+
 export function fetchStudies(table, antibody) {
   return request(`/studies?table=${table}&antibody=${encodeURIComponent(antibody)}`);
 }
 
-export function getExportUrl(table, filters, search) {
+export function getExportUrl(table, filters, search, format) {
   const params = new URLSearchParams({ table });
+  if (format) params.set('format', format);
   if (filters && Object.keys(filters).length) params.set('filters', JSON.stringify(filters));
   if (search) params.set('search', search);
   return `${BASE}/export?${params}`;
@@ -90,7 +134,7 @@ export function fetchCrossDataset({ antibody, groupBy, filters, topN }) {
   });
 }
 
-export function fetchTargetAggregation({ table, target, groupBy, filters, topN }) {
+export function fetchTargetAggregation({ table, target, groupBy, filters, topN, topK }) {
   return request('/chart/target-aggregation', {
     method: 'POST',
     body: JSON.stringify({
@@ -99,6 +143,22 @@ export function fetchTargetAggregation({ table, target, groupBy, filters, topN }
       group_by: groupBy || 'organ_system',
       filters: filters || {},
       top_n: topN || 15,
+      top_k: topK ?? null,
+    }),
+  });
+}
+
+export function fetchTargetAntibodies({ table, target, groupBy, category, filters, page, pageSize }) {
+  return request('/chart/target-aggregation/antibodies', {
+    method: 'POST',
+    body: JSON.stringify({
+      table,
+      target,
+      group_by: groupBy || 'organ_system',
+      category,
+      filters: filters || {},
+      page: page || 1,
+      page_size: pageSize || 50,
     }),
   });
 }
@@ -1,5 +1,6 @@
+import { Fragment, useEffect, useState } from 'react';
 import { useFilter } from '../context/FilterContext';
-import { getExportUrl } from '../api';
+import { fetchRecord, getExportUrl } from '../api';
 
 const PRIORITY_COLS = [
   'antibody', 'condition', 'organ_system', 'adverse_event_term', 
@@ -12,7 +13,29 @@ const PRIORITY_COLS = [
 
 export default function DataTable() {
   const { table, filters, search, results, loading, applyFilters, sortBy, sortDir } = useFilter();
-  const { data, total, page, page_size } = results;
+  const { data, rowids, total, page, page_size } = results;
+  // The page holds summary columns; a clicked row loads its full record
+  const [expanded, setExpanded] = useState(null);
+  const [record, setRecord] = useState(null);
+
+  useEffect(() => {
+    setExpanded(null);
+    setRecord(null);
+  }, [results]);
+
+  async function toggleRecord(rowid) {
+    if (expanded === rowid) {
+      setExpanded(null);
+      return;
+    }
+    setExpanded(rowid);
+    setRecord(null);
+    try {
+      setRecord(await fetchRecord(table, rowid));
+    } catch {
+      setRecord({});
+    }
+  }
 
   if (loading && data.length === 0) {
     return (
@@ -103,13 +126,38 @@ export default function DataTable() {
           </thead>
           <tbody className="divide-y divide-slate-100/80">
             {data.map((row, i) => (
-              <tr key={i} className="hover:bg-indigo-50/30 transition-colors duration-150">
-                {orderedCols.map(col => (
-                  <td key={col} className="px-4 py-2.5 text-slate-600 whitespace-nowrap max-w-[200px] truncate font-mono text-xs">
-                    {row[col] == null ? <span className="text-slate-300 font-sans italic">null</span> : String(row[col])}
-                  </td>
-                ))}
-              </tr>
+              <Fragment key={rowids ? rowids[i] : i}>
+                <tr
+                  onClick={() => rowids && toggleRecord(rowids[i])}
+                  className="hover:bg-indigo-50/30 transition-colors duration-150 cursor-pointer"
+                >
+                  {orderedCols.map(col => (
+                    <td key={col} className="px-4 py-2.5 text-slate-600 whitespace-nowrap max-w-[200px] truncate font-mono text-xs">
+                      {row[col] == null ? <span className="text-slate-300 font-sans italic">null</span> : String(row[col])}
+                    </td>
+                  ))}
+                </tr>
+                {rowids && expanded === rowids[i] && (
+                  <tr className="bg-slate-50/60">
+                    <td colSpan={orderedCols.length} className="px-6 py-4">
+                      {record ? (
+                        <dl className="grid grid-cols-2 lg:grid-cols-3 gap-x-6 gap-y-2 text-xs">
+                          {Object.entries(record).map(([col, value]) => (
+                            <div key={col} className="min-w-0">
+                              <dt className="text-[10px] font-bold text-slate-400 uppercase tracking-wider">{col.replace(/_/g, ' ')}</dt>
+                              <dd className="text-slate-600 font-mono whitespace-pre-wrap break-words">
+                                {value == null ? <span className="text-slate-300 font-sans italic">null</span> : String(value)}
+                              </dd>
+                            </div>
+                          ))}
+                        </dl>
+                      ) : (
+                        <div className="h-4 bg-slate-200/60 rounded-full w-48 animate-pulse" />
+                      )}
+                    </td>
+                  </tr>
+                )}
+              </Fragment>
             ))}
           </tbody>
         </table>
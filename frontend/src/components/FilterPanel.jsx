@@ -37,8 +37,14 @@ const selectStyles = {
 };
 
 function FilterSelect({ label, column, icon }) {
-  const { filters, setFilters, filterOptions } = useFilter();
-  const options = (filterOptions[column] || []).map(v => ({ value: v, label: String(v) }));
+  const { filters, setFilters, filterOptions, facetCounts } = useFilter();
+  const counts = facetCounts[column];
+  const options = (filterOptions[column] || []).map(v => {
+    const count = counts?.[String(v)];
+    return count
+      ? { value: v, label: `${v} (${count.rows.toLocaleString()})`, empty: count.rows === 0 }
+      : { value: v, label: String(v) };
+  });
   const selected = (filters[column] || []).map(v => ({ value: v, label: String(v) }));
 
   function handleChange(vals) {
@@ -66,6 +72,7 @@ function FilterSelect({ label, column, icon }) {
         options={options}
         value={selected}
         onChange={handleChange}
+        isOptionDisabled={o => o.empty}
         styles={selectStyles}
         placeholder={`All ${label.toLowerCase()}...`}
         maxMenuHeight={200}
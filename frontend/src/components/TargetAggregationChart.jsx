@@ -176,9 +176,9 @@ export default function TargetAggregationChart() {
                           <span className="ml-1 text-cyan-600 font-medium">{ab.proportion}%</span>
                         </span>
                       ))}
-                      {d.antibodies.length > 8 && (
+                      {d.count > 8 && (
                         <span className="inline-flex items-center px-2 py-0.5 rounded text-xs bg-slate-100 text-slate-500">
-                          +{d.antibodies.length - 8} more
+                          +{d.count - 8} more
                         </span>
                       )}
                     </div>
@@ -1,5 +1,5 @@
-import { createContext, useContext, useReducer, useCallback } from 'react';
-import { fetchFilterOptions, queryData, fetchDistribution, fetchAdverseEvents } from '../api';
+import { createContext, useContext, useReducer, useCallback, useEffect } from 'react';
+import { fetchFilterOptions, fetchBatch, toRecords } from '../api';
 
 const FilterContext = createContext(null);
 
@@ -23,6 +23,7 @@ const initialState = {
   filters: {},
   search: '',
   filterOptions: {},
+  facetCounts: {},
   results: { data: [], total: 0, page: 1, page_size: 50 },
   distributions: [{}, {}, {}, {}],
   aeData: { categories: [], proportions: [], counts: [] },
@@ -35,10 +36,11 @@ const initialState = {
 
 function reducer(state, action) {
   switch (action.type) {
-    case 'SET_TABLE': return { ...state, table: action.payload, filters: {}, search: '', results: initialState.results, distributions: initialState.distributions, aeData: initialState.aeData };
+    case 'SET_TABLE': return { ...state, table: action.payload, filters: {}, search: '', facetCounts: {}, results: initialState.results, distributions: initialState.distributions, aeData: initialState.aeData };
     case 'SET_FILTERS': return { ...state, filters: action.payload };
     case 'SET_SEARCH': return { ...state, search: action.payload };
     case 'SET_FILTER_OPTIONS': return { ...state, filterOptions: action.payload, optionsLoading: false };
+    case 'SET_FACET_COUNTS': return { ...state, facetCounts: action.payload };
     case 'SET_RESULTS': return { ...state, results: action.payload, loading: false };
     case 'SET_DISTRIBUTIONS': return { ...state, distributions: action.payload };
     case 'SET_AE_DATA': return { ...state, aeData: action.payload };
@@ -64,20 +66,44 @@ export function FilterProvider({ children }) {
     }
   }, []);
 
+  // Per-value counts under the other active filters, so the panel can show
+  // how many rows each choice leaves and grey out the ones that leave none
+  useEffect(() => {
+    let stale = false;
+    const timer = setTimeout(async () => {
+      try {
+        const data = await fetchFilterOptions(state.table, { filters: state.filters, search: state.search });
+        if (stale) return;
+        const counts = {};
+        for (const [column, values] of Object.entries(data)) {
+          counts[column] = Object.fromEntries(values.map(v => [String(v.value), v]));
+        }
+        dispatch({ type: 'SET_FACET_COUNTS', payload: counts });
+      } catch {
+        // Counts are a hint; the plain options still work without them
+      }
+    }, 250);
+    return () => { stale = true; clearTimeout(timer); };
+  }, [state.table, state.filters, state.search]);
+
   const applyFilters = useCallback(async (page = 1, sortBy = state.sortBy, sortDir = state.sortDir) => {
     dispatch({ type: 'SET_LOADING', payload: true });
     try {
-      const [results, ...dists] = await Promise.all([
-        queryData({ table: state.table, filters: state.filters, search: state.search, page, pageSize: 50, sortBy, sortDir }),
-        ...DISTRIBUTION_CHARTS.map(c => fetchDistribution(state.table, c.column, state.filters, state.search).catch(() => ({ labels: [], values: [] }))),
-      ]);
-      dispatch({ type: 'SET_RESULTS', payload: results });
-      dispatch({ type: 'SET_DISTRIBUTIONS', payload: dists });
+      const [results, ae, ...dists] = await fetchBatch({
+        table: state.table,
+        filters: state.filters,
+        search: state.search,
+        specs: [
+          { type: 'query', page, page_size: 50, sort_by: sortBy || null, sort_dir: sortDir || 'asc', format: 'columnar' },
+          { type: 'adverse-events', group_by: 'organ_system' },
+          ...DISTRIBUTION_CHARTS.map(c => ({ type: 'distribution', column: c.column })),
+        ],
+      });
+      if (results.error) throw new Error(results.error);
+      dispatch({ type: 'SET_RESULTS', payload: toRecords(results) });
+      dispatch({ type: 'SET_DISTRIBUTIONS', payload: dists.map(d => (d.error ? { labels: [], values: [] } : d)) });
       dispatch({ type: 'SET_SORT', payload: { sortBy, sortDir } });
-
-      fetchAdverseEvents({ table: state.table, groupBy: 'organ_system', filters: state.filters, search: state.search })
-        .then(ae => dispatch({ type: 'SET_AE_DATA', payload: ae }))
-        .catch(() => {});
+      if (!ae.error) dispatch({ type: 'SET_AE_DATA', payload: ae });
     } catch (e) {
       dispatch({ type: 'SET_ERROR', payload: e.message });
     }